@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Cost per horizon step of abstract.feasible.solve_closed_loop
+
+Compares solve_closed_loop with the previous loop,
+which reduced the union twice in each step and
+always checked the convexity of the union.
+Uses the dynamics of examples/robot_planning/continuous.py.
+
+usage: python closed_loop_benchmark.py [max_N]
+"""
+import sys
+import time
+
+import numpy as np
+import polytope as pc
+
+from tulip import hybrid
+from tulip.abstract.feasible import solve_open_loop, solve_closed_loop
+
+def previous_closed_loop(P1, P2, ssys, N, trans_set=None):
+    """solve_closed_loop before the union was memoized."""
+    p1 = P1
+    p2 = P2
+
+    if trans_set is not None:
+        Pinit = trans_set
+    else:
+        Pinit = p1
+
+    s0 = pc.Region()
+    for i in xrange(N, 0, -1):
+        if i == 1:
+            Pinit = p1
+
+        p2 = solve_open_loop(Pinit, p2, ssys, 1, trans_set)
+        s0 = s0.union(p2, check_convex=True)
+        s0 = pc.reduce(s0)
+
+        if not pc.is_fulldim(p2):
+            break
+
+        if p1.intersect(p2):
+            s0 = s0.union(p2, check_convex=True)
+            s0 = pc.reduce(s0)
+
+    if not pc.is_fulldim(s0):
+        return pc.Polytope()
+
+    return pc.reduce(s0)
+
+def robot_planning():
+    cont_state_space = pc.box2poly([[0., 3.], [0., 2.]])
+
+    A = np.eye(2)
+    B = 0.1 * np.eye(2)
+    E = np.eye(2)
+
+    U = pc.box2poly([[-1., 1.], [-1., 1.]])
+    W = pc.box2poly([[-0.01, 0.01], [-0.01, 0.01]])
+
+    return hybrid.LtiSysDyn(A, B, E, None, U, W, cont_state_space)
+
+def time_it(f, repeat=3):
+    best = None
+    for k in xrange(repeat):
+        start = time.time()
+        result = f()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        max_N = int(sys.argv[1])
+    else:
+        max_N = 8
+
+    ssys = robot_planning()
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    p2 = pc.box2poly([[1., 2.], [0., 1.]])
+    trans_set = pc.box2poly([[0., 2.], [0., 1.]])
+
+    print('{0:>3} {1:>12} {2:>12} {3:>8}'.format(
+        'N', 'before/step', 'after/step', 'same'))
+    for N in xrange(1, max_N + 1):
+        t0, s0 = time_it(
+            lambda: previous_closed_loop(p1, p2, ssys, N, trans_set)
+        )
+        t1, s1 = time_it(
+            lambda: solve_closed_loop(p1, p2, ssys, N, trans_set=trans_set)
+        )
+
+        if pc.is_fulldim(s0):
+            same = s0 <= s1 and s1 <= s0
+        else:
+            same = not pc.is_fulldim(s1)
+
+        print('{0:3d} {1:12.4f} {2:12.4f} {3:>8}'.format(
+            N, t0 / N, t1 / N, str(same)))
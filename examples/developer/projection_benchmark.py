@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Compare the projection strategies of abstract.feasible.poly_to_poly
+
+Times each strategy on the cell pairs of a grid over the state space,
+for the dynamics of the robot_planning and fuel_tank examples,
+and checks that all strategies compute the same set.
+
+usage: python projection_benchmark.py [max_N]
+"""
+import sys
+import time
+
+import numpy as np
+import polytope as pc
+
+from tulip import hybrid
+from tulip.abstract.feasible import poly_to_poly, select_projection
+
+strategies = [None, 'fm', 'esp', 'vertex', 'iterhull', 'preimage', 'auto']
+
+def robot_planning():
+    """Dynamics of examples/robot_planning/continuous.py"""
+    cont_state_space = pc.box2poly([[0., 3.], [0., 2.]])
+
+    A = np.eye(2)
+    B = 0.1 * np.eye(2)
+    E = np.eye(2)
+
+    U = pc.box2poly([[-1., 1.], [-1., 1.]])
+    W = pc.box2poly([[-0.01, 0.01], [-0.01, 0.01]])
+
+    sys_dyn = hybrid.LtiSysDyn(A, B, E, None, U, W, cont_state_space)
+    return sys_dyn, cont_state_space
+
+def fuel_tank():
+    """Normal mode of examples/developer/fuel_tank/double_tank.py
+
+    The input set only constrains the input,
+    so that all strategies apply.
+    """
+    cont_state_space = pc.box2poly([[0., 10.], [0., 10.]])
+
+    A = np.eye(2)
+    B = np.array([[-1.], [1.]])
+    E = np.array([[0.], [1.]])
+    K = np.array([[0.], [-1.]])
+
+    U = pc.box2poly([[0., 3.]])
+    W = pc.box2poly([[-0.1, 0.1]])
+
+    sys_dyn = hybrid.LtiSysDyn(A, B, E, K, U, W, cont_state_space)
+    return sys_dyn, cont_state_space
+
+def cell_pairs(domain, cells_per_dim=3):
+    """Return pairs of neighboring cells of a grid over domain."""
+    bbox = pc.bounding_box(domain)
+    lo = bbox[0].flatten()
+    hi = bbox[1].flatten()
+    step = (hi - lo) / cells_per_dim
+
+    cells = dict()
+    for i in xrange(cells_per_dim):
+        for j in xrange(cells_per_dim):
+            x = lo + step * np.array([i, j])
+            cells[(i, j)] = pc.box2poly([
+                [x[0], x[0] + step[0]],
+                [x[1], x[1] + step[1]]
+            ])
+
+    pairs = []
+    for (i, j), p1 in cells.iteritems():
+        for di, dj in [(0, 0), (1, 0), (0, 1), (-1, 0), (0, -1)]:
+            key = (i + di, j + dj)
+            if key in cells:
+                pairs.append((p1, cells[key]))
+    return pairs
+
+def same_set(s1, s2):
+    if not pc.is_fulldim(s1):
+        return not pc.is_fulldim(s2)
+    return s1 <= s2 and s2 <= s1
+
+def benchmark(name, ssys, domain, max_N):
+    pairs = cell_pairs(domain)
+    print(name + ': ' + str(len(pairs)) + ' cell pairs')
+
+    for N in xrange(1, max_N + 1):
+        print('  N = ' + str(N) +
+              ', auto selects: ' + str(select_projection(ssys, N)))
+
+        reference = [poly_to_poly(p1, p2, ssys, N) for p1, p2 in pairs]
+        for strategy in strategies:
+            if strategy == 'preimage' and N != 1:
+                continue
+
+            mismatch = 0
+            start = time.time()
+            try:
+                result = [
+                    poly_to_poly(p1, p2, ssys, N, projection=strategy)
+                    for p1, p2 in pairs
+                ]
+            except Exception, e:
+                print('    {0:>10}: failed ({1})'.format(str(strategy), e))
+                continue
+            elapsed = time.time() - start
+
+            for s0, s in zip(reference, result):
+                if not same_set(s0, s):
+                    mismatch += 1
+
+            print('    {0:>10}: {1:8.3f} sec, {2} mismatches'.format(
+                str(strategy), elapsed, mismatch))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        max_N = int(sys.argv[1])
+    else:
+        max_N = 3
+
+    benchmark('robot_planning', *robot_planning(), max_N=max_N)
+    benchmark('fuel_tank', *fuel_tank(), max_N=max_N)
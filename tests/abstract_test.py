@@ -7,9 +7,18 @@ logger = logging.getLogger(__name__)
 #logging.getLogger('tulip').setLevel(logging.ERROR)
 logger.setLevel(logging.DEBUG)
 
+import os
+import shutil
+import tempfile
+import json
+import multiprocessing
+from StringIO import StringIO
+
 import numpy as np
 
 from tulip import abstract, hybrid
+from tulip.abstract import discretization
+from tulip.abstract.telemetry import JsonLinesWriter
 import polytope as pc
 
 input_bound = 0.4
@@ -213,6 +222,307 @@ def test_abstract_the_dynamics():
 
 test_abstract_the_dynamics.slow = True
 
+def test_parallel_discretize():
+    """speculative parallel checks yield the serial abstraction"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    cont_props['lot'] = pc.box2poly([[2., 3.], [1., 2.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    sys = subsys0()
+    
+    serial = abstract.discretize(ppp, sys, N=3)
+    parallel = abstract.discretize(ppp, sys, N=3, n_jobs=2)
+    
+    assert(len(parallel.ppp) == len(serial.ppp) )
+    assert(set(parallel.ts.transitions() ) ==
+           set(serial.ts.transitions() ) )
+    for r, s in zip(parallel.ppp.regions, serial.ppp.regions):
+        assert(r == s)
+
+def test_parallel_discretize_cleanup():
+    """the process pool is closed when the loop raises"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    def callback(event):
+        raise RuntimeError('stop')
+    
+    try:
+        abstract.discretize(ppp, subsys0(), N=1, n_jobs=2,
+                            callback=callback)
+        raise AssertionError('expected RuntimeError')
+    except RuntimeError:
+        pass
+    assert(not multiprocessing.active_children() )
+
+def test_parallel_discretize_switched():
+    """the process pool yields the serial switched abstraction"""
+    modes = [('normal', 'fly'), ('refuel', 'fly')]
+    env_modes, sys_modes = zip(*modes)
+    
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    pwa_sys = dict()
+    pwa_sys[('normal', 'fly')] = hybrid.PwaSysDyn([subsys0()], dom)
+    pwa_sys[('refuel', 'fly')] = hybrid.PwaSysDyn([subsys1()], dom)
+    
+    switched_dynamics = hybrid.SwitchedSysDyn(
+        disc_domain_size=(len(env_modes), len(sys_modes)),
+        dynamics=pwa_sys,
+        env_labels=env_modes,
+        disc_sys_labels=sys_modes,
+        cts_ss=dom
+    )
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    cont_props['lot'] = pc.box2poly([[2., 3.], [1., 2.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    disc_params = {}
+    for mode in modes:
+        disc_params[mode] = {'N':2, 'trans_length':1}
+    
+    serial = abstract.discretize_switched(
+        ppp, switched_dynamics, disc_params
+    )
+    parallel = abstract.multiproc_discretize_switched(
+        ppp, switched_dynamics, disc_params,
+        n_jobs=2, chunk_size=1
+    )
+    
+    assert(len(parallel.ppp) == len(serial.ppp) )
+    assert(set(parallel.ts.transitions() ) ==
+           set(serial.ts.transitions() ) )
+
+def test_multiproc_merge_partitions():
+    """the tree reduction yields the regions of the serial merge"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    cont_props['lot'] = pc.box2poly([[2., 3.], [1., 2.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    abstractions = {
+        'a':abstract.discretize(ppp, subsys0(), N=1),
+        'b':abstract.discretize(ppp, subsys1(), N=1)
+    }
+    
+    serial, ap_labeling = discretization.merge_partitions(abstractions)
+    parallel, ap_labeling = discretization.multiproc_merge_partitions(
+        abstractions, n_jobs=2, chunk_size=1
+    )
+    
+    def parent_pairs(ab):
+        return {(ab.ppp2modes['a'][i], ab.ppp2modes['b'][i])
+                for i in xrange(len(ab.ppp) )}
+    
+    def adjacent_pairs(ab):
+        i, j = ab.ppp.adj.nonzero()
+        return {(ab.ppp2modes['a'][k], ab.ppp2modes['b'][k],
+                 ab.ppp2modes['a'][l], ab.ppp2modes['b'][l])
+                for k, l in zip(i, j)}
+    
+    assert(len(parallel.ppp) == len(serial.ppp) )
+    assert(parent_pairs(parallel) == parent_pairs(serial) )
+    assert(adjacent_pairs(parallel) == adjacent_pairs(serial) )
+
+def test_get_transitions_checked():
+    """transitions checked over the merged partition, not inferred"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    cont_props['lot'] = pc.box2poly([[2., 3.], [1., 2.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    abstractions = {
+        'a':abstract.discretize(ppp, subsys0(), N=1),
+        'b':abstract.discretize(ppp, subsys1(), N=1)
+    }
+    merged, ap_labeling = discretization.merge_partitions(abstractions)
+    
+    # N differs from that of the mode abstraction,
+    # so no pair is inferred from the parent regions
+    targets = discretization._transition_targets(merged.ppp, 1)
+    inferred, sources = discretization._infer_transitions(
+        merged, 'a', targets, 2, True, 1
+    )
+    assert(not inferred)
+    
+    trans = discretization.get_transitions(merged, 'a', subsys0(), N=2)
+    for i in targets:
+        for j in targets[i]:
+            expected = abstract.is_feasible(
+                merged.ppp[i], merged.ppp[j], subsys0(), 2,
+                trans_set=merged.ppp2pwa('a', i)[1]
+            )
+            assert(bool(trans[i, j]) == expected)
+
+def test_translation_templates():
+    """S0 of translated boxes equals S0 solved for each pair"""
+    ssys = subsys0()
+    templates = discretization._TranslationTemplates()
+    
+    boxes = [pc.box2poly([[0.5 * k, 0.5 * (k + 1)], [0., 0.5]])
+             for k in xrange(5)]
+    for N in (1, 2):
+        for si, sj in zip(boxes[:-1], boxes[1:]):
+            S0 = templates.solve(si, sj, ssys, None, N, True,
+                                 False, None, 5)
+            expected = abstract.solve_feasible(si, sj, ssys, N)
+            
+            if pc.is_fulldim(expected):
+                assert(S0 <= expected and expected <= S0)
+            else:
+                assert(not pc.is_fulldim(S0) )
+    assert(templates.hits == 6)
+    
+    # discretize passes its tolerance
+    reach = discretization._PairEvaluator(
+        1, boxes, ssys, None, None, None, 1, True, False, 5,
+        abs_tol=1e-4
+    )
+    assert(reach._args[-1].abs_tol == 1e-4)
+
+def test_discretize_resume():
+    """resuming from a checkpoint yields the uninterrupted abstraction"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    sys = subsys0()
+    
+    tmpdir = tempfile.mkdtemp()
+    ckpt = os.path.join(tmpdir, 'run.ckpt')
+    early = os.path.join(tmpdir, 'early.ckpt')
+    
+    # keep a copy of the state after 3 iterations
+    save = discretization._save_checkpoint
+    def save_copy(fname, params, state):
+        save(fname, params, state)
+        if state['iter_count'] == 3:
+            shutil.copy(fname, early)
+    
+    discretization._save_checkpoint = save_copy
+    try:
+        full = abstract.discretize(ppp, sys, N=3, checkpoint=ckpt,
+                                   checkpoint_every=1)
+    finally:
+        discretization._save_checkpoint = save
+    
+    resumed = abstract.discretize(ppp, sys, N=3, resume_from=early)
+    
+    assert(len(resumed.ppp) == len(full.ppp) )
+    assert(set(resumed.ts.transitions() ) ==
+           set(full.ts.transitions() ) )
+    
+    # different parameters are rejected
+    try:
+        abstract.discretize(ppp, sys, N=2, resume_from=ckpt)
+        raise AssertionError('expected ValueError')
+    except ValueError:
+        pass
+    
+    shutil.rmtree(tmpdir)
+
+def test_discretize_events():
+    """one event per checked pair, totals in stats"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    f = StringIO()
+    ab = abstract.discretize(ppp, subsys0(), N=3,
+                             callback=JsonLinesWriter(f) )
+    
+    events = [json.loads(line) for line in f.getvalue().splitlines()]
+    stats = ab.stats
+    
+    assert(len(events) == stats.n_iterations)
+    assert([e['iteration'] for e in events] == range(len(events) ) )
+    assert(sum(stats.outcomes.itervalues() ) == len(events) )
+    # each split adds at least one cell
+    assert(stats.outcomes['split'] <=
+           len(ab.ppp) - len(ppp) )
+    assert(events[-1]['n_pending'] == 0)
+    assert(events[-1]['n_cells'] == len(ab.ppp) )
+    assert(set(events[0]['times']) ==
+           {'solve_feasible', 'intersect', 'diff', 'volume', 'cheby_ball'})
+
+def test_discretize_budget():
+    """budgeted abstraction is sound and can be continued"""
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    
+    cont_props = {}
+    cont_props['home'] = pc.box2poly([[0., 1.], [0., 1.]])
+    
+    ppp = abstract.prop2part(dom, cont_props)
+    ppp, new2old = abstract.part2convex(ppp)
+    
+    sys = subsys0()
+    
+    # no time: nothing checked
+    ab = abstract.discretize(ppp, sys, N=1, time_budget=0)
+    assert(len(ab.ppp) == len(ppp) )
+    assert(len(ab.ts.transitions() ) == 0)
+    assert(len(ab.unverified) == ppp.adj.nnz)
+    
+    # with N = 1 the partition is refined
+    full = abstract.discretize(ppp, sys, N=1)
+    assert(len(full.ppp) > len(ppp) + 1)
+    
+    tmpdir = tempfile.mkdtemp()
+    ckpt = os.path.join(tmpdir, 'run.ckpt')
+    
+    n = len(ppp) + 1
+    partial = abstract.discretize(ppp, sys, N=1, max_cells=n,
+                                  checkpoint=ckpt)
+    # stops at the first split that reaches max_cells
+    assert(n <= len(partial.ppp) < len(full.ppp) )
+    assert(len(partial.ppp) - n <= 1)
+    assert(partial.unverified)
+    
+    # unverified pairs have no transition
+    trans = set(partial.ts.transitions() )
+    for i, j in partial.unverified:
+        si = partial.ppp2ts[i]
+        sj = partial.ppp2ts[j]
+        assert((si, sj) not in trans)
+    
+    resumed = abstract.discretize(ppp, sys, N=1, resume_from=ckpt)
+    
+    assert(not resumed.unverified)
+    assert(len(resumed.ppp) == len(full.ppp) )
+    assert(set(resumed.ts.transitions() ) ==
+           set(full.ts.transitions() ) )
+    
+    shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     test_abstract_the_dynamics()
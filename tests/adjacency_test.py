@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.adjacency
+"""
+import numpy as np
+from scipy import sparse as sp
+import polytope as pc
+
+from tulip.abstract.adjacency import (
+    SetMatrix, KHopNeighbors, BoxIndex, compose
+)
+from tulip.abstract.discretization import reachable_within
+
+def set_matrix_test():
+    A = np.array([[1, 1, 0],
+                  [1, 1, 0],
+                  [0, 0, 1]])
+    M = SetMatrix.from_sparse(sp.lil_matrix(A) )
+
+    assert(M.shape == (3, 3) )
+    assert(M.nnz == 5)
+    assert(M[0, 1] == 1)
+    assert(M[0, 2] == 0)
+    assert(M.row(0) == {0, 1})
+    assert(M.col(2) == {2})
+    assert(np.all(M.todense() == A) )
+
+    M.grow(2)
+    M[4, 0] = 1
+    assert(M.shape == (5, 5) )
+    assert(M.col(0) == {0, 1, 4})
+
+    M.clear_row(0)
+    assert(M.row(0) == set() )
+    assert(M.col(1) == {1})
+    assert(0 not in M.col(0) )
+
+    M.clear_col(0)
+    assert(M.row(4) == set() )
+
+    assert(M.T[1, 0] == 0)
+    assert(M.T.tolil().shape == (5, 5) )
+
+def compose_test():
+    """nonzero pattern equals that of dense matrix powers"""
+    A = np.array([[1, 1, 0, 0],
+                  [1, 1, 1, 0],
+                  [0, 1, 1, 1],
+                  [0, 0, 1, 1]])
+    M = SetMatrix.from_sparse(A)
+
+    assert(np.all(compose(M, M).todense() == (A.dot(A) > 0) ) )
+
+    for k in xrange(1, 4):
+        dense = reachable_within(k, A, A)
+        sparse = reachable_within(k, M, M)
+        assert(np.all(sparse.todense() == dense) )
+
+def k_hop_neighbors_test():
+    """cached neighborhoods match matrix powers after refinement"""
+    A = np.eye(6, dtype=int)
+    for i in xrange(5):
+        A[i, i + 1] = A[i + 1, i] = 1
+    adj = SetMatrix.from_sparse(A)
+
+    for k in xrange(1, 4):
+        adj_k = KHopNeighbors(adj.copy(), k)
+        dense = reachable_within(k, A, A)
+        assert(adj_k.row(2) == set(np.nonzero(dense[2, :])[0]) )
+        assert(adj_k.col(0) == set(np.nonzero(dense[:, 0])[0]) )
+
+    # split cell 5 of the path into 5 and new cell 6,
+    # both adjacent to 4
+    adj_k = KHopNeighbors(adj, 2)
+    before = [set(adj_k.row(v)) for v in xrange(6)]
+    assert(6 not in before[3])
+
+    adj_k.invalidate([5])
+    adj.grow(1)
+    for u, v in [(6, 6), (4, 6), (5, 6)]:
+        adj.add(u, v)
+        adj.add(v, u)
+    adj_k.invalidate([5, 6])
+
+    B = adj.todense()
+    dense = reachable_within(2, B, B)
+    for v in xrange(7):
+        assert(adj_k.row(v) == set(np.nonzero(dense[v, :])[0]) )
+        assert(adj_k.col(v) == set(np.nonzero(dense[:, v])[0]) )
+    assert(6 in adj_k.row(3) )
+
+def box_index_test():
+    """boxes of adjacent cells intersect, of distant cells do not"""
+    regions = [pc.box2poly([[0., 1.], [0., 1.]]),
+               pc.box2poly([[1., 2.], [0., 1.]]),
+               pc.box2poly([[3., 4.], [0., 1.]])]
+    boxes = BoxIndex(regions)
+
+    assert(len(boxes) == 3)
+    assert(boxes.intersect(0, 1) )
+    assert(not boxes.intersect(0, 2) )
+    assert(boxes.overlapping(1) == {0, 1})
+    assert(boxes.pairs() == [(1, 0)])
+
+    # refine cell 1 and add a piece next to cell 2
+    boxes.update(1, pc.box2poly([[1., 1.5], [0., 1.]]) )
+    k = boxes.append(pc.box2poly([[1.5, 3.], [0., 1.]]) )
+    assert(k == 3)
+    assert(boxes.overlapping(3) == {1, 2, 3})
+    assert(boxes.overlapping(3, among=[0, 2]) == {2})
+
+    # empty cells intersect nothing
+    k = boxes.append(pc.Region([]) )
+    assert(boxes.overlapping(k) == set() )
+    assert(sorted(boxes.pairs() ) == [(1, 0), (3, 1), (3, 2)])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.cache
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import polytope as pc
+
+from tulip import hybrid
+from tulip.abstract import feasible
+from tulip.abstract.cache import ReachCache, LOW_WATER
+
+def robot():
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    U = pc.box2poly([[-1., 1.], [-1., 1.]])
+    return hybrid.LtiSysDyn(np.eye(2), 0.1 * np.eye(2), Uset=U, domain=dom)
+
+def key_test():
+    """keys depend on values, not on objects"""
+    path = tempfile.mkdtemp()
+    try:
+        cache = ReachCache(path)
+        p1 = pc.box2poly([[0., 1.], [0., 1.]])
+        p2 = pc.box2poly([[1., 2.], [0., 1.]])
+
+        k1 = cache.key('S0', robot(), p1, p2, None, 1, True, False, 5)
+        k2 = cache.key('S0', robot(), pc.Polytope(p1.A, p1.b), p2,
+                       None, 1, True, False, 5)
+        k3 = cache.key('S0', robot(), p1, p2, None, 2, True, False, 5)
+        k4 = cache.key('S0', robot(), p2, p1, None, 1, True, False, 5)
+        assert(k1 == k2)
+        assert(k1 != k3)
+        assert(k1 != k4)
+    finally:
+        shutil.rmtree(path)
+
+def put_get_test():
+    path = tempfile.mkdtemp()
+    try:
+        cache = ReachCache(path)
+        p = pc.box2poly([[0., 1.], [0., 2.]])
+        r = pc.Region([p, pc.box2poly([[1., 2.], [0., 1.]])])
+
+        assert(cache.get('p') is None)
+        cache.put('p', p)
+        cache.put('r', r)
+        cache.put('b', False)
+        cache.put('e', pc.Polytope())
+
+        q = cache.get('p')
+        assert(q <= p and p <= q)
+        s = cache.get('r')
+        assert(len(s) == 2)
+        assert(s <= r and r <= s)
+        assert(cache.get('b') is False)
+        assert(not pc.is_fulldim(cache.get('e') ))
+        assert(cache.hits == 4)
+        assert(cache.misses == 1)
+
+        # another process sees the same results
+        other = ReachCache(path)
+        assert(other.get('b') is False)
+    finally:
+        shutil.rmtree(path)
+
+def eviction_test():
+    """least recently used results are removed first"""
+    path = tempfile.mkdtemp()
+    try:
+        cache = ReachCache(path)
+        for k in xrange(3):
+            cache.put(str(k), pc.box2poly([[0., k + 1.], [0., 1.]]) )
+            os.utime(cache._fname(str(k) ), (k, k) )
+        size = os.path.getsize(cache._fname('0') )
+
+        # two files fit below the low-water mark
+        cache.max_bytes = int(2 * size / LOW_WATER) + 1
+        cache.evict()
+        assert(cache.get('0') is None)
+        assert(cache.get('1') is not None)
+        assert(cache.get('2') is not None)
+
+        # a put that overflows evicts below the low-water mark
+        cache.max_bytes = int(2.1 * size)
+        cache.put('3', pc.box2poly([[0., 4.], [0., 1.]]) )
+        assert(cache._size <= LOW_WATER * cache.max_bytes)
+        assert(cache.get('1') is None)
+        assert(cache.get('2') is None)
+        assert(cache.get('3') is not None)
+    finally:
+        shutil.rmtree(path)
+
+def solve_feasible_test():
+    """second call is answered from the cache"""
+    path = tempfile.mkdtemp()
+    previous = feasible.set_reach_cache(path)
+    try:
+        ssys = robot()
+        p1 = pc.box2poly([[0., 1.], [0., 1.]])
+        p2 = pc.box2poly([[1., 2.], [0., 1.]])
+
+        s0 = feasible.solve_feasible(p1, p2, ssys, N=2)
+        cache = feasible.get_reach_cache()
+        assert(cache.hits == 0)
+
+        s1 = feasible.solve_feasible(p1, p2, ssys, N=2)
+        assert(cache.hits == 1)
+        assert(s0 <= s1 and s1 <= s0)
+
+        r = feasible.is_feasible_many(p1, [p2, p1], ssys, 2)
+        assert(feasible.is_feasible_many(p1, [p2, p1], ssys, 2) == r)
+        assert(cache.hits == 3)
+    finally:
+        feasible.set_reach_cache(previous)
+        shutil.rmtree(path)
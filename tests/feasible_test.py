@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.feasible
+"""
+import numpy as np
+import polytope as pc
+
+from tulip import hybrid
+from tulip.abstract.feasible import (
+    createLM, get_max_extreme, horizon_model,
+    poly_to_poly, select_projection,
+    solve_feasible, solve_feasible_many, is_feasible, is_feasible_many
+)
+
+def disturbed(W=None, b=0.5):
+    """Return x(t+1) = x(t) + b u(t) + w(t), with w in C{W}."""
+    if W is None:
+        W = pc.box2poly([[-0.1, 0.1], [-0.1, 0.1]])
+    U = pc.box2poly([[-1., 1.], [-1., 1.]])
+    dom = pc.box2poly([[0., 4.], [0., 4.]])
+    return hybrid.LtiSysDyn(
+        np.eye(2), b * np.eye(2), np.eye(2), None, U, W, dom
+    )
+
+def max_extreme_test():
+    """support function tightening equals vertex enumeration"""
+    D = pc.box2poly([[-1., 1.], [-0.5, 0.5], [0., 2.]])
+    np.random.seed(0)
+    for N in xrange(1, 4):
+        G = np.random.randn(7, 3*N)
+        d1 = get_max_extreme(G, D, N, 'support')
+        d2 = get_max_extreme(G, D, N, 'enumerate')
+        assert(d1.shape == (7, 1) )
+        assert(np.allclose(d1, d2) )
+
+def create_lm_disturbance_test():
+    ssys = disturbed(b=1.)
+    dom = ssys.domain
+
+    P = pc.box2poly([[0., 1.], [0., 1.]])
+    for N in xrange(1, 4):
+        L1, M1 = createLM(ssys, N, P, dom, P, tightening='support')
+        L2, M2 = createLM(ssys, N, P, dom, P, tightening='enumerate')
+        assert(np.allclose(L1, L2) )
+        assert(np.allclose(M1, M2) )
+
+def horizon_model_test():
+    """model is cached per horizon, until the dynamics change"""
+    U = pc.box2poly([[-1., 1.], [-1., 1.]])
+    dom = pc.box2poly([[0., 4.], [0., 4.]])
+    ssys = hybrid.LtiSysDyn(2 * np.eye(2), np.eye(2), Uset=U, domain=dom)
+
+    hm = horizon_model(ssys, 3)
+    assert(horizon_model(ssys, 3) is hm)
+    assert(horizon_model(ssys, 2) is not hm)
+
+    # x(3) = A^3 x(0) + ...
+    assert(np.allclose(hm.A_N[4:6, :], 8 * np.eye(2) ) )
+    assert(hm.Ct.shape == (6, 6) )
+
+    ssys.A = np.eye(2)
+    assert(np.allclose(horizon_model(ssys, 3).A_N[4:6, :], np.eye(2) ) )
+
+    # changed in place
+    hm = horizon_model(ssys, 3)
+    ssys.A *= 2
+    assert(horizon_model(ssys, 3) is not hm)
+    assert(np.allclose(horizon_model(ssys, 3).A_N[4:6, :], 8 * np.eye(2) ) )
+
+    ssys.A[0, 0] = 1.
+    assert(np.allclose(horizon_model(ssys, 3).A_N[4, 0], 1.) )
+
+    ssys.Uset.b[0] = 2.
+    assert(horizon_model(ssys, 3).MU[0, 0] == 2.)
+
+def projection_test():
+    """projection strategies compute the same set"""
+    ssys = disturbed()
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    p2 = pc.box2poly([[1., 2.], [0., 1.]])
+    for N in xrange(1, 3):
+        s0 = poly_to_poly(p1, p2, ssys, N)
+        assert(pc.is_fulldim(s0) )
+        for method in ('fm', 'vertex', 'auto'):
+            s = poly_to_poly(p1, p2, ssys, N, projection=method)
+            assert(s <= s0)
+            assert(s0 <= s)
+
+    s0 = poly_to_poly(p1, p2, ssys, 1)
+    s = poly_to_poly(p1, p2, ssys, 1, projection='preimage')
+    assert(s <= s0)
+    assert(s0 <= s)
+
+    assert(select_projection(ssys, 1) == 'preimage')
+    assert(select_projection(ssys, 2) == 'fm')
+    assert(select_projection(ssys, 5) is None)
+
+    try:
+        poly_to_poly(p1, p2, ssys, 2, projection='preimage')
+        raise AssertionError('expected ValueError')
+    except ValueError:
+        pass
+
+def solve_feasible_many_test():
+    """batch of targets gives the same sets as one at a time"""
+    ssys = disturbed()
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    targets = [
+        pc.box2poly([[1., 2.], [0., 1.]]),
+        pc.box2poly([[0., 1.], [1., 2.]]),
+        # too far to be reached
+        pc.box2poly([[3., 4.], [3., 4.]])
+    ]
+    for closed_loop in (True, False):
+        S0_list = solve_feasible_many(
+            p1, targets, ssys, 2, closed_loop=closed_loop
+        )
+        assert(len(S0_list) == len(targets) )
+        for p2, S0 in zip(targets, S0_list):
+            s0 = solve_feasible(p1, p2, ssys, 2, closed_loop=closed_loop)
+            assert(pc.is_fulldim(s0) == pc.is_fulldim(S0) )
+            if pc.is_fulldim(s0):
+                assert(s0 <= S0)
+                assert(S0 <= s0)
+        assert(not pc.is_fulldim(S0_list[2]) )
+
+def shifted_disturbance_test():
+    """targets reached only because of the disturbance are kept"""
+    W = pc.box2poly([[0.2, 0.3], [0.2, 0.3]])
+    ssys = disturbed(W)
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    targets = [
+        # beyond the states reachable without disturbance
+        pc.box2poly([[1.6, 2.6], [0., 1.]]),
+        pc.box2poly([[0.6, 1.6], [0.2, 1.2]])
+    ]
+    for N in (1, 2):
+        S0_list = solve_feasible_many(
+            p1, targets, ssys, N, closed_loop=False
+        )
+        for p2, S0 in zip(targets, S0_list):
+            # poly_to_poly of the baseline
+            L, M = createLM(ssys, N, p1, p1, p2)
+            s0 = pc.reduce(pc.Polytope(L, M) )
+            s0 = pc.reduce(s0.project(range(1, 3) ) )
+
+            assert(pc.is_fulldim(s0) == pc.is_fulldim(S0) )
+            if pc.is_fulldim(s0):
+                assert(s0 <= S0)
+                assert(S0 <= s0)
+    assert(pc.is_fulldim(
+        solve_feasible(p1, targets[0], ssys, 1, closed_loop=False)
+    ))
+
+def is_feasible_many_test():
+    """decision from vertices agrees with containment in S0"""
+    ssys = disturbed()
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    targets = [
+        pc.box2poly([[0., 2.], [0., 1.]]),
+        pc.box2poly([[1., 2.], [0., 1.]]),
+        pc.box2poly([[1., 2.], [1., 2.]]),
+        pc.box2poly([[3., 4.], [3., 4.]])
+    ]
+    for closed_loop in (True, False):
+        for N in (1, 2):
+            result = is_feasible_many(
+                p1, targets, ssys, N, closed_loop=closed_loop
+            )
+            expected = [
+                p1 <= solve_feasible(p1, p2, ssys, N, closed_loop=closed_loop)
+                for p2 in targets
+            ]
+            assert(result == expected)
+
+    # reachable from all of p1 in one step
+    assert(is_feasible_many(p1, targets[:1], ssys, 1) == [True])
+    assert(is_feasible_many(p1, targets[3:], ssys, 2) == [False])
+
+def is_feasible_shifted_disturbance_test():
+    """decisions for a disturbance set that excludes 0"""
+    W = pc.box2poly([[0.2, 0.3], [0.2, 0.3]])
+    ssys = disturbed(W)
+
+    p1 = pc.box2poly([[0., 0.1], [0., 0.1]])
+    targets = [
+        # beyond the states reachable without disturbance
+        pc.box2poly([[0.65, 1.2], [0.3, 0.9]]),
+        pc.box2poly([[2., 3.], [2., 3.]])
+    ]
+    for closed_loop in (True, False):
+        result = is_feasible_many(
+            p1, targets, ssys, 1, closed_loop=closed_loop
+        )
+        expected = [
+            p1 <= solve_feasible(p1, p2, ssys, 1, closed_loop=closed_loop)
+            for p2 in targets
+        ]
+        assert(result == expected)
+        assert(result == [True, False])
+
+def is_feasible_region_test():
+    """Region sources are decided as their single polytope"""
+    U = pc.box2poly([[0., 1.], [0., 1.]])
+    U.scale(0.4)
+    dom = pc.box2poly([[0., 3.], [0., 2.]])
+    ssys = hybrid.LtiSysDyn(np.eye(2), np.eye(2), Uset=U, domain=dom)
+
+    p1 = pc.box2poly([[0., 1.], [0., 1.]])
+    p2 = pc.box2poly([[1., 2.], [0., 1.]])
+    for closed_loop in (True, False):
+        for N in (1, 3):
+            expected = is_feasible(p1, p2, ssys, N, closed_loop=closed_loop)
+            r = is_feasible(
+                pc.Region([p1]), pc.Region([p2]), ssys, N,
+                closed_loop=closed_loop
+            )
+            assert(r == expected)
+    assert(is_feasible(pc.Region([p1]), pc.Region([p2]), ssys, 3) )
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.geometry
+"""
+import numpy as np
+import polytope as pc
+
+from tulip.abstract.geometry import GeometryCache
+
+def cached_quantities_test():
+    """values equal those of polytope and are computed once"""
+    cache = GeometryCache()
+    p = pc.box2poly([[0., 2.], [0., 1.]])
+    q = pc.box2poly([[2., 3.], [0., 1.]])
+    r = pc.Region([p, q])
+
+    rc, xc = cache.cheby_ball(p)
+    assert(np.isclose(rc, 0.5) )
+    assert(cache.cheby_ball(r)[0] == rc)
+
+    l, u = cache.bounding_box(r)
+    assert(np.allclose(l.flatten(), [0., 0.]) )
+    assert(np.allclose(u.flatten(), [3., 1.]) )
+
+    vol = cache.volume(r)
+    assert(vol == cache.volume(p) + cache.volume(q) )
+    assert(cache.volume(r) is vol)
+
+    # region and its polytopes
+    assert(len(cache) == 3)
+
+def invalidation_test():
+    cache = GeometryCache()
+    r = pc.Region([pc.box2poly([[0., 1.], [0., 1.]])])
+    assert(np.isclose(cache.cheby_ball(r)[0], 0.5) )
+
+    # replacing the polytopes of a region resets it
+    r.list_poly = [pc.box2poly([[0., 4.], [0., 4.]])]
+    assert(np.isclose(cache.cheby_ball(r)[0], 2.) )
+
+    # empty results are cached too
+    e = pc.Polytope(np.array([[1.], [-1.]]), np.array([-1., 0.]) )
+    assert(cache.cheby_ball(e)[0] == 0)
+    assert(cache.volume(e) == 0.)
+
+    cache.invalidate(r)
+    assert(len(cache) == 2)
+
+    # entries of collected objects are dropped
+    del r
+    assert(len(cache) == 1)
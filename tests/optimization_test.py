@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.optimization
+"""
+import numpy as np
+
+from tulip.abstract import optimization
+
+def usable_backends():
+    """Return names of the backends that solve a small LP."""
+    names = []
+    for name in optimization.available():
+        try:
+            optimization.lp(
+                np.array([1., 1.]),
+                np.array([[-1., -2.], [-2., -1.]]),
+                np.array([-1., -1.]),
+                solver=name
+            )
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+def lp_test():
+    """every backend solves the same LP"""
+    # min -x -y s.t. x + 2y <= 4, 3x + y <= 6, x, y >= 0
+    c = np.array([-1., -1.])
+    G = np.array([[1., 2.], [3., 1.], [-1., 0.], [0., -1.]])
+    h = np.array([4., 6., 0., 0.])
+
+    names = usable_backends()
+    assert(names)
+
+    optimization.reset_stats()
+    for name in names:
+        sol = optimization.lp(c, G, h, solver=name)
+        assert(sol['status'] == 'optimal')
+        assert(np.allclose(sol['x'], [1.6, 1.2], atol=1e-5) )
+        assert(abs(sol['fun'] + 2.8) < 1e-5)
+
+        # warm start from a strictly feasible point
+        sol = optimization.lp(c, G, h, solver=name, x0=np.array([.5, .5]) )
+        assert(np.allclose(sol['x'], [1.6, 1.2], atol=1e-5) )
+
+    stats = optimization.stats()
+    for name in names:
+        assert(stats[name]['lp'] == 2)
+        assert(stats[name]['time'] >= 0)
+
+def qp_test():
+    # min (x - 1)^2 + (y - 1)^2 s.t. x + y <= 1
+    P = 2 * np.eye(2)
+    q = np.array([-2., -2.])
+    G = np.array([[1., 1.]])
+    h = np.array([1.])
+
+    for name in usable_backends():
+        sol = optimization.qp(P, q, G, h, solver=name)
+        assert(sol['status'] == 'optimal')
+        assert(np.allclose(sol['x'], [0.5, 0.5], atol=1e-5) )
+
+def default_test():
+    default = optimization.get_default()
+    try:
+        optimization.set_default('no such solver')
+        raise AssertionError('expected ValueError')
+    except ValueError:
+        pass
+    assert(optimization.get_default() == default)
+
+    for name in optimization.available():
+        optimization.set_default(name)
+        assert(optimization.get_backend() is optimization.get_backend(name) )
+    optimization.set_default(default)
@@ -3,7 +3,7 @@
 Tests for abstract.prop2partition
 """
 
-from tulip.abstract import prop2part
+from tulip.abstract import prop2part, add_grid
 import polytope as pc
 import numpy as np
 
@@ -58,3 +58,50 @@ def prop2part_test():
     # invalidate it
     mypartition.regions += [pc.Region([pc.Polytope(A[0], b[0])], {})]
     assert(not mypartition.preserves_predicates())
+
+def add_grid_test():
+    """adjacency from grid coordinates agrees with pc.is_adjacent"""
+    state_space = pc.box2poly([[0., 2.], [0., 2.]])
+    cont_props = {'a':pc.Polytope(
+        np.array([[1., 1.], [-1., 0.], [0., -1.]]),
+        np.array([1.5, -.3, -.3])
+    )}
+    
+    ppp = prop2part(state_space, cont_props)
+    grid = add_grid(ppp, grid_size=0.5)
+    
+    assert(grid.preserves_predicates() )
+    
+    n = len(grid.regions)
+    for i in range(n):
+        for j in range(n):
+            adjacent = (i == j) or \
+                pc.is_adjacent(grid.regions[i], grid.regions[j])
+            assert(grid.adj[i, j] == adjacent)
+
+def prop2part_incremental_test():
+    """pruned, incremental and parallel prop2part agree with LPs"""
+    state_space = pc.box2poly([[0., 4.], [0., 4.]])
+    cont_props = {
+        'a':pc.box2poly([[0., 1.], [0., 1.]]),
+        'b':pc.box2poly([[.5, 2.5], [.5, 2.5]]),
+        'c':pc.box2poly([[3., 4.], [3., 4.]]),
+        'd':pc.box2poly([[1.5, 3.5], [0., 4.]])
+    }
+    
+    ppp = prop2part(state_space, cont_props)
+    assert(ppp.preserves_predicates() )
+    
+    n = len(ppp.regions)
+    for i in range(n):
+        for j in range(n):
+            adjacent = (i == j) or \
+                pc.is_adjacent(ppp.regions[i], ppp.regions[j])
+            assert(ppp.adj[i, j] == adjacent)
+    
+    parallel = prop2part(state_space, cont_props, n_jobs=2)
+    assert(len(parallel.regions) == n)
+    for r, s in zip(parallel.regions, ppp.regions):
+        assert(r.props == s.props)
+        assert(r <= s and s <= r)
+    assert((parallel.adj != ppp.adj).nnz == 0)
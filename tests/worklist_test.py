@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Tests for abstract.worklist
+"""
+import numpy as np
+
+from tulip.abstract.worklist import PairQueue, index_order, pair_order
+import polytope as pc
+
+def index_order_matches_dense_scan_test():
+    """pop order equals that of np.nonzero over IJ[j, i]"""
+    IJ = np.array([[0, 1, 1],
+                   [1, 0, 0],
+                   [0, 1, 1]])
+    q = PairQueue(key=index_order)
+    for j, i in zip(*np.nonzero(IJ)):
+        q.push(i, j)
+
+    popped = []
+    while np.sum(IJ) > 0:
+        ind = np.nonzero(IJ)
+        i = ind[1][0]
+        j = ind[0][0]
+        IJ[j, i] = 0
+
+        popped.append((i, j))
+        assert(q.pop() == (i, j))
+    assert(not q)
+    assert(len(popped) == 5)
+
+def discard_and_push_test():
+    q = PairQueue(key=index_order)
+    q.push(2, 0)
+    q.push(1, 1)
+    q.push(0, 2)
+    q.discard(2, 0)
+
+    assert(len(q) == 2)
+    assert((2, 0) not in q)
+    assert(q.pop() == (1, 1))
+
+    # re-enabled pair is checked again
+    q.push(2, 0)
+    q.push(2, 0)
+    assert(len(q) == 2)
+    assert(q.pop() == (2, 0))
+    assert(q.pop() == (0, 2))
+
+    try:
+        q.pop()
+        raise AssertionError('expected IndexError')
+    except IndexError:
+        pass
+
+def fifo_test():
+    q = PairQueue()
+    for pair in [(3, 1), (0, 0), (1, 2)]:
+        q.push(*pair)
+    q.discard(0, 0)
+    q.push(0, 0)
+
+    assert([q.pop() for k in xrange(3)] == [(3, 1), (1, 2), (0, 0)])
+
+def volume_order_test():
+    regions = [pc.Region([pc.box2poly([[0., 1.], [0., 1.]])]),
+               pc.Region([pc.box2poly([[0., 2.], [0., 2.]])])]
+    q = PairQueue(key=pair_order('volume', regions))
+    q.push(0, 1)
+    q.push(1, 0)
+    assert(q.pop() == (1, 0))
+
+    # refined region gets new key when pushed again
+    q.push(1, 0)
+    regions[1] = pc.Region([pc.box2poly([[0., .5], [0., .5]])])
+    q.push(1, 0)
+    assert(q.pop() == (0, 1))
+
+def pairs_of_test():
+    q = PairQueue(key=index_order)
+    q.push(0, 1)
+    q.push(1, 2)
+    q.push(2, 2)
+    assert(q.pairs_of(2) == {(1, 2), (2, 2)})
+
+    q.discard(1, 2)
+    assert(q.pairs_of(1) == {(0, 1)})
+
+    assert(q.pop() == (0, 1))
+    assert(q.pairs_of(0) == set() )
+
+def peek_test():
+    for key in [index_order, None]:
+        q = PairQueue(key=key)
+        for pair in [(3, 1), (0, 0), (1, 2), (2, 0)]:
+            q.push(*pair)
+        q.discard(1, 2)
+
+        ahead = q.peek(2)
+        assert(len(q) == 3)
+        assert(ahead == [q.pop(), q.pop()])
+        assert(q.peek(5) == [q.pop()])
+
+def peek_stale_test():
+    """peek skips re-pushed and discarded entries, as pop does"""
+    np.random.seed(0)
+    for key in [index_order, None]:
+        q = PairQueue(key=key)
+        for n in xrange(300):
+            i, j = np.random.randint(0, 10, size=2)
+            if np.random.rand() < 0.3:
+                q.discard(i, j)
+            else:
+                q.push(i, j)
+
+        order = q.peek(len(q) )
+        for k in (1, 5, 20):
+            assert(q.peek(k) == order[:k])
+        assert(order == [q.pop() for n in xrange(len(order) )])
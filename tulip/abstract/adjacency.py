@@ -0,0 +1,464 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Growable sparse 0/1 matrices for adjacency and transition bookkeeping.
+
+Primary classes:
+    - L{SetMatrix}
+    - L{KHopNeighbors}
+    - L{BoxIndex}
+
+See Also
+========
+L{discretize}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+from scipy import sparse as sp
+import polytope as pc
+
+from . import geometry
+
+class SetMatrix(object):
+    """Square 0/1 matrix stored as sets of nonzero indices.
+
+    Each row and each column is a C{set},
+    so reading, clearing or adding a row or column
+    costs time proportional to its number of nonzeros,
+    and L{grow} appends empty rows and columns
+    without copying the existing ones.
+    Memory is proportional to the number of nonzeros.
+
+    Indexing with C{A[i, j]} returns 0 or 1,
+    similar to the dense C{numpy} arrays it replaces.
+    """
+    def __init__(self, n=0):
+        self._rows = [set() for i in xrange(n)]
+        self._cols = [set() for i in xrange(n)]
+
+    @classmethod
+    def from_sparse(cls, A):
+        """Return L{SetMatrix} with the nonzero pattern of C{A}.
+
+        @type A: C{scipy.sparse} matrix or 2d C{numpy} array
+        """
+        n, m = A.shape
+        if n != m:
+            raise ValueError('SetMatrix: matrix must be square')
+
+        M = cls(n)
+        if sp.issparse(A):
+            rows, cols = A.nonzero()
+        else:
+            rows, cols = np.nonzero(A)
+
+        for i, j in zip(rows, cols):
+            M.add(int(i), int(j))
+        return M
+
+    @property
+    def shape(self):
+        n = len(self._rows)
+        return (n, n)
+
+    @property
+    def nnz(self):
+        return sum(len(row) for row in self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, pair):
+        i, j = pair
+        return j in self._rows[i]
+
+    def __getitem__(self, pair):
+        return int(pair in self)
+
+    def __setitem__(self, pair, value):
+        i, j = pair
+        if value:
+            self.add(i, j)
+        else:
+            self.discard(i, j)
+
+    def __str__(self):
+        s = 'SetMatrix of shape ' + str(self.shape)
+        s += ', with nonzeros:\n\t' + str(sorted(self.nonzero() )) + '\n'
+        return s
+
+    def add(self, i, j):
+        self._rows[i].add(j)
+        self._cols[j].add(i)
+
+    def discard(self, i, j):
+        self._rows[i].discard(j)
+        self._cols[j].discard(i)
+
+    def row(self, i):
+        """Return set of C{j} with C{A[i, j] == 1}.
+
+        The returned set is internal, so do not modify it.
+        """
+        return self._rows[i]
+
+    def col(self, j):
+        """Return set of C{i} with C{A[i, j] == 1}.
+
+        The returned set is internal, so do not modify it.
+        """
+        return self._cols[j]
+
+    def clear_row(self, i):
+        for j in self._rows[i]:
+            self._cols[j].discard(i)
+        self._rows[i] = set()
+
+    def clear_col(self, j):
+        for i in self._cols[j]:
+            self._rows[i].discard(j)
+        self._cols[j] = set()
+
+    def grow(self, k):
+        """Append C{k} empty rows and columns.
+        """
+        self._rows.extend(set() for i in xrange(k))
+        self._cols.extend(set() for i in xrange(k))
+
+    def nonzero(self):
+        """Return list of C{(i, j)} with C{A[i, j] == 1}.
+        """
+        return [(i, j) for i, row in enumerate(self._rows) for j in row]
+
+    def copy(self):
+        M = SetMatrix()
+        M._rows = [set(row) for row in self._rows]
+        M._cols = [set(col) for col in self._cols]
+        return M
+
+    def transpose(self):
+        M = SetMatrix()
+        M._rows = [set(col) for col in self._cols]
+        M._cols = [set(row) for row in self._rows]
+        return M
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def tocoo(self, dtype=int):
+        n = len(self._rows)
+        pairs = self.nonzero()
+        if pairs:
+            rows, cols = zip(*pairs)
+        else:
+            rows, cols = [], []
+        data = np.ones(len(pairs), dtype=dtype)
+        return sp.coo_matrix((data, (rows, cols)), shape=(n, n), dtype=dtype)
+
+    def tolil(self, dtype=int):
+        return self.tocoo(dtype).tolil()
+
+    def todense(self, dtype=int):
+        return np.array(self.tocoo(dtype).todense() )
+
+def compose(A, B):
+    """Return nonzero pattern of matrix product C{A * B}.
+
+    Row C{i} of the result is the union of rows C{B.row(k)}
+    for all C{k} in C{A.row(i)}.
+
+    @type A, B: L{SetMatrix}
+    @rtype: L{SetMatrix}
+    """
+    n = len(A)
+    C = SetMatrix(n)
+    for i in xrange(n):
+        row = set()
+        for k in A.row(i):
+            row.update(B.row(k))
+
+        for j in row:
+            C.add(i, j)
+    return C
+
+class KHopNeighbors(object):
+    """Cells reachable within C{k} hops, maintained under refinement.
+
+    Behaves as the read-only L{SetMatrix} C{adj^k},
+    i.e., C{row(i)} is the set of cells reachable from C{i}
+    by a walk of C{k} edges of C{adj}
+    (within C{k} hops, because cells are adjacent to themselves).
+
+    Rows and columns are computed on demand,
+    by a breadth-first search bounded to depth C{k},
+    and cached until L{invalidate} is called for
+    a nearby cell whose adjacency changed.
+    So refining a cell costs time proportional to
+    its C{k}-hop neighborhood, instead of
+    recomputing the matrix power over the whole partition.
+
+    @type adj: L{SetMatrix}
+    @type k: int >= 1
+    """
+    def __init__(self, adj, k):
+        self.adj = adj
+        self.k = k
+        self._rows = dict()
+        self._cols = dict()
+
+    def __len__(self):
+        return len(self.adj)
+
+    def __getitem__(self, pair):
+        i, j = pair
+        return int(j in self.row(i) )
+
+    def row(self, i):
+        """Return set of cells reachable from C{i} within C{k} hops.
+        """
+        if self.k <= 1:
+            return self.adj.row(i)
+
+        if i not in self._rows:
+            self._rows[i] = self._walk(self.adj.row, i)
+        return self._rows[i]
+
+    def col(self, j):
+        """Return set of cells that reach C{j} within C{k} hops.
+        """
+        if self.k <= 1:
+            return self.adj.col(j)
+
+        if j not in self._cols:
+            self._cols[j] = self._walk(self.adj.col, j)
+        return self._cols[j]
+
+    def nonzero(self):
+        return [(i, j) for i in xrange(len(self.adj)) for j in self.row(i)]
+
+    def invalidate(self, nodes):
+        """Forget rows and columns of cells near C{nodes}.
+
+        Call it with the cells whose adjacency changes,
+        once before and once after changing C{adj},
+        so that cells within C{k} hops in either graph are reset.
+
+        @type nodes: iterable of int
+        """
+        if self.k <= 1:
+            return
+
+        for v in self.ball(nodes, self.k):
+            self._rows.pop(v, None)
+            self._cols.pop(v, None)
+
+    def ball(self, nodes, depth):
+        """Return cells within C{depth} hops of C{nodes}, in any direction.
+        """
+        reached = set(nodes)
+        frontier = reached
+        for t in xrange(depth):
+            new = set()
+            for v in frontier:
+                new.update(self.adj.row(v) )
+                new.update(self.adj.col(v) )
+            frontier = new.difference(reached)
+            if not frontier:
+                break
+            reached.update(frontier)
+        return reached
+
+    def _walk(self, step, i):
+        level = set(step(i) )
+        for t in xrange(1, self.k):
+            nxt = set()
+            for v in level:
+                nxt.update(step(v) )
+            level = nxt
+        return level
+
+class BoxIndex(object):
+    """Bounding boxes of cells, to filter candidate adjacent pairs.
+
+    Two cells whose bounding boxes are disjoint cannot be adjacent,
+    so checking the boxes first avoids
+    the linear program solved by C{pc.is_adjacent}.
+    The boxes are stored as rows of two arrays,
+    so a cell is compared against all others
+    in a single vectorized comparison.
+
+    Boxes are enlarged by C{abs_tol} in each direction.
+    It should be larger than the tolerance of C{pc.is_adjacent},
+    so that no adjacent pair is filtered out.
+
+    @param regions: initial cells
+    @type regions: iterable of C{Polytope} or C{Region}
+    """
+    def __init__(self, regions=None, abs_tol=1e-5):
+        self.abs_tol = abs_tol
+        self._n = 0
+        self._lower = None
+        self._upper = None
+
+        if regions is not None:
+            for region in regions:
+                self.append(region)
+
+    def __len__(self):
+        return self._n
+
+    def append(self, region):
+        """Add box of C{region} as the last cell.
+
+        @return: index of new cell
+        """
+        box = self._box(region)
+
+        if self._lower is None:
+            self._allocate(box)
+        elif self._n == len(self._lower):
+            self._lower = np.vstack([self._lower, np.empty_like(self._lower)])
+            self._upper = np.vstack([self._upper, np.empty_like(self._upper)])
+
+        i = self._n
+        self._n += 1
+        if self._lower is not None:
+            self._set(i, box)
+        return i
+
+    def update(self, i, region):
+        """Replace box of cell C{i} with that of C{region}.
+        """
+        if not 0 <= i < self._n:
+            raise IndexError('BoxIndex: no cell: ' + str(i) )
+
+        box = self._box(region)
+        if self._lower is None:
+            self._allocate(box)
+        if self._lower is not None:
+            self._set(i, box)
+
+    def box(self, i):
+        """Return C{(l, u)} enlarged bounds of cell C{i}.
+        """
+        return (self._lower[i].copy(), self._upper[i].copy() )
+
+    def intersect(self, i, j):
+        """Return True if the boxes of cells C{i} and C{j} intersect.
+        """
+        if self._lower is None:
+            return False
+        return bool(
+            np.all(self._lower[i] <= self._upper[j]) and
+            np.all(self._lower[j] <= self._upper[i])
+        )
+
+    def overlapping(self, i, among=None):
+        """Return cells whose boxes intersect that of cell C{i}.
+
+        The result includes C{i}, unless it is empty.
+
+        @param among: consider only these cells,
+            by default all
+        @type among: iterable of int
+
+        @rtype: set of int
+        """
+        if self._lower is None:
+            return set()
+
+        if among is None:
+            idx = np.arange(self._n)
+        else:
+            idx = np.fromiter(among, dtype=int)
+            if len(idx) == 0:
+                return set()
+
+        hits = (
+            np.all(self._lower[idx] <= self._upper[i], axis=1) &
+            np.all(self._lower[i] <= self._upper[idx], axis=1)
+        )
+        return set(int(k) for k in idx[hits])
+
+    def pairs(self):
+        """Return pairs C{(i, j)} with C{j < i} whose boxes intersect.
+
+        @rtype: list of C{(i, j)}
+        """
+        result = []
+        if self._lower is None:
+            return result
+
+        lower = self._lower[:self._n]
+        upper = self._upper[:self._n]
+        for i in xrange(1, self._n):
+            hits = (
+                np.all(lower[:i] <= upper[i], axis=1) &
+                np.all(lower[i] <= upper[:i], axis=1)
+            )
+            result.extend((i, int(j)) for j in np.nonzero(hits)[0])
+        return result
+
+    def _allocate(self, box):
+        """Create the arrays, once a box gives the dimension.
+        """
+        if box is None:
+            return
+
+        shape = (max(16, 2 * self._n), len(box[0]) )
+        self._lower = np.empty(shape)
+        self._upper = np.empty(shape)
+
+        # cells added so far are empty
+        self._lower[:self._n] = np.inf
+        self._upper[:self._n] = -np.inf
+
+    def _set(self, i, box):
+        if box is None:
+            # intersects no other box
+            self._lower[i] = np.inf
+            self._upper[i] = -np.inf
+        else:
+            self._lower[i], self._upper[i] = box
+
+    def _box(self, region):
+        if isinstance(region, pc.Region) and len(region) == 0:
+            return None
+
+        l, u = geometry.bounding_box(region)
+        l = np.array(l, dtype=float).flatten() - self.abs_tol
+        u = np.array(u, dtype=float).flatten() + self.abs_tol
+        return (l, u)
@@ -0,0 +1,299 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Persistent memo of reachability results, shared by processes.
+
+Results of L{feasible} are stored in files of a local directory,
+one per result, named by a hash of everything they depend on:
+the dynamics C{A, B, E, K, Uset, Wset},
+the regions C{P1, P2, trans_set} in H-representation
+and the parameters C{N, closed_loop, use_all_horizon, max_num_poly}.
+So abstractions rerun with the same plant,
+for example while tuning the specification,
+reuse the results of earlier runs.
+
+Sets are stored in H-representation, decisions as bool.
+A file is written under a temporary name and then renamed,
+so processes that share the directory never read a partial file.
+The directory is bounded in size:
+the least recently used files are removed first,
+down to a fraction L{LOW_WATER} of the bound.
+
+Enable the cache for L{feasible}, and so for
+L{discretize}, L{get_transitions} and
+L{AbstractPwa.verify_transitions}, with
+L{feasible.set_reach_cache}.
+
+Primary classes:
+    - L{ReachCache}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import errno
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+import polytope as pc
+
+# change if the stored format changes
+VERSION = 1
+
+SUFFIX = '.reach'
+
+# what a reachability result depends on in LtiSysDyn
+DYNAMICS = ('A', 'B', 'E', 'K', 'Uset', 'Wset')
+
+# eviction stops at this fraction of max_bytes,
+# so that the directory is not listed at every put once full
+LOW_WATER = 0.9
+
+class ReachCache(object):
+    """Directory of reachability results, with LRU eviction.
+
+    Attributes:
+
+      - path: directory of the files
+      - max_bytes: bound on the total size of the files
+      - hits, misses: number of lookups found and not found
+
+    @param path: directory, created if missing
+    @type path: str
+
+    @param max_bytes: total size of files kept
+    @type max_bytes: int
+    """
+    def __init__(self, path, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self._size = sum(size for f, size, t in self._files())
+
+    def __str__(self):
+        s = 'Reachability cache in: ' + str(self.path) + '\n'
+        s += '\t hits: ' + str(self.hits) + '\n'
+        s += '\t misses: ' + str(self.misses) + '\n'
+        return s
+
+    def key(self, kind, ssys, P1, P2, trans_set, N, closed_loop,
+            use_all_horizon, max_num_poly):
+        """Return hash of the arguments of a reachability result.
+
+        The hash depends only on the values of the arrays
+        that define the dynamics and the regions,
+        so it is the same in every process and run.
+
+        @param kind: what is stored,
+            for example C{'S0'} or C{'feasible'}
+        @type kind: str
+
+        @type ssys: L{LtiSysDyn}
+
+        @rtype: str
+        """
+        h = hashlib.sha1()
+        _update(h, (VERSION, kind, N, closed_loop,
+                    use_all_horizon, max_num_poly))
+
+        for attr in DYNAMICS:
+            _update(h, getattr(ssys, attr, None) )
+
+        for region in (P1, P2, trans_set):
+            _update(h, region)
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return stored result, or C{None} if not found.
+
+        @return: C{Polytope}, C{Region} or bool
+        """
+        fname = self._fname(key)
+        try:
+            with open(fname, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            # missing, or removed by another process
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return _from_hrep(value)
+
+    def put(self, key, value):
+        """Store result C{value} under C{key}.
+
+        @type value: C{Polytope}, C{Region} or bool
+        """
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(_to_hrep(value), f, pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp)
+            os.rename(tmp, self._fname(key) )
+        except OSError:
+            # rename fails on some platforms if the key exists
+            _remove(tmp)
+            return
+
+        self._size += size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used files, until within
+        C{LOW_WATER * max_bytes}.
+
+        Files of other processes are counted, too.
+        """
+        files = sorted(self._files(), key=lambda x: x[2])
+
+        low = LOW_WATER * self.max_bytes
+        self._size = sum(size for f, size, t in files)
+        for fname, size, t in files:
+            if self._size <= low:
+                break
+            _remove(fname)
+            self._size -= size
+
+    def clear(self):
+        """Remove all stored results.
+        """
+        for fname, size, t in self._files():
+            _remove(fname)
+        self._size = 0
+
+    def _fname(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def _files(self):
+        """Return C{(file name, size, time of last use)} of results.
+        """
+        files = []
+        for name in os.listdir(self.path):
+            if not name.endswith(SUFFIX):
+                continue
+
+            fname = os.path.join(self.path, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            files.append((fname, st.st_size, st.st_mtime) )
+        return files
+
+def dynamics_digest(ssys):
+    """Return hash of the matrices and sets of C{ssys}, by value.
+
+    Changes in place, as C{ssys.A[0, 0] = 2}, change the hash.
+
+    @type ssys: L{LtiSysDyn}
+    @rtype: str
+    """
+    h = hashlib.sha1()
+    for attr in DYNAMICS:
+        _update(h, getattr(ssys, attr, None) )
+    return h.digest()
+
+def _update(h, x):
+    """Add C{x} to hash C{h}, by value.
+    """
+    if isinstance(x, pc.Region):
+        h.update(b'Region')
+        for p in x.list_poly:
+            _update(h, p)
+    elif isinstance(x, pc.Polytope):
+        h.update(b'Polytope')
+        _update(h, x.A)
+        _update(h, x.b)
+    elif isinstance(x, np.ndarray):
+        a = np.ascontiguousarray(x, dtype=float)
+        h.update(repr(a.shape).encode('ascii') )
+        h.update(a.data)
+    elif isinstance(x, (tuple, list) ):
+        h.update(b'(')
+        for y in x:
+            _update(h, y)
+        h.update(b')')
+    else:
+        h.update(repr(x).encode('ascii') )
+        h.update(b',')
+
+def _to_hrep(value):
+    if isinstance(value, pc.Region):
+        return ('Region', [_polytope_hrep(p) for p in value.list_poly])
+    elif isinstance(value, pc.Polytope):
+        return ('Polytope', _polytope_hrep(value) )
+    return ('value', value)
+
+def _polytope_hrep(p):
+    return (np.array(p.A, dtype=float), np.array(p.b, dtype=float) )
+
+def _from_hrep(stored):
+    kind, x = stored
+    if kind == 'Region':
+        return pc.Region([_hrep_polytope(A, b) for A, b in x])
+    elif kind == 'Polytope':
+        return _hrep_polytope(*x)
+    return x
+
+def _hrep_polytope(A, b):
+    if A.size == 0:
+        return pc.Polytope()
+    return pc.Polytope(A, b)
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except OSError:
+        pass
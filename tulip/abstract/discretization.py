@@ -43,9 +43,16 @@ logger = logging.getLogger(__name__)
 import os
 import warnings
 import pprint
+import time
+import gzip
 from copy import deepcopy
 import multiprocessing as mp
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import numpy as np
 from scipy import sparse as sp
 import polytope as pc
@@ -53,8 +60,14 @@ import polytope as pc
 from tulip import transys as trs
 from tulip.hybrid import LtiSysDyn, PwaSysDyn
 from .prop2partition import PropPreservingPartition, pwa_partition, part2convex
-from .feasible import is_feasible, solve_feasible
+from .feasible import (
+    solve_feasible, is_feasible_many, solve_feasible_many
+)
 from .plot import plot_ts_on_partition
+from .worklist import PairQueue, pair_order as _pair_order
+from .adjacency import SetMatrix, KHopNeighbors, BoxIndex, compose
+from . import geometry
+from .telemetry import DiscretizeStats
 
 try:
     import matplotlib.pyplot as plt
@@ -236,6 +249,17 @@ class AbstractPwa(object):
           to ensure consistency
 
           type: dict
+      
+      - stats: totals of the progress events of L{discretize}
+          
+          type: L{telemetry.DiscretizeStats}
+      
+      - unverified: pairs C{(i, j)} of C{ppp.regions} indices
+          for which C{i ---> j} was not checked,
+          because the budget of L{discretize} ran out.
+          The abstraction has no transition for them.
+          
+          type: list, empty if the abstraction is complete
     
     If any of the above is not given,
     then it is initialized to None.
@@ -255,11 +279,14 @@ class AbstractPwa(object):
         self, ppp=None, ts=None, ppp2ts=None,
         pwa=None, pwa_ppp=None, ppp2pwa=None, ppp2sys=None,
         orig_ppp=None, ppp2orig=None,
-        disc_params=None
+        disc_params=None, stats=None, unverified=None
     ):
         if disc_params is None:
             disc_params = dict()
         
+        if unverified is None:
+            unverified = list()
+        
         self.ppp = ppp
         self.ts = ts
         self.ppp2ts = ppp2ts
@@ -277,6 +304,8 @@ class AbstractPwa(object):
         # ppp2pwa -> ppp2pwa_sys
         
         self.disc_params = disc_params
+        self.stats = stats
+        self.unverified = unverified
     
     def __str__(self):
         s = str(self.ppp)
@@ -402,29 +431,37 @@ class AbstractPwa(object):
     def verify_transitions(self):
         logger.info('verifying transitions...')
         
+        # group by source region
+        to_states = dict()
         for from_state, to_state in self.ts.transitions():
+            to_states.setdefault(from_state, []).append(to_state)
+        
+        params = {'N', 'closed_loop', 'use_all_horizon'}
+        disc_params = {k:v for k,v in self.disc_params.iteritems()
+                       if k in params}
+        
+        for from_state, targets in to_states.iteritems():
             i, from_region = self.ts2ppp(from_state)
-            j, to_region = self.ts2ppp(to_state)
-            
             trans_set, sys = self.ppp2trans(i)
             
-            params = {'N', 'close_loop', 'use_all_horizon'}
-            disc_params = {k:v for k,v in self.disc_params.iteritems()
-                           if k in params}
-            
-            s0 = solve_feasible(from_region, to_region, sys,
-                                trans_set=trans_set, **disc_params)
-            
-            msg = str(i) + ' ---> ' + str(j)
+            to_regions = [self.ts2ppp(x)[1] for x in targets]
+            S0_list = solve_feasible_many(
+                from_region, to_regions, sys,
+                trans_set=trans_set, **disc_params
+            )
             
-            if not from_region <= s0:
-                logger.error('incorrect transition: ' + msg)
+            for to_state, s0 in zip(targets, S0_list):
+                j = self.ts2ppp(to_state)[0]
+                msg = str(i) + ' ---> ' + str(j)
                 
-                isect = from_region.intersect(s0)
-                ratio = isect.volume /from_region.volume
-                logger.error('intersection volume: ' + str(ratio) + ' %')
-            else:
-                logger.info('correct transition: ' + msg)
+                if not from_region <= s0:
+                    logger.error('incorrect transition: ' + msg)
+                    
+                    isect = from_region.intersect(s0)
+                    ratio = isect.volume /from_region.volume
+                    logger.error('intersection volume: ' + str(ratio) + ' %')
+                else:
+                    logger.info('correct transition: ' + msg)
 
 def _plot_abstraction(ab, show_ts, only_adjacent, color_seed):
     if ab.ppp is None or ab.ts is None:
@@ -453,7 +490,10 @@ def discretize(
     trans_length=1, remove_trans=False, 
     abs_tol=1e-7,
     plotit=False, save_img=False, cont_props=None,
-    plot_every=1
+    plot_every=1, pair_order='index', goal=None,
+    n_jobs=1, checkpoint=None, checkpoint_every=None,
+    checkpoint_interval=None, resume_from=None,
+    callback=None, time_budget=None, max_cells=None
 ):
     """Refine the partition and establish transitions
     based on reachability analysis.
@@ -497,9 +537,73 @@ def discretize(
     @param cont_props: continuous propositions to plot
     @type cont_props: list of C{Polytope}
     
+    @param pair_order: order in which pending pairs of cells
+        are checked for reachability.
+        See L{worklist.pair_order} for the available policies.
+        The default C{'index'} checks pairs in the same order
+        as earlier versions, so it yields the same abstraction.
+    @type pair_order: str or callable
+    
+    @param goal: target set for C{pair_order='goal'}
+    @type goal: C{Polytope} or C{Region}
+    
+    @param n_jobs: number of processes that check pairs in parallel.
+        The pairs next in line are evaluated speculatively
+        and their results are used in the serial order,
+        unless one of the two cells has been refined meanwhile,
+        in which case the pair is checked again.
+        So the abstraction is the same as with C{n_jobs=1},
+        up to the randomized volume estimates of C{polytope}.
+        If -1, then use all CPUs.
+    @type n_jobs: int
+    
+    @param checkpoint: file where the state of the refinement loop
+        is saved periodically, and once more when it ends.
+        The file is replaced atomically,
+        so a crash while saving leaves the previous checkpoint.
+    @type checkpoint: str
+    
+    @param checkpoint_every: save every this many iterations
+    @type checkpoint_every: int
+    
+    @param checkpoint_interval: save if this many seconds have passed
+        since the last save. If neither this nor C{checkpoint_every}
+        is given, then it defaults to 300 seconds.
+    @type checkpoint_interval: float
+    
+    @param resume_from: checkpoint file saved by an earlier call
+        with the same C{part}, C{ssys} and parameters,
+        to continue from where that call stopped.
+        Can be the same file as C{checkpoint}.
+    @type resume_from: str
+    
+    @param callback: called with the event of each iteration,
+        which describes the pair checked, the time spent
+        in each step and the outcome.
+        For example a L{telemetry.JsonLinesWriter}.
+        The totals over all events are stored as
+        the attribute C{stats} of the returned L{AbstractPwa}.
+        See L{telemetry} for the items of an event.
+    @type callback: callable
+    
+    @param time_budget: stop refining after this many seconds
+    @type time_budget: float
+    
+    @param max_cells: stop refining once there are this many cells
+        (the last split can exceed it)
+    @type max_cells: int
+    
+    If either budget runs out,
+    then the abstraction over the current cells is returned.
+    It is sound, because the pairs that remain unchecked
+    are listed in C{unverified} and have no transition.
+    If C{checkpoint} is given, then a later call
+    with C{resume_from} continues refining it.
+    
     @rtype: L{AbstractPwa}
     """
     start_time = os.times()[0]
+    start_wall = time.time()
     
     orig_ppp = part
     min_cell_volume = (min_cell_volume /np.finfo(np.double).eps
@@ -508,34 +612,59 @@ def discretize(
     ispwa = isinstance(ssys, PwaSysDyn)
     islti = isinstance(ssys, LtiSysDyn)
     
-    if ispwa:
-        (part, ppp2pwa, part2orig) = pwa_partition(ssys, part)
-    else:
-        part2orig = range(len(part))
+    if not conservative:
+        remove_trans = False # already allowed in nonconservative
     
-    # Save original polytopes, require them to be convex 
-    if conservative:
-        orig_list = None
-        orig = [0]
+    ckpt_params = {
+        'N':N,
+        'trans_length':trans_length,
+        'closed_loop':closed_loop,
+        'conservative':conservative,
+        'use_all_horizon':use_all_horizon,
+        'min_cell_volume':min_cell_volume,
+        'max_num_poly':max_num_poly,
+        'remove_trans':remove_trans,
+        'abs_tol':abs_tol
+    }
+    
+    if resume_from is None:
+        part, part2orig, subsys_list, orig_list, orig = _prepare_partition(
+            part, ssys, conservative
+        )
+        
+        # Initialize output
+        # Regions are never modified in place,
+        # refinement replaces them by new ones,
+        # so they are shared, not copied.
+        num_regions = len(part)
+        transitions = SetMatrix(num_regions)
+        sol = list(part.regions)
+        adj = SetMatrix.from_sparse(part.adj)
+        
+        pending = None
+        iter_count = 0
+        progress = list()
+        stats = DiscretizeStats()
     else:
-        (part, new2old) = part2convex(part) # convexify
-        part2orig = [part2orig[i] for i in new2old]
+        state = _load_checkpoint(resume_from, ckpt_params)
         
-        # map new regions to pwa subsystems
-        if ispwa:
-            ppp2pwa = [ppp2pwa[i] for i in new2old]
+        part = state['part']
+        part2orig = state['part2orig']
+        subsys_list = state['subsys_list']
+        orig_list = state['orig_list']
+        orig = state['orig']
         
-        remove_trans = False # already allowed in nonconservative
-        orig_list = []
-        for poly in part:
-            if len(poly) == 0:
-                orig_list.append(poly.copy())
-            elif len(poly) == 1:
-                orig_list.append(poly[0].copy())
-            else:
-                raise Exception("discretize: "
-                    "problem in convexification")
-        orig = range(len(orig_list))
+        transitions = state['transitions']
+        sol = state['sol']
+        adj = state['adj']
+        
+        pending = state['pending']
+        iter_count = state['iter_count']
+        progress = state['progress']
+        stats = state['stats']
+        
+        logger.info('resuming from iteration: ' + str(iter_count) +
+                    ', with: ' + str(len(pending)) + ' pending pairs')
     
     # Cheby radius of disturbance set
     # (defined within the loop for pwa systems)
@@ -545,32 +674,24 @@ def discretize(
         else:
             rd = 0.
     
-    # Initialize matrix for pairs to check
-    IJ = part.adj.copy()
-    IJ = IJ.todense()
-    IJ = np.array(IJ)
-    logger.debug("\n Starting IJ: \n" + str(IJ) )
-    
-    # next line omitted in discretize_overlap
-    IJ = reachable_within(trans_length, IJ,
-                          np.array(part.adj.todense()) )
-    
-    # Initialize output
-    num_regions = len(part)
-    transitions = np.zeros(
-        [num_regions, num_regions],
-        dtype = int
-    )
-    sol = deepcopy(part.regions)
-    adj = part.adj.copy()
-    adj = adj.todense()
-    adj = np.array(adj)
+    # Initialize pairs to check
+    adj_k = KHopNeighbors(adj, trans_length)
     
-    # next 2 lines omitted in discretize_overlap
-    if ispwa:
-        subsys_list = list(ppp2pwa)
+    # filters cells that cannot be adjacent
+    boxes = BoxIndex(sol)
+    
+    # adj_k[j, i] == 1 means check i ---> j
+    IJ = PairQueue(key=_pair_order(pair_order, sol, goal))
+    if pending is None:
+        for j, i in sorted(adj_k.nonzero() ):
+            IJ.push(i, j)
     else:
-        subsys_list = None
+        for i, j in pending:
+            IJ.push(i, j)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("\n Starting IJ: \n" + str(IJ) )
+    
     ss = ssys
     
     # init graphics
@@ -588,8 +709,6 @@ def discretize(
             ax1.axis('scaled')
             ax2.axis('scaled')
             file_extension = 'png'
-        
-    iter_count = 0
     
     # List of how many "new" regions
     # have been created for each region
@@ -597,317 +716,381 @@ def discretize(
     #num_new_reg = np.zeros(len(orig_list))
     #num_orig_neigh = np.sum(adj, axis=1).flatten() - 1
     
-    progress = list()
+    if checkpoint_every is None and checkpoint_interval is None:
+        checkpoint_interval = 300.
+    
+    def save_state():
+        state = {
+            'part':part,
+            'part2orig':part2orig,
+            'subsys_list':subsys_list,
+            'orig_list':orig_list,
+            'orig':orig,
+            'transitions':transitions,
+            'sol':sol,
+            'adj':adj,
+            'pending':IJ.peek(len(IJ) ),
+            'iter_count':iter_count,
+            'progress':progress,
+            'stats':stats
+        }
+        _save_checkpoint(checkpoint, ckpt_params, state)
+    
+    last_save = time.time()
+    
+    # time already spent before resuming
+    elapsed0 = stats.elapsed
+    
+    reach = _PairEvaluator(
+        n_jobs, sol, ssys, subsys_list, orig_list, orig,
+        N, closed_loop, use_all_horizon, max_num_poly, abs_tol
+    )
     
     # Do the abstraction
-    while np.sum(IJ) > 0:
-        ind = np.nonzero(IJ)
-        # i,j swapped in discretize_overlap
-        i = ind[1][0]
-        j = ind[0][0]
-        IJ[j, i] = 0
-        si = sol[i]
-        sj = sol[j]
-        
-        si_tmp = deepcopy(si)
-        sj_tmp = deepcopy(sj)
-        
-        #num_new_reg[i] += 1
-        #print(num_new_reg)
-        
-        if ispwa:
-            ss = ssys.list_subsys[subsys_list[i]]
-            if len(ss.E) > 0:
-                rd, xd = pc.cheby_ball(ss.Wset)
-            else:
-                rd = 0.
-        
-        if conservative:
-            # Don't use trans_set
-            trans_set = None
-        else:
-            # Use original cell as trans_set
-            trans_set = orig_list[orig[i]]
-        
-        S0 = solve_feasible(
-            si, sj, ss, N, closed_loop,
-            use_all_horizon, trans_set, max_num_poly
-        )
-        
-        msg = '\n Working with partition cells: ' + str(i) + ', ' + str(j)
-        logger.info(msg)
-        
-        msg = '\t' + str(i) +' (#polytopes = ' +str(len(si) ) +'), and:\n'
-        msg += '\t' + str(j) +' (#polytopes = ' +str(len(sj) ) +')\n'
-        
-        if ispwa:
-            msg += '\t with active subsystem: '
-            msg += str(subsys_list[i]) + '\n'
-            
-        msg += '\t Computed reachable set S0 with volume: '
-        msg += str(S0.volume) + '\n'
-        
-        logger.debug(msg)
-        
-        #logger.debug('si \cap s0')
-        isect = si.intersect(S0)
-        vol1 = isect.volume
-        risect, xi = pc.cheby_ball(isect)
-        
-        #logger.debug('si \ s0')
-        diff = si.diff(S0)
-        vol2 = diff.volume
-        rdiff, xd = pc.cheby_ball(diff)
-        
-        # if pc.is_fulldim(pc.Region([isect]).intersect(diff)):
-        #     logging.getLogger('tulip.polytope').setLevel(logging.DEBUG)
-        #     diff = pc.mldivide(si, S0, save=True)
-        #
-        #     ax = S0.plot()
-        #     ax.axis([0.0, 1.0, 0.0, 2.0])
-        #     ax.figure.savefig('./img/s0.pdf')
-        #
-        #     ax = si.plot()
-        #     ax.axis([0.0, 1.0, 0.0, 2.0])
-        #     ax.figure.savefig('./img/si.pdf')
-        #
-        #     ax = isect.plot()
-        #     ax.axis([0.0, 1.0, 0.0, 2.0])
-        #     ax.figure.savefig('./img/isect.pdf')
-        #
-        #     ax = diff.plot()
-        #     ax.axis([0.0, 1.0, 0.0, 2.0])
-        #     ax.figure.savefig('./img/diff.pdf')
-        #
-        #     ax = isect.intersect(diff).plot()
-        #     ax.axis([0.0, 1.0, 0.0, 2.0])
-        #     ax.figure.savefig('./img/diff_cap_isect.pdf')
-        #
-        #     logger.error('Intersection \cap Difference != \emptyset')
-        #
-        #     assert(False)
-
-        if vol1 <= min_cell_volume:
-            logger.warning('\t too small: si \cap Pre(sj), ' +
-                           'so discard intersection')
-        if vol1 <= min_cell_volume and isect:
-            logger.warning('\t discarded non-empty intersection: ' +
-                           'consider reducing min_cell_volume')
-        if vol2 <= min_cell_volume:
-            logger.warning('\t too small: si \ Pre(sj), so not reached it')
-        
-        # We don't want our partitions to be smaller than the disturbance set
-        # Could be a problem since cheby radius is calculated for smallest
-        # convex polytope, so if we have a region we might throw away a good
-        # cell.
-        if (vol1 > min_cell_volume) and (risect > rd) and \
-           (vol2 > min_cell_volume) and (rdiff > rd):
-        
-            # Make sure new areas are Regions and add proposition lists
-            if len(isect) == 0:
-                isect = pc.Region([isect], si.props)
-            else:
-                isect.props = si.props.copy()
-        
-            if len(diff) == 0:
-                diff = pc.Region([diff], si.props)
-            else:
-                diff.props = si.props.copy()
-        
-            # replace si by intersection (single state)
-            isect_list = pc.separate(isect)
-            sol[i] = isect_list[0]
+    try:
+        while IJ:
+            if time_budget is not None and \
+               time.time() - start_wall >= time_budget:
+                logger.warning('discretize: time budget of ' +
+                               str(time_budget) + ' [sec] ran out')
+                break
             
-            # cut difference into connected pieces
-            difflist = pc.separate(diff)
+            if max_cells is not None and len(sol) >= max_cells:
+                logger.warning('discretize: reached max_cells = ' +
+                               str(max_cells) )
+                break
             
-            difflist += isect_list[1:]
-            n_isect = len(isect_list) -1
+            reach.speculate(IJ)
+            i, j = IJ.pop()
+            si = sol[i]
+            sj = sol[j]
             
-            num_new = len(difflist)
+            #num_new_reg[i] += 1
+            #print(num_new_reg)
             
-            # add each piece, as a new state
-            for region in difflist:
-                sol.append(region)
-                
-                # keep track of PWA subsystems map to new states
-                if ispwa:
-                    subsys_list.append(subsys_list[i])
-            n_cells = len(sol)
-            new_idx = xrange(n_cells-1, n_cells-num_new-1, -1)
+            if ispwa:
+                ss = ssys.list_subsys[subsys_list[i]]
+                if len(ss.E) > 0:
+                    rd, xd = geometry.cheby_ball(ss.Wset)
+                else:
+                    rd = 0.
             
-            """Update transition matrix"""
-            transitions = np.pad(transitions, (0,num_new), 'constant')
+            r = reach(i, j)
+            S0, isect, diff, vol1, vol2, risect, rdiff, times = r
             
-            transitions[i, :] = np.zeros(n_cells)
-            for r in new_idx:
-                #transitions[:, r] = transitions[:, i]
-                # All sets reachable from start are reachable from both part's
-                # except possibly the new part
-                transitions[i, r] = 0
-                transitions[j, r] = 0            
+            msg = '\n Working with partition cells: ' + str(i) + ', ' + str(j)
+            logger.info(msg)
             
-            # sol[j] is reachable from intersection of sol[i] and S0
-            if i != j:
-                transitions[j, i] = 1
+            if logger.isEnabledFor(logging.DEBUG):
+                msg = '\t' + str(i) +' (#polytopes = ' +str(len(si) ) +'), and:\n'
+                msg += '\t' + str(j) +' (#polytopes = ' +str(len(sj) ) +')\n'
+                
+                if ispwa:
+                    msg += '\t with active subsystem: '
+                    msg += str(subsys_list[i]) + '\n'
+                
+                msg += '\t Computed reachable set S0 with volume: '
+                msg += str(geometry.volume(S0) ) + '\n'
                 
-                # sol[j] is reachable from each piece os S0 \cap sol[i]
-                #for k in xrange(n_cells-n_isect-2, n_cells):
-                #    transitions[j, k] = 1
+                logger.debug(msg)
             
-            """Update adjacency matrix"""
-            old_adj = np.nonzero(adj[i, :])[0]
+            # if pc.is_fulldim(pc.Region([isect]).intersect(diff)):
+            #     logging.getLogger('tulip.polytope').setLevel(logging.DEBUG)
+            #     diff = pc.mldivide(si, S0, save=True)
+            #
+            #     ax = S0.plot()
+            #     ax.axis([0.0, 1.0, 0.0, 2.0])
+            #     ax.figure.savefig('./img/s0.pdf')
+            #
+            #     ax = si.plot()
+            #     ax.axis([0.0, 1.0, 0.0, 2.0])
+            #     ax.figure.savefig('./img/si.pdf')
+            #
+            #     ax = isect.plot()
+            #     ax.axis([0.0, 1.0, 0.0, 2.0])
+            #     ax.figure.savefig('./img/isect.pdf')
+            #
+            #     ax = diff.plot()
+            #     ax.axis([0.0, 1.0, 0.0, 2.0])
+            #     ax.figure.savefig('./img/diff.pdf')
+            #
+            #     ax = isect.intersect(diff).plot()
+            #     ax.axis([0.0, 1.0, 0.0, 2.0])
+            #     ax.figure.savefig('./img/diff_cap_isect.pdf')
+            #
+            #     logger.error('Intersection \cap Difference != \emptyset')
+            #
+            #     assert(False)
+
+            if vol1 <= min_cell_volume:
+                logger.warning('\t too small: si \cap Pre(sj), ' +
+                               'so discard intersection')
+            if vol1 <= min_cell_volume and isect:
+                logger.warning('\t discarded non-empty intersection: ' +
+                               'consider reducing min_cell_volume')
+            if vol2 <= min_cell_volume:
+                logger.warning('\t too small: si \ Pre(sj), so not reached it')
             
-            # reset new adjacencies
-            adj[i, :] = np.zeros([n_cells -num_new])
-            adj[:, i] = np.zeros([n_cells -num_new])
-            adj[i, i] = 1
+            # We don't want our partitions to be smaller than the disturbance set
+            # Could be a problem since cheby radius is calculated for smallest
+            # convex polytope, so if we have a region we might throw away a good
+            # cell.
+            if (vol1 > min_cell_volume) and (risect > rd) and \
+               (vol2 > min_cell_volume) and (rdiff > rd):
             
-            adj = np.pad(adj, (0, num_new), 'constant')
+                # Make sure new areas are Regions and add proposition lists
+                if len(isect) == 0:
+                    isect = pc.Region([isect], si.props)
+                else:
+                    isect.props = si.props.copy()
             
-            for r in new_idx:
-                adj[i, r] = 1
-                adj[r, i] = 1
-                adj[r, r] = 1
-                
-                if not conservative:
-                    orig = np.hstack([orig, orig[i]])
+                if len(diff) == 0:
+                    diff = pc.Region([diff], si.props)
+                else:
+                    diff.props = si.props.copy()
             
-            # adjacencies between pieces of isect and diff
-            for r in new_idx:
-                for k in new_idx:
-                    if r is k:
-                        continue
+                # replace si by intersection (single state)
+                isect_list = pc.separate(isect)
+                sol[i] = isect_list[0]
+                boxes.update(i, sol[i])
+                reach.refined(i)
+                
+                # cut difference into connected pieces
+                difflist = pc.separate(diff)
+                
+                difflist += isect_list[1:]
+                n_isect = len(isect_list) -1
+                
+                num_new = len(difflist)
+                
+                # add each piece, as a new state
+                for region in difflist:
+                    sol.append(region)
+                    boxes.append(region)
                     
-                    if pc.is_adjacent(sol[r], sol[k]):
-                        adj[r, k] = 1
-                        adj[k, r] = 1
-            
-            msg = ''
-            if logger.getEffectiveLevel() <= logging.DEBUG:
-                msg += '\t\n Adding states ' + str(i) + ' and '
+                    # keep track of PWA subsystems map to new states
+                    if ispwa:
+                        subsys_list.append(subsys_list[i])
+                n_cells = len(sol)
+                new_idx = xrange(n_cells-1, n_cells-num_new-1, -1)
+                
+                """Update transition matrix"""
+                transitions.grow(num_new)
+                
+                transitions.clear_row(i)
                 for r in new_idx:
-                    msg += str(r) + ' and '
-                msg += '\n'
-                logger.debug(msg)
-                        
-            for k in np.setdiff1d(old_adj, [i,n_cells-1]):
-                # Every "old" neighbor must be the neighbor
-                # of at least one of the new
-                if pc.is_adjacent(sol[i], sol[k]):
-                    adj[i, k] = 1
-                    adj[k, i] = 1
-                elif remove_trans and (trans_length == 1):
-                    # Actively remove transitions between non-neighbors
-                    transitions[i, k] = 0
-                    transitions[k, i] = 0
+                    #transitions[:, r] = transitions[:, i]
+                    # All sets reachable from start are reachable from both part's
+                    # except possibly the new part
+                    transitions[i, r] = 0
+                    transitions[j, r] = 0
+                
+                # sol[j] is reachable from intersection of sol[i] and S0
+                if i != j:
+                    transitions[j, i] = 1
+                    
+                    # sol[j] is reachable from each piece os S0 \cap sol[i]
+                    #for k in xrange(n_cells-n_isect-2, n_cells):
+                    #    transitions[j, k] = 1
+                
+                """Update adjacency matrix"""
+                old_adj = sorted(adj.row(i) )
+                adj_k.invalidate([i])
+                
+                # reset new adjacencies
+                adj.clear_row(i)
+                adj.clear_col(i)
+                adj[i, i] = 1
+                
+                adj.grow(num_new)
                 
                 for r in new_idx:
-                    if pc.is_adjacent(sol[r], sol[k]):
-                        adj[r, k] = 1
-                        adj[k, r] = 1
+                    adj[i, r] = 1
+                    adj[r, i] = 1
+                    adj[r, r] = 1
+                    
+                    if not conservative:
+                        orig.append(orig[i])
+                
+                # adjacencies between pieces of isect and diff
+                for r in new_idx:
+                    for k in new_idx:
+                        if r is k:
+                            continue
+                        
+                        if not boxes.intersect(r, k):
+                            continue
+                        
+                        if pc.is_adjacent(sol[r], sol[k]):
+                            adj[r, k] = 1
+                            adj[k, r] = 1
+                
+                msg = ''
+                if logger.getEffectiveLevel() <= logging.DEBUG:
+                    msg += '\t\n Adding states ' + str(i) + ' and '
+                    for r in new_idx:
+                        msg += str(r) + ' and '
+                    msg += '\n'
+                    logger.debug(msg)
+                            
+                for k in old_adj:
+                    if k == i:
+                        continue
+                    
+                    # Every "old" neighbor must be the neighbor
+                    # of at least one of the new
+                    if boxes.intersect(i, k) and pc.is_adjacent(sol[i], sol[k]):
+                        adj[i, k] = 1
+                        adj[k, i] = 1
                     elif remove_trans and (trans_length == 1):
                         # Actively remove transitions between non-neighbors
-                        transitions[r, k] = 0
-                        transitions[k, r] = 0
+                        transitions[i, k] = 0
+                        transitions[k, i] = 0
+                    
+                    for r in new_idx:
+                        if boxes.intersect(r, k) and \
+                           pc.is_adjacent(sol[r], sol[k]):
+                            adj[r, k] = 1
+                            adj[k, r] = 1
+                        elif remove_trans and (trans_length == 1):
+                            # Actively remove transitions between non-neighbors
+                            transitions[r, k] = 0
+                            transitions[k, r] = 0
+                
+                """Update IJ matrix"""
+                adj_k.invalidate([i] + list(new_idx) )
+                sym_adj_change(IJ, adj_k, transitions, i)
+                
+                for r in new_idx:
+                    sym_adj_change(IJ, adj_k, transitions, r)
+                
+                if logger.getEffectiveLevel() <= logging.DEBUG:
+                    msg = '\n\n Updated adj: \n' + str(adj)
+                    msg += '\n\n Updated trans: \n' + str(transitions)
+                    msg += '\n\n Updated IJ: \n' + str(IJ)
+                    logger.debug(msg)
+                
+                logger.info('Divided region: ' + str(i) + '\n')
+                outcome = 'split'
+            elif vol2 < abs_tol:
+                logger.info('Found: ' + str(i) + ' ---> ' + str(j) + '\n')
+                transitions[j,i] = 1
+                outcome = 'found'
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    msg = '\t Unreachable: ' + str(i) + ' --X--> ' + str(j) + '\n'
+                    msg += '\t\t diff vol: ' + str(vol2) + '\n'
+                    msg += '\t\t intersect vol: ' + str(vol1) + '\n'
+                    logger.debug(msg)
+                else:
+                    logger.info('\t unreachable\n')
+                transitions[j,i] = 0
+                outcome = 'unreachable'
+            
+            # check to avoid overlapping Regions
+            if debug:
+                tmp_part = PropPreservingPartition(
+                    domain=part.domain,
+                    regions=sol, adj=adj.tolil(),
+                    prop_regions=part.prop_regions
+                )
+                assert(tmp_part.is_partition() )
             
-            """Update IJ matrix"""
-            IJ = np.pad(IJ, (0,num_new), 'constant')
-            adj_k = reachable_within(trans_length, adj, adj)
-            sym_adj_change(IJ, adj_k, transitions, i)
+            n_cells = len(sol)
+            progress_ratio = 1 - float(len(IJ) ) /n_cells**2
+            progress += [progress_ratio]
             
-            for r in new_idx:
-                sym_adj_change(IJ, adj_k, transitions, r)
+            msg = '\t total # polytopes: ' + str(n_cells) + '\n'
+            msg += '\t progress ratio: ' + str(progress_ratio) + '\n'
+            logger.info(msg)
             
-            if logger.getEffectiveLevel() <= logging.DEBUG:
-                msg = '\n\n Updated adj: \n' + str(adj)
-                msg += '\n\n Updated trans: \n' + str(transitions)
-                msg += '\n\n Updated IJ: \n' + str(IJ)
-                logger.debug(msg)
+            event = {
+                'iteration':iter_count,
+                'pair':[int(i), int(j)],
+                'times':times,
+                'outcome':outcome,
+                'n_cells':n_cells,
+                'n_pending':len(IJ),
+                'elapsed':elapsed0 + time.time() - start_wall
+            }
+            stats(event)
+            if callback is not None:
+                callback(event)
+            
+            iter_count += 1
+            
+            if checkpoint is not None:
+                if (checkpoint_every and iter_count % checkpoint_every == 0) or \
+                   (checkpoint_interval is not None and
+                    time.time() - last_save >= checkpoint_interval):
+                    save_state()
+                    last_save = time.time()
+            
+            # no plotting ?
+            if not plotit:
+                continue
+            if plot_partition is None:
+                continue
+            if iter_count % plot_every != 0:
+                continue
             
-            logger.info('Divided region: ' + str(i) + '\n')
-        elif vol2 < abs_tol:
-            logger.info('Found: ' + str(i) + ' ---> ' + str(j) + '\n')
-            transitions[j,i] = 1
-        else:
-            if logger.level <= logging.DEBUG:
-                msg = '\t Unreachable: ' + str(i) + ' --X--> ' + str(j) + '\n'
-                msg += '\t\t diff vol: ' + str(vol2) + '\n'
-                msg += '\t\t intersect vol: ' + str(vol1) + '\n'
-                logger.debug(msg)
-            else:
-                logger.info('\t unreachable\n')
-            transitions[j,i] = 0
-        
-        # check to avoid overlapping Regions
-        if debug:
             tmp_part = PropPreservingPartition(
                 domain=part.domain,
-                regions=sol, adj=sp.lil_matrix(adj),
+                regions=sol, adj=adj.tolil(),
                 prop_regions=part.prop_regions
             )
-            assert(tmp_part.is_partition() )
-        
-        n_cells = len(sol)
-        progress_ratio = 1 - float(np.sum(IJ) ) /n_cells**2
-        progress += [progress_ratio]
-        
-        msg = '\t total # polytopes: ' + str(n_cells) + '\n'
-        msg += '\t progress ratio: ' + str(progress_ratio) + '\n'
-        logger.info(msg)
-        
-        iter_count += 1
-        
-        # no plotting ?
-        if not plotit:
-            continue
-        if plot_partition is None:
-            continue
-        if iter_count % plot_every != 0:
-            continue
-        
-        tmp_part = PropPreservingPartition(
-            domain=part.domain,
-            regions=sol, adj=sp.lil_matrix(adj),
-            prop_regions=part.prop_regions
-        )
-        
-        # plot pair under reachability check
-        ax2.clear()
-        si_tmp.plot(ax=ax2, color='green')
-        sj_tmp.plot(ax2, color='red', hatch='o', alpha=0.5)
-        plot_transition_arrow(si_tmp, sj_tmp, ax2)
-        
-        S0.plot(ax2, color='none', hatch='/', alpha=0.3)
-        fig.canvas.draw()
-        
-        # plot partition
-        ax1.clear()
-        plot_partition(tmp_part, transitions.T, ax=ax1, color_seed=23)
-        
-        # plot dynamics
-        ssys.plot(ax1, show_domain=False)
-        
-        # plot hatched continuous propositions
-        part.plot_props(ax1)
-        
-        fig.canvas.draw()
-        
-        # scale view based on domain,
-        # not only the current polytopes si, sj
-        l,u = part.domain.bounding_box
-        ax2.set_xlim(l[0,0], u[0,0])
-        ax2.set_ylim(l[1,0], u[1,0])
-        
-        if save_img:
-            fname = 'movie' +str(iter_count).zfill(3)
-            fname += '.' + file_extension
-            fig.savefig(fname, dpi=250)
-        plt.pause(1)
-
+            
+            # plot pair under reachability check
+            ax2.clear()
+            si.plot(ax=ax2, color='green')
+            sj.plot(ax2, color='red', hatch='o', alpha=0.5)
+            plot_transition_arrow(si, sj, ax2)
+            
+            S0.plot(ax2, color='none', hatch='/', alpha=0.3)
+            fig.canvas.draw()
+            
+            # plot partition
+            ax1.clear()
+            plot_partition(tmp_part, transitions.T.todense(), ax=ax1,
+                           color_seed=23)
+            
+            # plot dynamics
+            ssys.plot(ax1, show_domain=False)
+            
+            # plot hatched continuous propositions
+            part.plot_props(ax1)
+            
+            fig.canvas.draw()
+            
+            # scale view based on domain,
+            # not only the current polytopes si, sj
+            l,u = part.domain.bounding_box
+            ax2.set_xlim(l[0,0], u[0,0])
+            ax2.set_ylim(l[1,0], u[1,0])
+            
+            if save_img:
+                fname = 'movie' +str(iter_count).zfill(3)
+                fname += '.' + file_extension
+                fig.savefig(fname, dpi=250)
+            plt.pause(1)
+    finally:
+        reach.close()
+    
+    if checkpoint is not None:
+        save_state()
+    
+    # not checked: conservatively no transition
+    unverified = IJ.peek(len(IJ) )
+    for i, j in unverified:
+        transitions[j, i] = 0
+    
+    if unverified:
+        logger.warning('discretize: ' + str(len(unverified) ) +
+                       ' pairs left unverified')
+    
     new_part = PropPreservingPartition(
         domain=part.domain,
-        regions=sol, adj=sp.lil_matrix(adj),
+        regions=sol, adj=adj.tolil(),
         prop_regions=part.prop_regions
     )
     
@@ -919,7 +1102,7 @@ def discretize(
     # Generate transition system and add transitions       
     ofts = trs.OpenFTS()
     
-    adj = sp.lil_matrix(transitions.T)
+    adj = transitions.T.tolil()
     n = adj.shape[0]
     ofts_states = range(n)
     ofts_states = trs.prepend_with(ofts_states, 's')
@@ -971,15 +1154,403 @@ def discretize(
         ppp2sys=subsys_list,
         orig_ppp=orig_ppp,
         ppp2orig=ppp2orig,
-        disc_params=param
+        disc_params=param,
+        stats=stats,
+        unverified=unverified
+    )
+
+def _prepare_partition(part, ssys, conservative):
+    """Split C{part} by PWA subsystem and convexify it for L{discretize}.
+    
+    @return: C{(part, part2orig, subsys_list, orig_list, orig)}
+    """
+    ispwa = isinstance(ssys, PwaSysDyn)
+    
+    if ispwa:
+        (part, ppp2pwa, part2orig) = pwa_partition(ssys, part)
+    else:
+        part2orig = range(len(part))
+    
+    # Save original polytopes, require them to be convex 
+    if conservative:
+        orig_list = None
+        orig = [0]
+    else:
+        (part, new2old) = part2convex(part) # convexify
+        part2orig = [part2orig[i] for i in new2old]
+        
+        # map new regions to pwa subsystems
+        if ispwa:
+            ppp2pwa = [ppp2pwa[i] for i in new2old]
+        
+        orig_list = []
+        for poly in part:
+            if len(poly) == 0:
+                orig_list.append(poly)
+            elif len(poly) == 1:
+                orig_list.append(poly[0])
+            else:
+                raise Exception("discretize: "
+                    "problem in convexification")
+        orig = range(len(orig_list))
+    
+    # next 2 lines omitted in discretize_overlap
+    if ispwa:
+        subsys_list = list(ppp2pwa)
+    else:
+        subsys_list = None
+    
+    return part, part2orig, subsys_list, orig_list, orig
+
+def _save_checkpoint(fname, params, state):
+    """Save refinement state of L{discretize}, replacing C{fname}.
+    """
+    tmp = fname + '.tmp'
+    f = gzip.open(tmp, 'wb')
+    try:
+        pickle.dump((params, state), f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    
+    # atomic on POSIX, so C{fname} is never half-written
+    os.rename(tmp, fname)
+    logger.info('saved checkpoint: ' + str(fname) )
+
+def _load_checkpoint(fname, params):
+    """Return refinement state saved by L{_save_checkpoint}.
+    
+    @raise ValueError: if the checkpoint was saved
+        with different discretization parameters
+    """
+    f = gzip.open(fname, 'rb')
+    try:
+        (saved_params, state) = pickle.load(f)
+    finally:
+        f.close()
+    
+    if saved_params != params:
+        msg = 'checkpoint: ' + str(fname) + ' saved with parameters:\n'
+        msg += pprint.pformat(saved_params) + '\n'
+        msg += 'but resuming with:\n' + pprint.pformat(params)
+        raise ValueError(msg)
+    
+    return state
+
+class _PairEvaluator(object):
+    """Compute reachable set of pairs of cells for L{discretize}.
+    
+    With C{n_jobs > 1}, the pending pairs next in line
+    are sent to a process pool before they are popped.
+    A result is used only if neither cell of the pair
+    has been refined since it was sent,
+    otherwise the pair is computed again.
+    
+    Calling the evaluator with C{(i, j)} returns
+    C{S0, isect, diff, vol1, vol2, risect, rdiff, times}.
+    
+    @param abs_tol: tolerance of L{_TranslationTemplates}
+    """
+    def __init__(
+        self, n_jobs, sol, ssys, subsys_list, orig_list, orig,
+        N, closed_loop, use_all_horizon, max_num_poly, abs_tol=1e-7
+    ):
+        if n_jobs == -1:
+            n_jobs = mp.cpu_count()
+        
+        self.sol = sol
+        self.subsys_list = subsys_list
+        self.orig_list = orig_list
+        self.orig = orig
+        self.n_jobs = n_jobs
+        
+        # incremented when cell is replaced by a piece of it
+        self._version = dict()
+        self._pending = dict()
+        
+        self._args = (ssys, orig_list, N, closed_loop,
+                      use_all_horizon, max_num_poly,
+                      _TranslationTemplates(abs_tol) )
+        
+        if n_jobs > 1:
+            self._pool = mp.Pool(
+                n_jobs, initializer=_init_reach_worker,
+                initargs=self._args
+            )
+        else:
+            self._pool = None
+    
+    def __call__(self, i, j):
+        versions = self._versions(i, j)
+        job = self._pending.pop((i, j), None)
+        
+        if job is not None and job[0] == versions:
+            return job[1].get()
+        return _check_pair(self._task(i, j), self._args)
+    
+    def speculate(self, IJ):
+        """Send the next pending pairs in C{IJ} to the pool.
+        
+        @type IJ: L{PairQueue}
+        """
+        if self._pool is None:
+            return
+        
+        for i, j in IJ.peek(2 * self.n_jobs):
+            versions = self._versions(i, j)
+            job = self._pending.get((i, j) )
+            
+            if job is not None and job[0] == versions:
+                continue
+            
+            result = self._pool.apply_async(
+                _reach_pair, (self._task(i, j), )
+            )
+            self._pending[(i, j)] = (versions, result)
+    
+    def refined(self, i):
+        """Mark cell C{i} as changed, so results for it are stale.
+        """
+        self._version[i] = self._version.get(i, 0) + 1
+        
+        for pair in [p for p in self._pending if i in p]:
+            del self._pending[pair]
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._pending = dict()
+    
+    def _versions(self, i, j):
+        return (self._version.get(i, 0), self._version.get(j, 0) )
+    
+    def _task(self, i, j):
+        if self.subsys_list is None:
+            subsys = None
+        else:
+            subsys = self.subsys_list[i]
+        
+        if self.orig_list is None:
+            orig = None
+        else:
+            orig = self.orig[i]
+        return (self.sol[i], self.sol[j], subsys, orig)
+
+# inputs shared by all pairs, set once per process
+_reach_args = None
+
+def _init_reach_worker(*args):
+    global _reach_args
+    _reach_args = args
+
+def _reach_pair(task):
+    return _check_pair(task, _reach_args)
+
+def _check_pair(task, args):
+    """Check reachability from C{si} to C{sj}.
+    
+    @param task: C{(si, sj, subsys, orig)} where:
+        C{subsys} indexes the active PWA subsystem and
+        C{orig} the original cell used as C{trans_set},
+        or they are None.
+    
+    @param args: C{(ssys, orig_list, N, closed_loop,
+        use_all_horizon, max_num_poly, templates)}, as in L{discretize},
+        where C{templates} is a L{_TranslationTemplates}
+    
+    @return: C{S0, isect, diff, vol1, vol2, risect, rdiff, times},
+        where C{times} are the seconds spent in each step,
+        see L{telemetry}
+    """
+    si, sj, subsys, orig = task
+    (ssys, orig_list, N, closed_loop,
+     use_all_horizon, max_num_poly, templates) = args
+    
+    if subsys is None:
+        ss = ssys
+    else:
+        ss = ssys.list_subsys[subsys]
+    
+    if orig is None:
+        # Don't use trans_set
+        trans_set = None
+    else:
+        # Use original cell as trans_set
+        trans_set = orig_list[orig]
+    
+    t0 = time.time()
+    S0 = templates.solve(
+        si, sj, ss, subsys, N, closed_loop,
+        use_all_horizon, trans_set, max_num_poly
     )
+    t1 = time.time()
+    
+    #logger.debug('si \cap s0')
+    isect = si.intersect(S0)
+    t2 = time.time()
+    
+    #logger.debug('si \ s0')
+    diff = si.diff(S0)
+    t3 = time.time()
+    
+    vol1 = geometry.volume(isect)
+    vol2 = geometry.volume(diff)
+    t4 = time.time()
+    
+    risect, xi = geometry.cheby_ball(isect)
+    rdiff, xd = geometry.cheby_ball(diff)
+    t5 = time.time()
+    
+    times = {
+        'solve_feasible':t1 - t0,
+        'intersect':t2 - t1,
+        'diff':t3 - t2,
+        'volume':t4 - t3,
+        'cheby_ball':t5 - t4
+    }
+    return S0, isect, diff, vol1, vol2, risect, rdiff, times
+
+class _TranslationTemplates(object):
+    """Reuse S0 of pairs of boxes that are translates of each other.
+    
+    For L{LtiSysDyn} with C{Uset} that constrains only the input,
+    if C{A c = c}, then translating both C{si} and C{sj} by C{c}
+    translates the set S0 from which C{sj} is reachable by C{c}.
+    So on a uniform grid, as made by L{add_grid},
+    one S0 is solved for each pair of box sizes and
+    relative offset of the target box,
+    and the other pairs with the same offset are looked up.
+    
+    The C{trans_set} has to translate, too,
+    so it must be C{None} (then C{si} is used),
+    or not matter, because C{N = 1}.
+    Other pairs, for example of cells that are no longer boxes
+    after refinement, are solved individually.
+    
+    @param abs_tol: tolerance for box bounds, offsets and C{A c = c},
+        the C{abs_tol} of L{discretize}
+    """
+    def __init__(self, abs_tol=1e-7):
+        self.abs_tol = abs_tol
+        self.hits = 0
+        self._templates = dict()
+    
+    def solve(
+        self, si, sj, ss, subsys, N, closed_loop,
+        use_all_horizon, trans_set, max_num_poly
+    ):
+        """Return S0 of L{solve_feasible}, from a template if possible.
+        
+        @param subsys: index of C{ss} among PWA subsystems, or None
+        """
+        key = None
+        if (trans_set is None or N == 1) and _input_only(ss):
+            key = self._key(si, sj, subsys, N, closed_loop,
+                            use_all_horizon, max_num_poly)
+        
+        found = None
+        if key is not None:
+            lower = _box_bounds(si)[0]
+            found = self._templates.get(key)
+        
+        if found is not None:
+            c = lower - found[0]
+            if np.allclose(np.dot(ss.A, c), c, atol=self.abs_tol):
+                self.hits += 1
+                return _translate(found[1], c)
+        
+        S0 = solve_feasible(
+            si, sj, ss, N, closed_loop,
+            use_all_horizon, trans_set, max_num_poly
+        )
+        
+        if key is not None and found is None:
+            self._templates[key] = (lower, S0)
+        return S0
+    
+    def _key(self, si, sj, *params):
+        box_i = _box_bounds(si, self.abs_tol)
+        box_j = _box_bounds(sj, self.abs_tol)
+        if box_i is None or box_j is None:
+            return None
+        
+        li, ui = box_i
+        lj, uj = box_j
+        
+        # equal up to abs_tol
+        d = -int(np.floor(np.log10(self.abs_tol) ))
+        offsets = [ui - li, lj - li, uj - lj]
+        return tuple(tuple(np.round(x, d) ) for x in offsets) + params
+
+def _input_only(ss):
+    """Return True if C{ss.Uset} does not constrain the state.
+    """
+    if ss.Uset is None:
+        return True
+    return ss.Uset.A.shape[1] == np.shape(ss.B)[1]
+
+def _box_bounds(region, abs_tol=1e-7):
+    """Return C{(lower, upper)} if C{region} is a box, else C{None}.
+    
+    A box is a polytope whose constraints are
+    bounds on single coordinates, on both sides.
+    """
+    if isinstance(region, pc.Region):
+        if len(region) != 1:
+            return None
+        region = region.list_poly[0]
+    
+    A = region.A
+    b = region.b
+    if A.size == 0:
+        return None
+    
+    n = A.shape[1]
+    lower = -np.inf * np.ones(n)
+    upper = np.inf * np.ones(n)
+    
+    for a, bk in zip(A, b):
+        nz = np.nonzero(np.abs(a) > abs_tol)[0]
+        if len(nz) != 1:
+            return None
+        
+        k = nz[0]
+        if a[k] > 0:
+            upper[k] = min(upper[k], bk / a[k])
+        else:
+            lower[k] = max(lower[k], bk / a[k])
+    
+    if not np.all(np.isfinite(lower) ) or not np.all(np.isfinite(upper) ):
+        return None
+    return (lower, upper)
+
+def _translate(region, c):
+    """Return C{region} translated by vector C{c}.
+    """
+    if isinstance(region, pc.Region):
+        return pc.Region(
+            [_translate(p, c) for p in region.list_poly],
+            region.props
+        )
+    
+    if region.A.size == 0:
+        return pc.Polytope()
+    return pc.Polytope(region.A, region.b + np.dot(region.A, c) )
 
 def reachable_within(trans_length, adj_k, adj):
     """Find cells reachable within trans_length hops.
+    
+    @type adj_k, adj: L{SetMatrix} or 2d C{numpy} arrays
     """
     if trans_length <= 1:
         return adj_k
     
+    if isinstance(adj_k, SetMatrix):
+        for k in xrange(1, trans_length):
+            adj_k = compose(adj_k, adj)
+        return adj_k
+    
     k = 1
     while k < trans_length:
         adj_k = np.dot(adj_k, adj)
@@ -989,11 +1560,28 @@ def reachable_within(trans_length, adj_k, adj):
     return adj_k
 
 def sym_adj_change(IJ, adj_k, transitions, i):
-    horizontal = adj_k[i, :] -transitions[i, :] > 0
-    vertical = adj_k[:, i] -transitions[:, i] > 0
+    """Update pending pairs that involve region C{i}.
     
-    IJ[i, :] = horizontal.astype(int)
-    IJ[:, i] = vertical.astype(int)
+    A pair is pending if it is within C{adj_k}
+    and its transition has not been found yet.
+    
+    @type IJ: L{PairQueue}
+    @type adj_k: L{SetMatrix} or L{KHopNeighbors}
+    @type transitions: L{SetMatrix}
+    """
+    # k ---> i
+    horizontal = adj_k.row(i).difference(transitions.row(i) )
+    # i ---> k
+    vertical = adj_k.col(i).difference(transitions.col(i) )
+    
+    pending = {(k, i) for k in horizontal}
+    pending.update((i, k) for k in vertical)
+    
+    for pair in IJ.pairs_of(i).difference(pending):
+        IJ.discard(*pair)
+    
+    for pair in sorted(pending):
+        IJ.push(*pair)
 
 # DEFUNCT until further notice
 def discretize_overlap(closed_loop=False, conservative=False):
@@ -1077,89 +1665,123 @@ def discretize_overlap(closed_loop=False, conservative=False):
 #                    original_regions=orig_list, orig=orig)                           
 #     return new_part
 
-def multiproc_discretize(q, mode, ppp, cont_dyn, disc_params):
-    global logger
-    logger = mp.log_to_stderr()
-    
-    name = mp.current_process().name
-    print('Abstracting mode: ' + str(mode) + ', on: ' + str(name))
+# inputs shared by all tasks of a switched system, set once per process
+_switched_args = None
+
+def _init_switched_worker(*args):
+    global _switched_args
+    _switched_args = args
+
+def _discretize_mode(task):
+    """Abstract one mode, in a worker of L{multiproc_discretize_switched}.
     
-    absys = discretize(ppp, cont_dyn, **disc_params)
+    Pool workers are daemonic, so cannot start a pool of their own:
+    the pairs of each mode are checked serially.
+    """
+    mode, params = task
+    ppp, hybrid_sys = _switched_args
     
-    q.put((mode, absys))
-    print('Worker: ' + str(name) + 'finished.')
-
-def multiproc_get_transitions(
-    q, absys, mode, ssys, params
-):
-    global logger
-    logger = mp.log_to_stderr()
+    params = dict(params)
+    params['n_jobs'] = 1
     
     name = mp.current_process().name
-    print('Merged transitions for mode: ' + str(mode) + ', on: ' + str(name))
+    logger.info('Abstracting mode: ' + str(mode) + ', on: ' + str(name))
     
-    trans = get_transitions(absys, mode, ssys, **params)
+    return discretize(ppp, hybrid_sys.dynamics[mode], **params)
+
+def _mode_transitions(task):
+    """Check a chunk of source regions, in a pool worker.
     
-    q.put((mode, trans))
-    print('Worker: ' + str(name) + 'finished.')
+    See L{_check_chunk}.
+    """
+    (merged_abstr, ) = _switched_args
+    return _check_chunk(merged_abstr, task)
+
+def _chunks(items, size):
+    return [items[k:k + size] for k in xrange(0, len(items), size)]
 
 def multiproc_discretize_switched(
     ppp, hybrid_sys, disc_params=None,
-    plot=False, show_ts=False, only_adjacent=True
+    plot=False, show_ts=False, only_adjacent=True,
+    checkpoint_dir=None, n_jobs=-1, chunk_size=None
 ):
     """Parallel implementation of discretize_switched.
     
-    Uses the multiprocessing package.
+    Uses a pool of C{n_jobs} processes of the multiprocessing package.
+    Each worker receives the partition and the dynamics once,
+    when it starts (inherited when the platform forks),
+    so tasks carry only a mode and region indices.
+    
+    Modes are abstracted as one task each.
+    Transitions over the merged partition are checked
+    in tasks of C{chunk_size} source regions of one mode,
+    so idle workers take the remaining chunks of any mode.
+    Results are collected in a fixed order,
+    so the abstraction does not depend on scheduling.
+    
+    For the other parameters, see L{discretize_switched}.
+    
+    @param n_jobs: number of worker processes,
+        -1 to use all CPUs
+    @type n_jobs: int
+    
+    @param chunk_size: source regions per transition task,
+        if C{None}, then about 4 tasks per worker for each mode
+    @type chunk_size: int
     """
     logger.info('parallel discretize_switched started')
     
     modes = hybrid_sys.modes
     mode_nums = hybrid_sys.disc_domain_size
     
-    q = mp.Queue()
-    
-    mode_args = dict()
-    for mode in modes:
-        cont_dyn = hybrid_sys.dynamics[mode]
-        mode_args[mode] = (q, mode, ppp, cont_dyn, disc_params[mode])
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
     
-    jobs = [mp.Process(target=multiproc_discretize, args=args)
-            for args in mode_args.itervalues()]
-    for job in jobs:
-        job.start()
-    
-    # flush before join:
-    #   http://stackoverflow.com/questions/19071529/
-    abstractions = dict()
-    for job in jobs:
-        mode, absys = q.get()
-        abstractions[mode] = absys
+    tasks = [
+        (mode, _mode_checkpoint(disc_params[mode], mode, checkpoint_dir))
+        for mode in modes
+    ]
     
-    for job in jobs:
-        job.join()
+    pool = mp.Pool(
+        min(n_jobs, len(tasks)), initializer=_init_switched_worker,
+        initargs=(ppp, hybrid_sys)
+    )
+    try:
+        abstractions = dict(zip(
+            modes, pool.map(_discretize_mode, tasks, chunksize=1)
+        ))
+    finally:
+        pool.close()
+        pool.join()
     
     # merge their domains
-    (merged_abstr, ap_labeling) = merge_partitions(abstractions)
+    (merged_abstr, ap_labeling) = multiproc_merge_partitions(
+        abstractions, n_jobs
+    )
     n = len(merged_abstr.ppp)
     logger.info('Merged partition has: ' + str(n) + ', states')
     
     # find feasible transitions over merged partition
+    tasks = []
+    inferred = dict()
     for mode in modes:
-        cont_dyn = hybrid_sys.dynamics[mode]
         params = disc_params[mode]
-        
-        mode_args[mode] = (q, merged_abstr, mode, cont_dyn, params)
-    
-    jobs = [mp.Process(target=multiproc_get_transitions, args=args)
-            for args in mode_args.itervalues()]
+        targets = _transition_targets(
+            merged_abstr.ppp, params['trans_length']
+        )
+        inferred[mode], sources = _infer_transitions(
+            merged_abstr, mode, targets,
+            params['N'], True, params['trans_length']
+        )
+        tasks.append((mode, sources, params['N'], True) )
     
-    for job in jobs:
-        job.start()
+    checked = _check_transitions(merged_abstr, tasks, n_jobs, chunk_size)
     
     trans = dict()
-    for job in jobs:
-        mode, t = q.get()
-        trans[mode] = t
+    for mode in modes:
+        trans[mode] = _transition_matrix(
+            n, sorted(checked[mode] + inferred[mode])
+        )
     
     # merge the abstractions, creating a common TS
     merge_abstractions(merged_abstr, trans,
@@ -1172,7 +1794,8 @@ def multiproc_discretize_switched(
 
 def discretize_switched(
     ppp, hybrid_sys, disc_params=None,
-    plot=False, show_ts=False, only_adjacent=True
+    plot=False, show_ts=False, only_adjacent=True,
+    checkpoint_dir=None
 ):
     """Abstract switched dynamics over given partition.
     
@@ -1190,6 +1813,12 @@ def discretize_switched(
     
     @param show_ts, only_adjacent: options for L{AbstractPwa.plot}.
     
+    @param checkpoint_dir: directory for one checkpoint file per mode,
+        passed as C{checkpoint} to L{discretize}.
+        Modes with an existing file there are resumed from it,
+        so rerunning after a crash repeats no finished work.
+    @type checkpoint_dir: str
+    
     @return: abstracted dynamics,
         some attributes are dict keyed by mode
     @rtype: L{AbstractSwitched}
@@ -1209,10 +1838,11 @@ def discretize_switched(
         logger.info('Abstracting mode: ' + str(mode))
         
         cont_dyn = hybrid_sys.dynamics[mode]
+        params = _mode_checkpoint(disc_params[mode], mode, checkpoint_dir)
         
         absys = discretize(
             ppp, cont_dyn,
-            **disc_params[mode]
+            **params
         )
         logger.debug('Mode Abstraction:\n' + str(absys) +'\n')
         
@@ -1244,6 +1874,27 @@ def discretize_switched(
     
     return merged_abstr
 
+def _mode_checkpoint(params, mode, checkpoint_dir):
+    """Return copy of C{params} that checkpoints C{mode}.
+    """
+    if checkpoint_dir is None:
+        return params
+    
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    
+    if isinstance(mode, tuple):
+        name = '_'.join(str(x) for x in mode)
+    else:
+        name = str(mode)
+    fname = os.path.join(checkpoint_dir, 'mode_' + name + '.ckpt')
+    
+    params = dict(params)
+    params['checkpoint'] = fname
+    if os.path.isfile(fname):
+        params['resume_from'] = fname
+    return params
+
 def plot_mode_partitions(swab, show_ts, only_adjacent):
     """Save each mode's partition and final merged partition.
     """
@@ -1349,86 +2000,393 @@ def merge_abstractions(merged_abstr, trans, abstr, modes, mode_nums):
 def get_transitions(
     abstract_sys, mode, ssys, N=10,
     closed_loop=True,
-    trans_length=1
+    trans_length=1,
+    n_jobs=1
 ):
     """Find which transitions are feasible in given mode.
     
     Used for the candidate transitions of the merged partition.
     
+    Pairs whose answer follows from the transitions
+    between their parent regions in the abstraction of C{mode}
+    are not checked, see L{_infer_transitions}.
+    
+    @param n_jobs: number of processes that check the other pairs,
+        -1 to use all CPUs
+    @type n_jobs: int
+    
     @rtype: scipy.sparse.lil_matrix
     """
     logger.info('checking which transitions remain feasible after merging')
     part = abstract_sys.ppp
     
-    # Initialize matrix for pairs to check
-    IJ = part.adj.copy()
-    if trans_length > 1:
-        k = 1
-        while k < trans_length:
-            IJ = np.dot(IJ, part.adj)
-            k += 1
-        IJ = (IJ > 0).astype(int)
-    
-    # Initialize output
-    n = len(part)
-    transitions = sp.lil_matrix((n, n), dtype=int)
+    targets = _transition_targets(part, trans_length)
+    inferred, sources = _infer_transitions(
+        abstract_sys, mode, targets, N, closed_loop, trans_length
+    )
     
     # Do the abstraction
-    n_checked = 0
-    n_found = 0
-    while np.sum(IJ) > 0:
-        n_checked += 1
-        
-        ind = np.nonzero(IJ)
-        i = ind[1][0]
-        j = ind[0][0]
-        IJ[j,i] = 0
-        
-        logger.debug('checking transition: ' + str(i) + ' -> ' + str(j))
-        
-        si = part[i]
-        sj = part[j]
+    checked = _check_transitions(
+        abstract_sys, [(mode, sources, N, closed_loop)], n_jobs
+    )[mode]
+    return _transition_matrix(len(part), sorted(checked + inferred) )
+
+def _infer_transitions(
+    abstract_sys, mode, targets, N, closed_loop, trans_length
+):
+    """Decide candidate transitions from those of parent regions.
+    
+    Each merged region is a subset of a region (its parent)
+    of the abstraction of C{mode}, which already decided
+    the transitions between parents. So, for a pair C{i -> j}:
+    
+      - if the parent of C{i} has no transition to the parent of C{j},
+        then C{i -> j} is not feasible,
+        as in the abstraction of C{mode}.
+    
+      - if the parent of C{i} has a transition to the parent of C{j},
+        and C{j} is the only merged region in the parent of C{j},
+        then C{i -> j} is feasible,
+        because C{i} is a subset of its parent.
+    
+    The parents are used only if the abstraction of C{mode}
+    was computed with the same C{N} and C{closed_loop}
+    and at least C{trans_length}.
+    Pairs of parents it did not verify are always checked.
+    
+    @param targets: candidate targets, keyed by source,
+        as returned by L{_transition_targets}
+    
+    @return: C{(inferred, sources)} where:
+        - C{inferred}: list of C{(i, to_check, feasible)}
+        - C{sources}: list of C{(i, to_check)} still to be checked
+    """
+    ab = abstract_sys.modes[mode]
+    params = ab.disc_params
+    
+    use_parents = (
+        params.get('N') == N and
+        params.get('closed_loop') == closed_loop and
+        params.get('trans_length', 0) >= trans_length
+    )
+    if not use_parents:
+        sources = [(i, targets[i]) for i in sorted(targets)]
+        return ([], sources)
+    
+    parents = abstract_sys.ppp2modes[mode]
+    
+    state2region = dict((s, k) for k, s in enumerate(ab.ppp2ts) )
+    parent_trans = set(
+        (state2region[u], state2region[v])
+        for u, v in ab.ts.transitions()
+    )
+    unverified = set(ab.unverified)
+    
+    n_children = dict()
+    for i in xrange(len(abstract_sys.ppp) ):
+        pi = parents[i]
+        n_children[pi] = n_children.get(pi, 0) + 1
+    
+    inferred = []
+    sources = []
+    for i in sorted(targets):
+        known = []
+        feasible = []
+        to_check = []
+        for j in targets[i]:
+            pair = (parents[i], parents[j])
+            
+            if pair in unverified:
+                to_check.append(j)
+            elif pair not in parent_trans:
+                known.append(j)
+                feasible.append(False)
+            elif n_children[parents[j]] == 1:
+                known.append(j)
+                feasible.append(True)
+            else:
+                to_check.append(j)
         
-        # Use original cell as trans_set
-        trans_set = abstract_sys.ppp2pwa(mode, i)[1]
-        active_subsystem = abstract_sys.ppp2sys(mode, i)[1]
+        if known:
+            inferred.append((i, known, feasible) )
+        if to_check:
+            sources.append((i, to_check) )
+    
+    n_inferred = sum(len(known) for i, known, feasible in inferred)
+    logger.info('Inferred from parent regions: ' + str(n_inferred) )
+    
+    return (inferred, sources)
+
+def _check_transitions(abstract_sys, tasks, n_jobs=1, chunk_size=None):
+    """Check transitions of source regions, possibly on a process pool.
+    
+    The sources of each task are split in chunks of C{chunk_size},
+    so idle workers take the remaining chunks of any mode.
+    
+    @param tasks: C{(mode, sources, N, closed_loop)},
+        where C{sources} is a list of C{(i, to_check)}
+    
+    @param chunk_size: source regions per chunk,
+        if C{None}, then about 4 chunks per worker for each task
+    
+    @return: C{(i, to_check, feasible)} for each source,
+        as lists keyed by mode
+    @rtype: dict
+    """
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
+    
+    chunks = []
+    for mode, sources, N, closed_loop in tasks:
+        size = chunk_size
+        if size is None:
+            size = max(1, len(sources) // (4 * n_jobs) )
         
-        trans_feasible = is_feasible(
-            si, sj, active_subsystem, N,
-            closed_loop = closed_loop,
-            trans_set = trans_set
-        )
-                    
-        if trans_feasible:
-            transitions[i, j] = 1 
-            msg = '\t Feasible transition.'
-            n_found += 1
-        else:
-            transitions[i, j] = 0
-            msg = '\t Not feasible transition.'
-        logger.debug(msg)
+        for chunk in _chunks(sources, size):
+            chunks.append((mode, chunk, N, closed_loop) )
+    
+    checked = dict((task[0], []) for task in tasks)
+    
+    if n_jobs <= 1 or len(chunks) < 2:
+        for chunk in chunks:
+            mode, result = _check_chunk(abstract_sys, chunk)
+            checked[mode].extend(result)
+        return checked
+    
+    pool = mp.Pool(
+        n_jobs, initializer=_init_switched_worker,
+        initargs=(abstract_sys, )
+    )
+    try:
+        for mode, result in pool.imap_unordered(_mode_transitions, chunks):
+            checked[mode].extend(result)
+    finally:
+        pool.close()
+        pool.join()
+    return checked
+
+def _check_chunk(abstract_sys, task):
+    """Check a chunk of source regions of the merged partition.
+    
+    @param task: C{(mode, chunk, N, closed_loop)}
+    
+    @return: C{(mode, checked)} where C{checked} is
+        a list of C{(i, to_check, feasible)},
+        as returned by L{_source_transitions}
+    """
+    mode, chunk, N, closed_loop = task
+    
+    checked = [
+        (i, to_check, _source_transitions(
+            abstract_sys, mode, i, to_check, N, closed_loop
+        ))
+        for i, to_check in chunk
+    ]
+    return (mode, checked)
+
+def _transition_targets(part, trans_length):
+    """Return candidate targets of each region, within C{trans_length}.
+    
+    @rtype: dict of sorted lists, keyed by source region
+    """
+    adj = SetMatrix.from_sparse(part.adj)
+    adj_k = reachable_within(trans_length, adj, adj)
+    
+    targets = dict()
+    for j, i in adj_k.nonzero():
+        targets.setdefault(i, []).append(j)
+    
+    for i in targets:
+        targets[i].sort()
+    return targets
+
+def _source_transitions(abstract_sys, mode, i, to_check, N, closed_loop):
+    """Return feasibility of transitions from region C{i} to C{to_check}.
+    
+    @rtype: list of bool
+    """
+    part = abstract_sys.ppp
+    
+    logger.debug('checking transitions: ' + str(i) +
+                 ' -> ' + str(to_check) )
+    
+    si = part[i]
+    
+    # Use original cell as trans_set
+    trans_set = abstract_sys.ppp2pwa(mode, i)[1]
+    active_subsystem = abstract_sys.ppp2sys(mode, i)[1]
+    
+    return is_feasible_many(
+        si, [part[j] for j in to_check],
+        active_subsystem, N,
+        closed_loop = closed_loop,
+        trans_set = trans_set
+    )
+
+def _transition_matrix(n, checked):
+    """Return transitions found by L{_source_transitions}.
+    
+    @param checked: C{(i, to_check, feasible)} for each source C{i}
+    
+    @rtype: scipy.sparse.lil_matrix
+    """
+    transitions = SetMatrix(n)
+    
+    n_checked = 0
+    n_found = 0
+    for i, to_check, feasible in checked:
+        for j, trans_feasible in zip(to_check, feasible):
+            n_checked += 1
+            
+            if trans_feasible:
+                transitions[i, j] = 1
+                msg = '\t Feasible transition: '
+                n_found += 1
+            else:
+                transitions[i, j] = 0
+                msg = '\t Not feasible transition: '
+            logger.debug(msg + str(i) + ' -> ' + str(j) )
     logger.info('Checked: ' + str(n_checked))
     logger.info('Found: ' + str(n_found))
     logger.info('Survived merging: ' + str(float(n_found) / n_checked) + ' % ')
-            
-    return transitions
+    
+    return transitions.tolil()
 
-def multiproc_merge_partitions(abstractions):
-    """LOGTIME in #processors parallel merging.
+def multiproc_merge_partitions(abstractions, n_jobs=-1, chunk_size=None):
+    """Merge multiple abstractions, in parallel.
+    
+    The partitions of the modes are merged pairwise,
+    as a tree of depth logarithmic in the number of modes.
+    Each merge of two partitions is split into tasks of
+    C{chunk_size} regions of the first partition,
+    which run on a pool of C{n_jobs} processes.
+    The adjacency of the merged regions is checked on a pool, too.
+    
+    The merged regions are the same as with L{merge_partitions},
+    possibly in a different order.
+    
+    @param abstractions: keyed by mode
+    @type abstractions: dict of L{AbstractPwa}
+    
+    @param n_jobs: number of worker processes,
+        -1 to use all CPUs
+    @type n_jobs: int
+    
+    @param chunk_size: regions of the first partition per task,
+        if C{None}, then about 4 tasks per worker in each level
+    @type chunk_size: int
+    
+    @return: (merged_abstraction, ap_labeling),
+        as returned by L{merge_partitions}
+    """
+    if len(abstractions) == 0:
+        warnings.warn('Abstractions empty, nothing to merge.')
+        return
     
-    Assuming sufficient number of processors.
+    _check_mergeable(abstractions)
+    
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
+    
+    level = [
+        _mode_partition(ab, mode)
+        for mode, ab in abstractions.iteritems()
+    ]
+    
+    pool = mp.Pool(n_jobs)
+    try:
+        while len(level) > 1:
+            pairs = [
+                (level[k], level[k + 1])
+                for k in xrange(0, len(level) - 1, 2)
+            ]
+            
+            size = chunk_size
+            if size is None:
+                n = sum(len(left[0]) for left, right in pairs)
+                size = max(1, n // (4 * n_jobs) )
+            
+            tasks = []
+            for k, (left, right) in enumerate(pairs):
+                for chunk in _split_partition(left, size):
+                    tasks.append((k, chunk, right) )
+            
+            pieces = [[] for pair in pairs]
+            for k, merged in pool.imap(_intersect_task, tasks):
+                pieces[k].append(merged)
+            
+            merged_level = [_join_partitions(p) for p in pieces]
+            if len(level) % 2 == 1:
+                merged_level.append(level[-1])
+            level = merged_level
+    finally:
+        pool.close()
+        pool.join()
+    
+    regions, parents, ap_labeling = level[0]
+    abstraction = _merged_abstraction(
+        abstractions, regions, parents, n_jobs
+    )
+    return (abstraction, ap_labeling)
 
-    UNDER DEVELOPMENT; function signature may change without notice.
-    Calling will result in NotImplementedError.
+def _intersect_task(task):
+    k, left, right = task
+    return (k, _intersect_partitions(left, right) )
+
+def _mode_partition(ab, mode):
+    """Return C{(regions, parents, ap_labeling)} of one mode.
     """
-    raise NotImplementedError
+    regions = list(ab.ppp)
+    parents = {mode:dict((i, i) for i in xrange(len(regions) ))}
+    ap_labeling = {i:reg.props for i, reg in enumerate(regions)}
+    return (regions, parents, ap_labeling)
+
+def _split_partition(part, size):
+    """Split C{(regions, parents, ap_labeling)} in chunks of C{size}.
+    """
+    regions, parents, ap_labeling = part
+    
+    chunks = []
+    for start in xrange(0, len(regions), size):
+        idx = range(start, min(start + size, len(regions) ))
+        chunks.append((
+            [regions[i] for i in idx],
+            {mode:dict((k, p[i]) for k, i in enumerate(idx))
+             for mode, p in parents.iteritems()},
+            dict((k, ap_labeling[i]) for k, i in enumerate(idx))
+        ))
+    return chunks
 
-def merge_partitions(abstractions):
+def _join_partitions(parts):
+    """Concatenate C{(regions, parents, ap_labeling)} in order.
+    """
+    regions = []
+    parents = {mode:dict() for mode in parts[0][1]}
+    ap_labeling = dict()
+    
+    for part_regions, part_parents, part_labeling in parts:
+        offset = len(regions)
+        regions.extend(part_regions)
+        
+        for mode, p in part_parents.iteritems():
+            for i, j in p.iteritems():
+                parents[mode][offset + i] = j
+        
+        for i, label in part_labeling.iteritems():
+            ap_labeling[offset + i] = label
+    return (regions, parents, ap_labeling)
+
+def merge_partitions(abstractions, n_jobs=1):
     """Merge multiple abstractions.
     
     @param abstractions: keyed by mode
     @type abstractions: dict of L{AbstractPwa}
     
+    @param n_jobs: number of processes that check
+        adjacency of the merged regions,
+        -1 to use all CPUs
+    @type n_jobs: int
+    
     @return: (merged_abstraction, ap_labeling)
         where:
             - merged_abstraction: L{AbstractSwitched}
@@ -1438,24 +2396,7 @@ def merge_partitions(abstractions):
         warnings.warn('Abstractions empty, nothing to merge.')
         return
     
-    # consistency check
-    for ab1 in abstractions.itervalues():
-        for ab2 in abstractions.itervalues():
-            p1 = ab1.ppp
-            p2 = ab2.ppp
-            
-            if p1.prop_regions != p2.prop_regions:
-                msg = 'merge: partitions have different sets '
-                msg += 'of continuous propositions'
-                raise Exception(msg)
-            
-            if not (p1.domain.A == p2.domain.A).all() or \
-            not (p1.domain.b == p2.domain.b).all():
-                raise Exception('merge: partitions have different domains')
-            
-            # check equality of original PPP partitions
-            if ab1.orig_ppp == ab2.orig_ppp:
-                logger.info('original partitions happen to be equal')
+    _check_mergeable(abstractions)
     
     init_mode = abstractions.keys()[0]
     all_modes = set(abstractions)
@@ -1481,7 +2422,41 @@ def merge_partitions(abstractions):
         )
         regions, parents, ap_labeling = r
         prev_modes += [cur_mode]
-    new_list = regions
+    
+    abstraction = _merged_abstraction(
+        abstractions, regions, parents, n_jobs
+    )
+    return (abstraction, ap_labeling)
+
+def _check_mergeable(abstractions):
+    """Raise Exception if the partitions cannot be merged.
+    """
+    for ab1 in abstractions.itervalues():
+        for ab2 in abstractions.itervalues():
+            p1 = ab1.ppp
+            p2 = ab2.ppp
+            
+            if p1.prop_regions != p2.prop_regions:
+                msg = 'merge: partitions have different sets '
+                msg += 'of continuous propositions'
+                raise Exception(msg)
+            
+            if not (p1.domain.A == p2.domain.A).all() or \
+            not (p1.domain.b == p2.domain.b).all():
+                raise Exception('merge: partitions have different domains')
+            
+            # check equality of original PPP partitions
+            if ab1.orig_ppp == ab2.orig_ppp:
+                logger.info('original partitions happen to be equal')
+
+def _merged_abstraction(abstractions, new_list, parents, n_jobs=1):
+    """Return L{AbstractSwitched} over merged regions C{new_list}.
+    
+    @param n_jobs: number of processes that check adjacency,
+        -1 to use all CPUs
+    @type n_jobs: int
+    """
+    ab0 = abstractions.itervalues().next()
     
     # build adjacency based on spatial adjacencies of
     # component abstractions.
@@ -1491,27 +2466,16 @@ def merge_partitions(abstractions):
 	# regions are adjacent in the switched dynamics.
     n_reg = len(new_list)
     
-    adj = np.zeros([n_reg, n_reg], dtype=int)
-    for i, reg_i in enumerate(new_list):
-        for j, reg_j in enumerate(new_list[0:i]):
-            touching = False
-            for mode in abstractions:
-                pi = parents[mode][i]
-                pj = parents[mode][j]
-                
-                part = abstractions[mode].ppp
-                
-                if (part.adj[pi, pj] == 1) or (pi == pj):
-                    touching = True
-                    break
-            
-            if not touching:
-                continue
-            
-            if pc.is_adjacent(reg_i, reg_j):
-                adj[i,j] = 1
-                adj[j,i] = 1
-        adj[i,i] = 1
+    adj = sp.lil_matrix((n_reg, n_reg), dtype=np.int8)
+    for i, j in _adjacent_pairs(
+        new_list, _merged_candidates(abstractions, new_list, parents),
+        n_jobs
+    ):
+        adj[i, j] = 1
+        adj[j, i] = 1
+    
+    for i in xrange(n_reg):
+        adj[i, i] = 1
     
     ppp = PropPreservingPartition(
         domain=ab0.ppp.domain,
@@ -1526,7 +2490,68 @@ def merge_partitions(abstractions):
         ppp2modes=parents,
     )
     
-    return (abstraction, ap_labeling)
+    return abstraction
+
+def _merged_candidates(abstractions, new_list, parents):
+    """Return pairs of merged regions that may be adjacent.
+    
+    Pairs are found from the adjacent parents in each mode,
+    by looking up the merged regions of each parent,
+    so the work is proportional to the number of
+    adjacent parent pairs, not to the square of C{len(new_list)}.
+    Pairs with disjoint bounding boxes are dropped.
+    
+    @rtype: sorted list of C{(i, j)} with C{j < i}
+    """
+    boxes = BoxIndex(new_list)
+    
+    candidates = set()
+    for mode, ab in abstractions.iteritems():
+        children = dict()
+        for i in xrange(len(new_list) ):
+            children.setdefault(parents[mode][i], []).append(i)
+        
+        parent_adj = SetMatrix.from_sparse(ab.ppp.adj)
+        for pi, ci in children.iteritems():
+            for pj in parent_adj.row(pi) | set([pi]):
+                for i in ci:
+                    for j in children.get(pj, []):
+                        if j < i and boxes.intersect(i, j):
+                            candidates.add((i, j) )
+    return sorted(candidates)
+
+def _adjacent_pairs(regions, pairs, n_jobs=1):
+    """Return those C{pairs} of C{regions} that are adjacent.
+    
+    With C{n_jobs > 1}, the pairs are checked
+    in chunks on a process pool.
+    """
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
+    
+    if n_jobs <= 1 or len(pairs) < 2:
+        return _adjacent_in(regions, pairs)
+    
+    size = max(1, len(pairs) // (4 * n_jobs) )
+    
+    pool = mp.Pool(
+        n_jobs, initializer=_init_switched_worker,
+        initargs=(regions, )
+    )
+    try:
+        found = pool.map(_adjacent_task, _chunks(pairs, size) )
+    finally:
+        pool.close()
+        pool.join()
+    return [pair for chunk in found for pair in chunk]
+
+def _adjacent_in(regions, pairs):
+    return [(i, j) for i, j in pairs
+            if pc.is_adjacent(regions[i], regions[j])]
+
+def _adjacent_task(pairs):
+    (regions, ) = _switched_args
+    return _adjacent_in(regions, pairs)
 
 def merge_partition_pair(
     old_regions, ab2,
@@ -1570,18 +2595,50 @@ def merge_partition_pair(
     logger.info('merging partitions')
 
     part2 = ab2.ppp
+    n = len(part2)
+    
+    left = (
+        old_regions,
+        {mode:old_parents[mode] for mode in prev_modes},
+        old_ap_labeling
+    )
+    right = (
+        list(part2),
+        {cur_mode:dict((j, j) for j in xrange(n))},
+        dict((j, ab2.ts.states['s'+str(j)]['ap']) for j in xrange(n))
+    )
+    return _intersect_partitions(left, right)
+
+def _intersect_partitions(left, right):
+    """Intersect the regions of two partial merges.
+    
+    Only pairs of regions whose bounding boxes intersect
+    are passed to C{pc.intersect}.
+    
+    @param left, right: C{(regions, parents, ap_labeling)},
+        where C{parents} is keyed by the modes merged so far
+    
+    @return: C{(regions, parents, ap_labeling)} of
+        the full-dimensional intersections,
+        ordered by region in C{left}, then in C{right}
+    """
+    regions1, parents1, ap_labeling1 = left
+    regions2, parents2, ap_labeling2 = right
     
-    modes = prev_modes + [cur_mode]
+    n1 = len(regions1)
+    n2 = len(regions2)
+    boxes = BoxIndex(list(regions1) + list(regions2) )
     
     new_list = []
-    parents = {mode:dict() for mode in modes}
+    parents = {mode:dict() for mode in parents1.keys() + parents2.keys()}
     ap_labeling = dict()
     
-    for i in xrange(len(old_regions)):
-        for j in xrange(len(part2)):
-            isect = pc.intersect(old_regions[i],
-                                 part2[j])
-            rc, xc = pc.cheby_ball(isect)
+    for i in xrange(n1):
+        candidates = boxes.overlapping(i, among=xrange(n1, n1 + n2) )
+        for j in sorted(k - n1 for k in candidates):
+            isect = pc.intersect(regions1[i],
+                                 regions2[j])
+            rc, xc = geometry.cheby_ball(isect)
             
             # no intersection ?
             if rc < 1e-5:
@@ -1594,19 +2651,20 @@ def merge_partition_pair(
                 isect = pc.Region([isect])
             
             # label the Region with propositions
-            isect.props = old_regions[i].props.copy()
+            isect.props = regions1[i].props.copy()
             
+            idx = len(new_list)
             new_list.append(isect)
-            idx = new_list.index(isect)
             
             # keep track of parents
-            for mode in prev_modes:
-                parents[mode][idx] = old_parents[mode][i]
-            parents[cur_mode][idx] = j
+            for mode, p in parents1.iteritems():
+                parents[mode][idx] = p[i]
+            for mode, p in parents2.iteritems():
+                parents[mode][idx] = p[j]
             
             # union of AP labels from parent states
-            ap_label_1 = old_ap_labeling[i]
-            ap_label_2 = ab2.ts.states['s'+str(j)]['ap']
+            ap_label_1 = ap_labeling1[i]
+            ap_label_2 = ap_labeling2[j]
             
             logger.debug('AP label 1: ' + str(ap_label_1))
             logger.debug('AP label 2: ' + str(ap_label_2))
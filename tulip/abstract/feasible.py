@@ -35,7 +35,12 @@ Check Linear Discrete-Time-Invariant System reachability between polytopes
     
 Primary functions:
     - L{solve_feasible}
+    - L{solve_feasible_many}
+    - L{set_reach_cache}
+    - L{poly_to_poly}
+    - L{select_projection}
     - L{createLM}
+    - L{horizon_model}
     - L{get_max_extreme}
 
 See Also
@@ -50,26 +55,36 @@ from collections import Iterable
 import numpy as np
 import polytope as pc
 
+from . import geometry
+from . import optimization
+from .cache import ReachCache, dynamics_digest
+
+# results of reachability stored on disk, see set_reach_cache
+_reach_cache = None
+
 def is_feasible(
     from_region, to_region, sys, N,
     closed_loop=True,
     use_all_horizon=False,
-    trans_set=None
+    trans_set=None,
+    projection=None,
+    solver=None
 ):
     """Return True if to_region is reachable from_region.
     
-    For details see solve_feasible.
+    For details see solve_feasible and L{is_feasible_many}.
     """
-    S0 = solve_feasible(
-        from_region, to_region, sys, N,
+    return is_feasible_many(
+        from_region, [to_region], sys, N,
         closed_loop, use_all_horizon,
-        trans_set
-    )
-    return from_region <= S0
+        trans_set, projection=projection,
+        solver=solver
+    )[0]
 
 def solve_feasible(
     P1, P2, ssys, N=1, closed_loop=True,
-    use_all_horizon=False, trans_set=None, max_num_poly=5
+    use_all_horizon=False, trans_set=None, max_num_poly=5,
+    projection=None
 ):
     """Compute S0 \subseteq P1 from which P2 is N-reachable.
     
@@ -95,25 +110,170 @@ def solve_feasible(
         then force transitions to be in this set.
         Otherwise, P1 is used.
     
+    @param projection: how the lifted polytope is projected
+        onto the state space, see L{poly_to_poly}
+    
     @return: the subset S0 of P1 from which P2 is reachable
     @rtype: C{Polytope} or C{Region}
     """
-    if closed_loop:
-        return solve_closed_loop(
-            P1, P2, ssys, N,
-            use_all_horizon=use_all_horizon,
-            trans_set=trans_set
-        )
-    else:
-        return solve_open_loop(
-            P1, P2, ssys, N,
-            trans_set=trans_set,
-            max_num_poly=max_num_poly
-        )
+    return solve_feasible_many(
+        P1, [P2], ssys, N, closed_loop,
+        use_all_horizon, trans_set, max_num_poly,
+        projection
+    )[0]
+
+def is_feasible_many(
+    from_region, to_regions, sys, N,
+    closed_loop=True,
+    use_all_horizon=False,
+    trans_set=None,
+    projection=None,
+    solver=None
+):
+    """Return list of bool, True where to_regions[k] is reachable.
+    
+    Same as C{from_region <= S0} for each S0
+    of L{solve_feasible_many}.
+    
+    If C{from_region} is a polytope, then the containment
+    is decided from its vertices where possible,
+    before S0 is complete:
+    
+      - a vertex from which the target is not reachable
+        refutes containment
+      - a set in the union S0 that contains all vertices
+        proves containment
+    
+    Whether a vertex is in the set of the last step is found
+    by one LP on the lifted constraints, see L{createLM},
+    so the last projection is skipped.
+    For the open-loop algorithm it is the only one.
+    S0 is completed only for undecided targets.
+    
+    The LPs of the vertices are warm started
+    from the solution for the previous target,
+    if the backend supports it, see L{optimization}.
+    The default backend C{'glpk'} does not.
+    
+    @param solver: LP backend, see L{optimization}
+    
+    For the other arguments see L{solve_feasible}.
+    
+    @rtype: list of bool
+    """
+    def solve(to_regions):
+        if closed_loop:
+            return _closed_loop_many(
+                from_region, to_regions, sys, N,
+                trans_set, projection, decide=True, solver=solver
+            )
+        else:
+            return _open_loop_many(
+                from_region, to_regions, sys, N,
+                trans_set, projection=projection,
+                decide=True, solver=solver
+            )
+    
+    return _cached(
+        'feasible', from_region, to_regions, sys, N,
+        closed_loop, use_all_horizon, trans_set, 5, solve
+    )
+
+def solve_feasible_many(
+    P1, P2_list, ssys, N=1, closed_loop=True,
+    use_all_horizon=False, trans_set=None, max_num_poly=5,
+    projection=None
+):
+    """Compute S0 of L{solve_feasible} for each target in C{P2_list}.
+    
+    The constraints on the source region, C{trans_set}
+    and the inputs are stacked once and shared by all targets,
+    only the rows of each target are appended,
+    see L{polys_to_polys}.
+    
+    @param P2_list: target regions
+    @type P2_list: list of C{Polytope} or C{Region}
+    
+    For the other arguments see L{solve_feasible}.
+    
+    @return: S0 for each target, in the order of C{P2_list}
+    @rtype: list of C{Polytope} or C{Region}
+    """
+    def solve(P2_list):
+        if closed_loop:
+            return _closed_loop_many(
+                P1, P2_list, ssys, N,
+                trans_set, projection
+            )
+        else:
+            return _open_loop_many(
+                P1, P2_list, ssys, N,
+                trans_set, max_num_poly, projection
+            )
+    
+    return _cached(
+        'S0', P1, P2_list, ssys, N,
+        closed_loop, use_all_horizon, trans_set, max_num_poly, solve
+    )
+
+def set_reach_cache(cache):
+    """Store results of L{solve_feasible} and L{is_feasible} on disk.
+    
+    Results are reused by later calls with the same dynamics,
+    regions and parameters, in this or any other process
+    that uses the same directory, see L{cache}.
+    This includes the calls of L{discretize},
+    L{get_transitions} and L{AbstractPwa.verify_transitions}.
+    
+    @param cache: directory, or C{None} to stop using the cache
+    @type cache: str or L{ReachCache}
+    
+    @return: the cache used so far, or C{None}
+    """
+    global _reach_cache
+    previous = _reach_cache
+    
+    if isinstance(cache, basestring):
+        cache = ReachCache(cache)
+    _reach_cache = cache
+    return previous
+
+def get_reach_cache():
+    """Return the L{ReachCache} in use, or C{None}.
+    """
+    return _reach_cache
+
+def _cached(
+    kind, P1, P2_list, ssys, N, closed_loop,
+    use_all_horizon, trans_set, max_num_poly, solve
+):
+    """Return C{solve(P2_list)}, reusing results of L{set_reach_cache}.
+    
+    Only the targets not found in the cache are passed to C{solve},
+    and its results are stored.
+    """
+    cache = _reach_cache
+    if cache is None:
+        return solve(P2_list)
+    
+    keys = [
+        cache.key(kind, ssys, P1, P2, trans_set, N, closed_loop,
+                  use_all_horizon, max_num_poly)
+        for P2 in P2_list
+    ]
+    results = [cache.get(key) for key in keys]
+    
+    missing = [k for k, x in enumerate(results) if x is None]
+    if missing:
+        solved = solve([P2_list[k] for k in missing])
+        for k, x in zip(missing, solved):
+            results[k] = x
+            cache.put(keys[k], x)
+    return results
 
 def solve_closed_loop(
     P1, P2, ssys, N,
-    use_all_horizon=False, trans_set=None
+    use_all_horizon=False, trans_set=None, projection=None
 ):
     """Compute S0 \subseteq P1 from which P2 is closed-loop N-reachable.
     
@@ -135,9 +295,35 @@ def solve_closed_loop(
         to be in trans_set.
         
         Otherwise, P1 is used.
+    
+    @param projection: see L{poly_to_poly}
     """
-    p1 = P1.copy() # Initial set
-    p2 = P2.copy() # Terminal set
+    return _closed_loop_many(
+        P1, [P2], ssys, N, trans_set, projection
+    )[0]
+
+def _closed_loop_many(
+    P1, P2_list, ssys, N, trans_set, projection,
+    decide=False, solver=None
+):
+    """Closed loop S0 for each target, one step at a time.
+    
+    The targets still nonempty after each step
+    are solved together.
+    
+    @param decide: return instead whether C{P1 <= S0},
+        see L{is_feasible_many}
+    @param solver: LP backend for C{decide}
+    """
+    # not modified, so not copied
+    p1 = P1 # Initial set
+    p2_list = list(P2_list) # Terminal sets
+    
+    decided = [None for p2 in p2_list]
+    if decide:
+        V = _vertices(p1)
+    else:
+        V = None
     
     if trans_set is not None:
         Pinit = trans_set
@@ -145,101 +331,691 @@ def solve_closed_loop(
         Pinit = p1
     
     # backwards in time
-    s0 = pc.Region()
-    reached = False
+    s0_list = [pc.Region() for p2 in p2_list]
+    active = range(len(p2_list) )
     for i in xrange(N, 0, -1):
+        if not active:
+            break
+        
         # first step from P1
         if i == 1:
             Pinit = p1
+            
+            # decide before the last projection
+            if V is not None:
+                source = _LiftedSource(
+                    ssys, 1, _polys(p1)[0], solver=solver
+                )
+                for k in active:
+                    previous = [
+                        p for p in _polys(s0_list[k])
+                        if pc.is_fulldim(p)
+                    ]
+                    targets = _polys(volumes_for_reachability(
+                        p2_list[k], 5
+                    ))
+                    decided[k] = _decide(V, previous, source, targets)
+                
+                active = [k for k in active if decided[k] is None]
+                if not active:
+                    break
         
-        p2 = solve_open_loop(Pinit, p2, ssys, 1, trans_set)
-        s0 = s0.union(p2, check_convex=True)
-        s0 = pc.reduce(s0)
-        
-        # empty target polytope ?
-        if not pc.is_fulldim(p2):
-            break
+        targets = [p2_list[k] for k in active]
+        preimages = _open_loop_many(
+            Pinit, targets, ssys, 1, trans_set,
+            projection=projection
+        )
         
-        old_reached = reached
+        still_active = []
+        for k, p2 in zip(active, preimages):
+            p2_list[k] = p2
+            s0_list[k] = _union(s0_list[k], p2)
+            
+            # empty target polytope ?
+            if not pc.is_fulldim(p2):
+                continue
+            
+            # already contains P1 ?
+            if V is not None and _covers(p2, V):
+                decided[k] = True
+                continue
+            
+            still_active.append(k)
+        active = still_active
+    
+    result = []
+    for s0, d in zip(s0_list, decided):
+        if d is not None:
+            result.append(d)
+            continue
         
-        # overlaps initial set ?
-        if p1.intersect(p2):
-            s0 = s0.union(p2, check_convex=True)
+        if not pc.is_fulldim(s0):
+            s0 = pc.Polytope()
+        else:
             s0 = pc.reduce(s0)
         
-        # we went past it -> don't continue
-        if old_reached is True and reached is False:
-            logger.info('stopped intersecting si')
-            #break
-        
-        if reached is True:
-            break
+        if decide:
+            result.append(p1 <= s0)
+        else:
+            result.append(s0)
+    return result
+
+def _union(s0, p2):
+    """Return reduced union of C{s0} and C{p2}.
+    
+    The polytopes of C{s0} are reduced,
+    and C{pc.reduce} returns reduced polytopes as they are,
+    so only the polytopes new in the union are reduced.
+    
+    When one of C{s0}, C{p2} is a polytope that contains the other,
+    the union is that polytope, so the convexity check
+    of C{union}, with its differences and envelopes, is skipped.
+    
+    @type s0: C{Polytope} or C{Region}
+    @type p2: C{Polytope} or C{Region}
+    """
+    if not pc.is_fulldim(p2):
+        return pc.reduce(s0)
     
     if not pc.is_fulldim(s0):
-        return pc.Polytope()
+        return pc.reduce(p2)
+    
+    polys = _polys(s0)
+    new_polys = _polys(p2)
+    if len(polys) == 1 and len(new_polys) == 1:
+        V = pc.extreme(polys[0])
+        if V is not None and _covers(new_polys[0], V):
+            return pc.reduce(p2)
+        
+        V = pc.extreme(new_polys[0])
+        if V is not None and _covers(polys[0], V):
+            return pc.reduce(s0)
     
-    s0 = pc.reduce(s0)
-    return s0
+    s0 = s0.union(p2, check_convex=True)
+    return pc.reduce(s0)
 
 def solve_open_loop(
     P1, P2, ssys, N,
-    trans_set=None, max_num_poly=5
+    trans_set=None, max_num_poly=5, projection=None
+):
+    return _open_loop_many(
+        P1, [P2], ssys, N,
+        trans_set, max_num_poly, projection
+    )[0]
+
+def _open_loop_many(
+    P1, P2_list, ssys, N,
+    trans_set=None, max_num_poly=5, projection=None,
+    decide=False, solver=None
 ):
-    r1 = P1.copy() # Initial set
-    r2 = P2.copy() # Terminal set
+    if decide:
+        decided = [None for P2 in P2_list]
+        
+        V = _vertices(P1)
+        if V is not None:
+            source = _LiftedSource(
+                ssys, N, _polys(P1)[0], trans_set, solver
+            )
+            for k, P2 in enumerate(P2_list):
+                targets = _polys(volumes_for_reachability(P2, max_num_poly))
+                decided[k] = _decide(V, [], source, targets)
+        
+        undecided = [k for k, d in enumerate(decided) if d is None]
+        if undecided:
+            s0_list = _open_loop_many(
+                P1, [P2_list[k] for k in undecided], ssys, N,
+                trans_set, max_num_poly, projection
+            )
+            for k, s0 in zip(undecided, s0_list):
+                decided[k] = P1 <= s0
+        return decided
     
     # use the max_num_poly largest volumes for reachability
-    r1 = volumes_for_reachability(r1, max_num_poly)
-    r2 = volumes_for_reachability(r2, max_num_poly)
+    r1 = volumes_for_reachability(P1, max_num_poly) # Initial set
     
     if len(r1) > 0:
         start_polys = r1
     else:
         start_polys = [r1]
     
-    if len(r2) > 0:
-        target_polys = r2
-    else:
-        target_polys = [r2]
+    # Terminal sets, as (index in P2_list, polytope)
+    target_polys = []
+    for k, P2 in enumerate(P2_list):
+        r2 = volumes_for_reachability(P2, max_num_poly)
+        
+        if len(r2) > 0:
+            target_polys.extend((k, p2) for p2 in r2)
+        else:
+            target_polys.append((k, r2) )
     
     # union of s0 over all polytope combinations
-    s0 = pc.Polytope()
+    s0_list = [pc.Polytope() for P2 in P2_list]
     for p1 in start_polys:
-        for p2 in target_polys:
-            cur_s0 = poly_to_poly(p1, p2, ssys, N, trans_set)
-            s0 = s0.union(cur_s0, check_convex=True)
+        cur_s0_list = polys_to_polys(
+            p1, [p2 for k, p2 in target_polys],
+            ssys, N, trans_set, projection
+        )
+        for (k, p2), cur_s0 in zip(target_polys, cur_s0_list):
+            s0_list[k] = s0_list[k].union(cur_s0, check_convex=True)
     
-    return s0
+    return s0_list
 
-def poly_to_poly(p1, p2, ssys, N, trans_set=None):
+def poly_to_poly(p1, p2, ssys, N, trans_set=None, projection=None):
     """Compute s0 for open-loop polytope to polytope N-reachability.
+    
+    The polytopes are only read, not modified.
+    
+    The constraints are lifted to C{[x(0)' u(0)' ... u(N-1)']'}
+    by L{createLM} and projected onto C{x(0)}.
+    The C{projection} strategy can be:
+    
+      - C{None}: let C{polytope} pick the projection method
+      - C{'fm'}: Fourier-Motzkin elimination with
+        redundancy removal after each eliminated dimension
+      - C{'esp'}: equality set projection
+      - C{'vertex'}: enumerate the vertices of the lifted polytope
+      - C{'iterhull'}: iterative hull
+      - C{'preimage'}: for C{N = 1} compute the one step preimage
+        of C{p2} in the state space, without lifting,
+        see L{one_step_preimage}
+      - C{'auto'}: as chosen by L{select_projection}
+    
+    @type projection: str or C{None}
+    """
+    return polys_to_polys(p1, [p2], ssys, N, trans_set, projection)[0]
+
+def polys_to_polys(p1, p2_list, ssys, N, trans_set=None, projection=None):
+    """Compute s0 of L{poly_to_poly} for each polytope in C{p2_list}.
+    
+    The rows of the lifted constraints for C{x(0), ..., x(N-1)}
+    and the inputs do not depend on the target,
+    so they are computed once.
+    
+    The targets that the bounding box of the states
+    reachable from C{p1} misses are found in one pass
+    and are not projected.
+    
+    @type p2_list: list of C{Polytope}
+    
+    @rtype: list of C{Polytope}
     """
-    p1 = p1.copy()
-    p2 = p2.copy()
+    if projection == 'auto':
+        projection = select_projection(ssys, N)
     
-    if trans_set is None:
-        trans_set = p1
+    if projection == 'preimage':
+        if N != 1:
+            raise ValueError('poly_to_poly: preimage projection '
+                             'needs N = 1, got N = ' + str(N))
+        return [one_step_preimage(p1, p2, ssys) for p2 in p2_list]
     
-    # stack polytope constraints
-    L, M = createLM(ssys, N, p1, trans_set, p2)
-    s0 = pc.Polytope(L, M)
-    s0 = pc.reduce(s0)
+    # stack constraints shared by all targets
+    source = _LiftedSource(ssys, N, p1, trans_set)
+    missed = _missed_targets(ssys, source.hm, p1, p2_list)
     
-    # Project polytope s0 onto lower dim
     n = np.shape(ssys.A)[1]
     dims = range(1, n+1)
     
-    s0 = s0.project(dims)
+    s0_list = []
+    for p2, miss in zip(p2_list, missed):
+        if miss:
+            s0_list.append(pc.Polytope() )
+            continue
+        
+        L, M = source.rows(p2)
+        s0 = pc.Polytope(L, M)
+        s0 = pc.reduce(s0)
+        
+        # Project polytope s0 onto lower dim
+        s0 = project(s0, dims, projection)
+        s0_list.append(pc.reduce(s0) )
+    
+    return s0_list
+
+class _LiftedSource(object):
+    """Rows of the lifted constraints that do not depend on the target.
+    
+    The rows for C{x(0) \in p1}, C{x(k) \in trans_set}
+    for C{k = 1, ..., N-1} and the inputs
+    are stacked once, see L{createLM}.
+    
+    The LP solutions of L{_reaches} are kept in C{warm},
+    keyed by the initial state, to warm start
+    the LPs for the next target.
+    
+    @param solver: LP backend, see L{optimization}
+    """
+    def __init__(self, ssys, N, p1, trans_set=None, solver=None):
+        if trans_set is None:
+            trans_set = p1
+        
+        self.ssys = ssys
+        self.p1 = p1
+        self.hm = horizon_model(ssys, N)
+        self.solver = solver
+        self.warm = dict()
+        
+        disturbance_ind = range(1, N+1)
+        self._shared = [
+            _lifted_rows(ssys, self.hm, P, i, i in disturbance_ind)
+            for i, P in enumerate([p1] + (N-1) *[trans_set])
+        ]
+        self._input_rows = _input_rows(ssys, self.hm, disturbance_ind)
+    
+    def rows(self, p2):
+        """Return C{L, M} of L{createLM} with C{x(N) \in p2}.
+        """
+        blocks = self._shared + [
+            _lifted_rows(self.ssys, self.hm, p2, self.hm.N),
+            self._input_rows
+        ]
+        L = np.vstack([Li for Li, Mi in blocks])
+        M = np.vstack([Mi for Li, Mi in blocks])
+        return L, M
+
+def _polys(P):
+    """Return list of the polytopes in C{P}.
+    """
+    if len(P) > 0:
+        return list(P)
+    return [P]
+
+def _vertices(P):
+    """Return vertices of C{P}, if it is a single polytope.
+    
+    Otherwise, or if it is not full-dimensional, return C{None}.
+    """
+    polys = _polys(P)
+    if len(polys) != 1 or not pc.is_fulldim(polys[0]):
+        return None
+    return pc.extreme(polys[0])
+
+def _covers(P, V, abs_tol=1e-7):
+    """Return True if some polytope of C{P} contains the vertices C{V}.
+    """
+    for p in _polys(P):
+        if not pc.is_fulldim(p):
+            continue
+        
+        if np.all(p.A.dot(V.T) <= p.b.reshape(-1, 1) + abs_tol):
+            return True
+    return False
+
+def _decide(V, previous, source, targets, abs_tol=1e-7):
+    """Decide if the convex hull of C{V} is contained in S0.
+    
+    S0 is the union of the polytopes C{previous}
+    and the sets of initial states in C{source.p1}
+    from which some polytope in C{targets} is reachable.
+    
+    The vertices are checked one at a time and
+    the first that is in none of the sets refutes containment.
+    Targets outside the reach box of L{_missed_targets},
+    which includes the disturbance, are dropped without LPs.
+    
+    @param V: vertices, one per row
+    @type source: L{_LiftedSource}
+    
+    @return: True, False, or C{None} if undecided
+    """
+    missed = _missed_targets(source.ssys, source.hm, source.p1, targets)
+    lifted = [
+        source.rows(p2)
+        for p2, miss in zip(targets, missed)
+        if not miss
+    ]
+    n_sets = len(previous) + len(lifted)
+    
+    def member(c, v):
+        if c < len(previous):
+            p = previous[c]
+            return np.all(p.A.dot(v) <= p.b.flatten() + abs_tol)
+        
+        L, M = lifted[c - len(previous)]
+        key = tuple(v)
+        
+        r, u = _reaches(L, M, v, abs_tol, source.solver,
+                        source.warm.get(key) )
+        if u is not None:
+            source.warm[key] = u
+        return r
+    
+    # sets containing all vertices checked so far
+    candidates = range(n_sets)
+    for v in V:
+        checked = [(c, member(c, v) ) for c in candidates]
+        candidates = [c for c, r in checked if r]
+        
+        if candidates:
+            continue
+        
+        # counterexample ?
+        unknown = any(r is None for c, r in checked)
+        tested = {c for c, r in checked}
+        for c in xrange(n_sets):
+            if c in tested:
+                continue
+            
+            r = member(c, v)
+            if r:
+                break
+            elif r is None:
+                unknown = True
+        else:
+            if not unknown:
+                return False
+    
+    if candidates:
+        return True
+    return None
+
+def _reaches(L, M, x0, abs_tol=1e-7, solver=None, u0=None):
+    """Return True if some inputs satisfy C{L [x0' u']' <= M}.
+    
+    Solves the LP that minimizes the largest violation C{t}::
+    
+        min t s.t. Lu u - t <= M - Lx x0
+    
+    @param u0: inputs to warm start from,
+        with C{t} large enough to be strictly feasible
+    
+    @return: C{(reached, u)},
+        both C{None} if the LP solver fails
+    """
+    n = x0.size
+    
+    Lx = L[:, :n]
+    Lu = L[:, n:]
+    
+    c = np.zeros(Lu.shape[1] + 1)
+    c[-1] = 1.
+    G = np.hstack([Lu, -np.ones([L.shape[0], 1])])
+    h = M.flatten() - Lx.dot(x0)
+    
+    start = None
+    if u0 is not None and u0.size == Lu.shape[1]:
+        t0 = np.amax(Lu.dot(u0) - h) + 1.
+        start = np.hstack([u0, t0])
+    
+    sol = optimization.lp(c, G, h, solver, start)
+    
+    if sol['status'] != 'optimal':
+        logger.warn('_reaches: LP solver finished with status ' +
+                    str(sol['status']) )
+        return None, None
+    
+    x = sol['x']
+    return x[-1] <= abs_tol, x[:-1]
+
+def _missed_targets(ssys, hm, p1, p2_list, abs_tol=1e-7):
+    """Return which targets no state reachable from C{p1} is in.
+    
+    The states reachable in C{N} steps are bounded by a box,
+    the interval image of the bounding boxes of C{p1}, C{Uset}
+    and, at each step, C{Wset}.
+    This ignores C{trans_set}, so it is conservative:
+    a target outside the box is not reachable,
+    for any disturbance, so not robustly.
+    The boxes of all targets are compared at once.
+    
+    @rtype: C{numpy} bool array
+    """
+    missed = np.zeros(len(p2_list), dtype=bool)
+    
+    if ssys.Uset.dim != hm.m or not pc.is_fulldim(p1):
+        return missed
+    
+    boxes = [geometry.bounding_box(p1)]
+    boxes += hm.N *[geometry.bounding_box(ssys.Uset)]
+    
+    z_low = np.vstack([l for l, u in boxes])
+    z_up = np.vstack([u for l, u in boxes])
+    
+    Z = hm.AB_line[hm.N]
+    center = Z.dot(z_low + z_up) / 2. + hm.AkK[hm.N]
+    radius = np.abs(Z).dot(z_up - z_low) / 2.
+    
+    # disturbance, which is zeroed in hm if Wset is empty
+    ZE = hm.AkE[hm.N]
+    if not np.all(ZE == 0):
+        w_low, w_up = geometry.bounding_box(ssys.Wset)
+        w_low = np.tile(w_low.reshape(-1, 1), (hm.N, 1) )
+        w_up = np.tile(w_up.reshape(-1, 1), (hm.N, 1) )
+        
+        center = center + ZE.dot(w_low + w_up) / 2.
+        radius = radius + np.abs(ZE).dot(w_up - w_low) / 2.
+    
+    x_low = (center - radius).flatten()
+    x_up = (center + radius).flatten()
+    
+    ind = [k for k, p2 in enumerate(p2_list) if pc.is_fulldim(p2)]
+    if not ind:
+        return missed
+    
+    t_boxes = [geometry.bounding_box(p2_list[k]) for k in ind]
+    t_low = np.vstack([l.flatten() for l, u in t_boxes])
+    t_up = np.vstack([u.flatten() for l, u in t_boxes])
+    
+    missed[ind] = np.any(
+        (t_low > x_up + abs_tol) | (t_up < x_low - abs_tol),
+        axis=1
+    )
+    return missed
+
+_PROJECTION_SOLVERS = {
+    'esp':'esp',
+    'vertex':'exthull',
+    'iterhull':'iterhull'
+}
+
+def project(poly, dims, method=None):
+    """Project C{poly} onto C{dims} using C{method}.
+    
+    @param dims: dimensions to keep, numbered from 1
+    
+    @param method: C{None}, C{'fm'}, C{'esp'},
+        C{'vertex'} or C{'iterhull'}, see L{poly_to_poly}
+    
+    @rtype: C{Polytope}
+    """
+    if method is None:
+        return poly.project(dims)
+    elif method == 'fm':
+        return fourier_motzkin(poly, dims)
+    elif method in _PROJECTION_SOLVERS:
+        return pc.projection(poly, dims,
+                             solver=_PROJECTION_SOLVERS[method])
+    else:
+        raise ValueError('project: unknown method: ' + str(method))
+
+def fourier_motzkin(poly, dims, abs_tol=1e-7):
+    """Project C{poly} onto C{dims} by Fourier-Motzkin elimination.
+    
+    At each step the dimension that creates
+    the fewest new constraints is eliminated,
+    then the redundant constraints are removed,
+    so the number of constraints stays small.
+    
+    @param dims: dimensions to keep, numbered from 1
+    
+    @rtype: C{Polytope}
+    """
+    if not pc.is_fulldim(poly):
+        return pc.Polytope()
+    
+    keep = [d - 1 for d in dims]
+    cols = range(poly.dim)
+    
+    poly = pc.reduce(poly)
+    A = poly.A
+    b = poly.b.flatten()
+    while len(cols) > len(keep):
+        # pick column to eliminate
+        best = None
+        for k, col in enumerate(cols):
+            if col in keep:
+                continue
+            
+            n_pos = np.sum(A[:, k] > abs_tol)
+            n_neg = np.sum(A[:, k] < -abs_tol)
+            n_new = n_pos * n_neg - n_pos - n_neg
+            
+            if best is None or n_new < best[0]:
+                best = (n_new, k)
+        k = best[1]
+        
+        a = A[:, k]
+        pos = a > abs_tol
+        neg = a < -abs_tol
+        null = ~(pos | neg)
+        
+        # sum each row with positive coefficient
+        # and each row with negative coefficient, scaled
+        Ap = A[pos, :] / a[pos].reshape(-1, 1)
+        bp = b[pos] / a[pos]
+        An = A[neg, :] / -a[neg].reshape(-1, 1)
+        bn = b[neg] / -a[neg]
+        
+        d = A.shape[1]
+        A = np.vstack([
+            A[null, :],
+            (Ap[:, np.newaxis, :] + An[np.newaxis, :, :]).reshape(-1, d)
+        ])
+        b = np.hstack([
+            b[null],
+            (bp[:, np.newaxis] + bn[np.newaxis, :]).flatten()
+        ])
+        
+        A = np.delete(A, k, axis=1)
+        del cols[k]
+        
+        if A.shape[0] == 0:
+            raise ValueError('fourier_motzkin: projection is unbounded')
+        
+        poly = pc.Polytope(A, b)
+        if not pc.is_fulldim(poly):
+            return pc.Polytope()
+        
+        poly = pc.reduce(poly)
+        A = poly.A
+        b = poly.b.flatten()
+    
+    # order columns as in dims
+    order = [cols.index(d) for d in keep]
+    return pc.Polytope(A[:, order], b)
+
+def one_step_preimage(p1, p2, ssys):
+    """Compute the subset of C{p1} from which C{p2} is 1-step reachable.
+    
+    The states C{x} are those with::
+    
+        A x + K \in (p2 - E W) + (-B U)
+    
+    where C{-} on sets is the Pontryagin difference
+    and C{+} the Minkowski sum.
+    The Minkowski sum is computed in the state space
+    from the vertices of its summands,
+    so there is no projection from a lifted space.
+    
+    Applies only when C{ssys.Uset} constrains C{u} alone.
+    The result is the same as L{poly_to_poly} for C{N = 1}.
+    
+    @type p1: C{Polytope}
+    @type p2: C{Polytope}
+    @type ssys: L{LtiSysDyn}
+    
+    @rtype: C{Polytope}
+    """
+    A = ssys.A
+    B = ssys.B
+    E = ssys.E
+    K = ssys.K
+    
+    n = A.shape[1]
+    m = B.shape[1]
+    
+    if ssys.Uset.dim != m:
+        raise ValueError('one_step_preimage: Uset should have '
+                         'dimension ' + str(m) + ' = dim(u)')
+    
+    H = p2.A
+    h = p2.b.flatten()
+    
+    # tighten for the disturbance
+    if not np.all(E==0) and pc.is_fulldim(ssys.Wset):
+        h = h - get_max_extreme(H.dot(E), ssys.Wset, 1).flatten()
+    
+    target = pc.Polytope(H, h)
+    if not pc.is_fulldim(target):
+        return pc.Polytope()
+    
+    vt = pc.extreme(target)
+    vu = pc.extreme(ssys.Uset)
+    if vt is None or vu is None:
+        return pc.Polytope()
+    
+    # vertices of the Minkowski sum contained in these points
+    points = vt[:, np.newaxis, :] - vu.dot(B.T)[np.newaxis, :, :]
+    points = points.reshape(-1, n)
+    
+    if n == 1:
+        hull = pc.Polytope(
+            np.array([[1.], [-1.]]),
+            np.array([np.amax(points), -np.amin(points)])
+        )
+    else:
+        hull = pc.qhull(points)
+        if not pc.is_fulldim(hull):
+            return pc.Polytope()
+    
+    # shift by K and pull back by A
+    Hs = hull.A
+    hs = hull.b.flatten() - Hs.dot(K).flatten()
+    
+    s0 = pc.Polytope(
+        np.vstack([p1.A, Hs.dot(A)]),
+        np.hstack([p1.b.flatten(), hs])
+    )
+    if not pc.is_fulldim(s0):
+        return pc.Polytope()
     
     return pc.reduce(s0)
 
+def select_projection(ssys, N):
+    """Return projection strategy expected to be fastest.
+    
+    Used by L{poly_to_poly} for C{projection='auto'}.
+    
+      - C{'preimage'} for C{N = 1}, if C{Uset} constrains only C{u}
+      - C{'fm'} when few dimensions are eliminated,
+        because the number of constraints grows
+        quadratically with each eliminated dimension
+      - C{None} otherwise, leaving the choice to C{polytope}
+    
+    Compare the strategies on specific dynamics with
+    C{examples/developer/projection_benchmark.py}.
+    
+    @type ssys: L{LtiSysDyn}
+    @type N: int > 0
+    
+    @rtype: str or C{None}
+    """
+    m = ssys.B.shape[1]
+    
+    if N == 1 and ssys.Uset.dim == m:
+        return 'preimage'
+    
+    if N * m <= 4:
+        return 'fm'
+    
+    return None
+
 def volumes_for_reachability(part, max_num_poly):
     if len(part) <= max_num_poly:
         return part
     
     vol_list = np.zeros(len(part) )
     for i in xrange(len(part) ):
-        vol_list[i] = part[i].volume
+        vol_list[i] = geometry.volume(part[i])
     
     ind = np.argsort(-vol_list)
     temp = []
@@ -249,7 +1025,8 @@ def volumes_for_reachability(part, max_num_poly):
     part = pc.Region(temp, [])
     return part
 
-def createLM(ssys, N, list_P, Pk=None, PN=None, disturbance_ind=None):
+def createLM(ssys, N, list_P, Pk=None, PN=None, disturbance_ind=None,
+             tightening='support'):
     """Compute the components of the polytope::
     
         L [x(0)' u(0)' ... u(N-1)']' <= M
@@ -284,6 +1061,10 @@ def createLM(ssys, N, list_P, Pk=None, PN=None, disturbance_ind=None):
     @param disturbance_ind: list indicating which k's
         that disturbance should be taken into account.
         Default is [1,2, ... N]
+    
+    @param tightening: how the constraints are tightened
+        for the disturbance, see L{get_max_extreme}
+    @type tightening: C{'support'} or C{'enumerate'}
     """
     if not isinstance(list_P, Iterable):
         list_P = [list_P] +(N-1) *[Pk] +[PN]
@@ -291,138 +1072,199 @@ def createLM(ssys, N, list_P, Pk=None, PN=None, disturbance_ind=None):
     if disturbance_ind is None:
         disturbance_ind = range(1,N+1)
     
-    A = ssys.A
-    B = ssys.B
-    E = ssys.E
-    K = ssys.K
+    # polytope independent part
+    hm = horizon_model(ssys, N)
+    
+    blocks = [
+        _lifted_rows(ssys, hm, list_P[i], i, i in disturbance_ind,
+                     tightening)
+        for i in xrange(N+1)
+    ]
+    blocks.append(_input_rows(ssys, hm, disturbance_ind, tightening) )
+    
+    # Put together matrices L, M
+    L = np.vstack([Li for Li, Mi in blocks])
+    M = np.vstack([Mi for Li, Mi in blocks])
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        msg = 'Computed S0 polytope: L x <= M, where:\n\t L = \n'
+        msg += str(L) +'\n\t M = \n' + str(M) +'\n'
+        logger.debug(msg)
     
-    D = ssys.Wset
-    PU = ssys.Uset
+    return L,M
 
-    n = A.shape[1]  # State space dimension
-    m = B.shape[1]  # Input space dimension
-    p = E.shape[1]  # Disturbance space dimension
+def _lifted_rows(ssys, hm, P, i, disturbance=True, tightening='support'):
+    """Return rows C{L, M} of L{createLM} for C{x(i) \in P}.
+    
+    @type hm: L{HorizonModel}
+    @param disturbance: tighten the rows for the disturbance
+    """
+    if not isinstance(P, pc.Polytope):
+        logger.warn('createLM: Li of type: ' +str(type(P) ) )
     
-    # non-zero disturbance matrix E ?
-    if not np.all(E==0):
-        if not pc.is_fulldim(D):
-            E = np.zeros(K.shape)
+    L = P.A.dot(hm.AB_line[i])
+    M = P.b.reshape(P.b.size, 1) - P.A.dot(hm.AkK[i])
     
-    list_len = np.array([P.A.shape[0] for P in list_P])
-    sumlen = np.sum(list_len)
+    if disturbance:
+        G = P.A.dot(hm.AkE[i])
+        if not np.all(G==0):
+            M = M - get_max_extreme(G, ssys.Wset, hm.N, tightening)
+    return L, M
 
-    LUn = np.shape(PU.A)[0]
+def _input_rows(ssys, hm, disturbance_ind, tightening='support'):
+    """Return rows C{L, M} of L{createLM} for the input constraints.
     
-    Lk = np.zeros([sumlen, n+N*m])
-    LU = np.zeros([LUn*N, n+N*m])
+    @type hm: L{HorizonModel}
+    """
+    GU = np.zeros(hm.GU.shape)
+    for i in disturbance_ind:
+        if i < hm.N:
+            rows = hm.LU_rows(i)
+            GU[rows, :] = hm.GU[rows, :]
     
-    Mk = np.zeros([sumlen, 1])
-    MU = np.tile(PU.b.reshape(PU.b.size, 1), (N, 1))
-  
-    Gk = np.zeros([sumlen, p*N])
-    GU = np.zeros([LUn*N, p*N])
+    M = hm.MU
+    if not np.all(GU==0):
+        M = M - get_max_extreme(GU, ssys.Wset, hm.N, tightening)
+    return hm.LU, M
+
+class HorizonModel(object):
+    """Matrices of the dynamics stacked over a horizon of N steps.
     
-    K_hat = np.tile(K, (N, 1))
+    They depend only on the system and C{N},
+    so they are computed once and reused by
+    every call of L{createLM} and C{get_input_helper}.
+    Use L{horizon_model} to get the cached instance.
     
-    B_diag = B
-    E_diag = E
-    for i in xrange(N-1):
-        B_diag = _block_diag2(B_diag, B)
-        E_diag = _block_diag2(E_diag, E)
+    Attributes, for each time step C{i = 0, ..., N}:
     
-    A_n = np.eye(n)
-    A_k = np.zeros([n, n*N])
+      - C{AB_line[i]}: maps C{[x(0)' u(0)' ... u(N-1)']'} to C{x(i)}
+      - C{AkK[i]}: effect of the affine term C{K} on C{x(i)}
+      - C{AkE[i]}: maps the stacked disturbances to C{x(i)}
     
-    sum_vert = 0
-    for i in xrange(N+1):
-        Li = list_P[i]
+    and the input constraints C{LU z <= MU},
+    with their disturbance matrix C{GU},
+    where C{z = [x(0)' u(0)' ... u(N-1)']'}.
+    
+    For the quadratic cost of C{get_input_helper}:
+    
+      - C{A_N}: maps C{x(0)} to C{[x(1)' ... x(N)']'}
+      - C{A_K}: maps the stacked C{B u(k) + K} to the same
+      - C{Ct}: C{A_K} times the block diagonal of C{B}
+      - C{K_hat}: C{K} stacked C{N} times
+    
+    @type ssys: L{LtiSysDyn}
+    @type N: int > 0
+    """
+    def __init__(self, ssys, N):
+        A = ssys.A
+        B = ssys.B
+        E = ssys.E
+        K = ssys.K
         
-        if not isinstance(Li, pc.Polytope):
-            logger.warn('createLM: Li of type: ' +str(type(Li) ) )
+        D = ssys.Wset
+        PU = ssys.Uset
         
-        ######### FOR M #########
-        idx = range(sum_vert, sum_vert + Li.A.shape[0])
-        Mk[idx, :] = Li.b.reshape(Li.b.size,1) - \
-                     Li.A.dot(A_k).dot(K_hat)
+        n = A.shape[1]  # State space dimension
+        m = B.shape[1]  # Input space dimension
         
-        ######### FOR G #########
-        if i in disturbance_ind:
-            idx = np.ix_(
-                range(sum_vert, sum_vert + Li.A.shape[0]),
-                range(Gk.shape[1])
-            )
-            Gk[idx] = Li.A.dot(A_k).dot(E_diag)
-            
-            if (PU.A.shape[1] == m+n) and (i < N):
-                A_k_E_diag = A_k.dot(E_diag)
-                d_mult = np.vstack([np.zeros([m, p*N]), A_k_E_diag])
-                
-                idx = np.ix_(range(LUn*i, LUn*(i+1)), range(p*N))
-                GU[idx] = PU.A.dot(d_mult)
+        # non-zero disturbance matrix E ?
+        if not np.all(E==0):
+            if not pc.is_fulldim(D):
+                E = np.zeros(K.shape)
         
-        ######### FOR L #########
-        AB_line = np.hstack([A_n, A_k.dot(B_diag)])
+        p = E.shape[1]  # Disturbance space dimension
         
-        idx = np.ix_(
-            range(sum_vert, sum_vert + Li.A.shape[0]),
-            range(0,Lk.shape[1])
-        )
-        Lk[idx] = Li.A.dot(AB_line)
+        self.N = N
+        self.n = n
+        self.m = m
+        self.p = p
         
-        if i >= N:
-            continue
+        LUn = np.shape(PU.A)[0]
+        self._LUn = LUn
         
-        if PU.A.shape[1] == m:
-            idx = np.ix_(
-                range(i*LUn, (i+1)*LUn),
-                range(n + m*i, n + m*(i+1))
-            )
-            LU[idx] = PU.A
-        elif PU.A.shape[1] == m+n:
-            uk_line = np.zeros([m, n + m*N])
-            
-            idx = np.ix_(range(m), range(n+m*i, n+m*(i+1)))
-            uk_line[idx] = np.eye(m)
+        self.K_hat = np.tile(K, (N, 1))
+        B_diag = np.kron(np.eye(N), B)
+        E_diag = np.kron(np.eye(N), E)
+        
+        LU = np.zeros([LUn*N, n+N*m])
+        MU = np.tile(PU.b.reshape(PU.b.size, 1), (N, 1))
+        GU = np.zeros([LUn*N, p*N])
+        
+        self.AB_line = []
+        self.AkK = []
+        self.AkE = []
+        A_k_list = []
+        
+        A_n = np.eye(n)
+        A_k = np.zeros([n, n*N])
+        for i in xrange(N+1):
+            A_k_list.append(A_k)
+            AB_line = np.hstack([A_n, A_k.dot(B_diag)])
+            A_k_E_diag = A_k.dot(E_diag)
             
-            A_mult = np.vstack([uk_line, AB_line])
+            self.AB_line.append(AB_line)
+            self.AkK.append(A_k.dot(self.K_hat) )
+            self.AkE.append(A_k_E_diag)
             
-            b_mult = np.zeros([m+n, 1])
-            b_mult[range(m, m+n), :] = A_k.dot(K_hat)
+            if i >= N:
+                continue
             
-            idx = np.ix_(
-                range(i*LUn, (i+1)*LUn),
-                range(n+m*N)
-            )
-            LU[idx] = PU.A.dot(A_mult)
+            rows = self.LU_rows(i)
+            if PU.A.shape[1] == m:
+                LU[rows, n + m*i:n + m*(i+1)] = PU.A
+            elif PU.A.shape[1] == m+n:
+                uk_line = np.zeros([m, n + m*N])
+                uk_line[:, n+m*i:n+m*(i+1)] = np.eye(m)
+                
+                A_mult = np.vstack([uk_line, AB_line])
+                
+                b_mult = np.zeros([m+n, 1])
+                b_mult[m:m+n, :] = A_k.dot(self.K_hat)
+                
+                LU[rows, :] = PU.A.dot(A_mult)
+                MU[rows, :] -= PU.A.dot(b_mult)
+                
+                d_mult = np.vstack([np.zeros([m, p*N]), A_k_E_diag])
+                GU[rows, :] = PU.A.dot(d_mult)
             
-            MU[range(i*LUn, (i+1)*LUn), :] -= PU.A.dot(b_mult)
+            ####### Iterate #########
+            A_n = A.dot(A_n)
+            A_k = A.dot(A_k)
+            A_k[:, i*n:(i+1)*n] = np.eye(n)
         
-        ####### Iterate #########
-        sum_vert += Li.A.shape[0]
-        A_n = A.dot(A_n)
-        A_k = A.dot(A_k)
+        self.LU = LU
+        self.MU = MU
+        self.GU = GU
         
-        idx = np.ix_(range(n), range(i*n, (i+1)*n))
-        A_k[idx] = np.eye(n)
-                
-    # Get disturbance sets
-    if not np.all(Gk==0):  
-        G = np.vstack([Gk, GU])
-        D_hat = get_max_extreme(G, D, N)
-    else:
-        D_hat = np.zeros([sumlen + LUn*N, 1])
+        # x(i) = A^i x(0) + A_k (B_diag u + K_hat), for i = 1, ..., N
+        self.A_N = np.vstack([self.AB_line[i][:, :n] for i in xrange(1, N+1)])
+        self.A_K = np.vstack(A_k_list[1:])
+        self.Ct = self.A_K.dot(B_diag)
+    
+    def LU_rows(self, i):
+        """Return rows of C{LU} that constrain C{u(i)}.
+        """
+        return slice(i*self._LUn, (i+1)*self._LUn)
 
-    # Put together matrices L, M
-    L = np.vstack([Lk, LU])
-    M = np.vstack([Mk, MU]) - D_hat
+def horizon_model(ssys, N):
+    """Return L{HorizonModel} of C{ssys} and C{N}, cached in C{ssys}.
     
-    msg = 'Computed S0 polytope: L x <= M, where:\n\t L = \n'
-    msg += str(L) +'\n\t M = \n' + str(M) +'\n'
-    logger.debug(msg)
+    The cache is reset if any of the matrices or sets
+    of C{ssys} changes, by value, so also if modified in place.
     
-    return L,M
+    @type ssys: L{LtiSysDyn}
+    """
+    stamp = dynamics_digest(ssys)
+    
+    cache = ssys.__dict__.setdefault('_horizon_models', dict())
+    if N in cache and cache[N][0] == stamp:
+        return cache[N][1]
+    
+    model = HorizonModel(ssys, N)
+    cache[N] = (stamp, model)
+    return model
 
-def get_max_extreme(G,D,N):
+def get_max_extreme(G, D, N, method='support'):
     """Calculate the array d_hat such that::
     
         d_hat = max(G*DN_extreme),
@@ -444,12 +1286,31 @@ def get_max_extreme(G,D,N):
     @param D: Polytope describing the disturbance set
     @param N: Horizon length
     
+    @param method:
+        - C{'support'}: the maximum over D^N is the sum over
+          the time steps of the support function of D,
+          so each block of G is maximized over
+          the C{nv} vertices of D separately,
+          which takes time linear in C{N} (default)
+        - C{'enumerate'}: maximize over all C{nv**N}
+          vertices of D^N
+    
     @return: d_hat: Array describing the maximum possible
         effect from the disturbance
     """
     D_extreme = pc.extreme(D)
     nv = D_extreme.shape[0]
     dim = D_extreme.shape[1]
+    
+    if method == 'support':
+        d_hat = np.zeros(G.shape[0])
+        for j in xrange(N):
+            Gj = G[:, j*dim:(j+1)*dim]
+            d_hat += np.amax(np.dot(Gj, D_extreme.T), axis=1)
+        return d_hat.reshape(d_hat.size,1)
+    elif method != 'enumerate':
+        raise ValueError('get_max_extreme: unknown method: ' + str(method))
+    
     DN_extreme = np.zeros([dim*N, nv**N])
     
     for i in xrange(nv**N):
@@ -460,20 +1321,3 @@ def get_max_extreme(G,D,N):
 
     d_hat = np.amax(np.dot(G,DN_extreme), axis=1)     
     return d_hat.reshape(d_hat.size,1)
-
-def _block_diag2(A,B):
-    """Like block_diag() in scipy.linalg, but restricted to 2 inputs.
-
-    Old versions of the linear algebra package in SciPy (i.e.,
-    scipy.linalg) do not have a block_diag() function.  Providing
-    _block_diag2() here until most folks are using sufficiently
-    up-to-date SciPy installations improves portability.
-    """
-    if len(A.shape) == 1:  # Cast 1d array into matrix
-        A = np.array([A])
-    if len(B.shape) == 1:
-        B = np.array([B])
-    C = np.zeros((A.shape[0]+B.shape[0], A.shape[1]+B.shape[1]))
-    C[:A.shape[0], :A.shape[1]] = A.copy()
-    C[A.shape[0]:, A.shape[1]:] = B.copy()
-    return C
@@ -45,16 +45,16 @@ See Also
 L{discretize}
 """
 import numpy as np
-from cvxopt import matrix, solvers
 import polytope as pc
 
-from .feasible import solve_feasible, createLM, _block_diag2
+from .feasible import solve_feasible, createLM, horizon_model
+from . import optimization
 
 def get_input(
     x0, ssys, abstraction,
     start, end,
     R=[], r=[], Q=[], mid_weight=0.0,
-    test_result=False
+    test_result=False, solver=None
 ):
     """Compute continuous control input for discrete transition.
     
@@ -136,6 +136,10 @@ def get_input(
         the calculated input sequence is safe.
     @type test_result: bool
     
+    @param solver: QP backend, see L{optimization}.
+        The QP for each polytope of the target region
+        is warm started from the previous solution.
+    
     @return: array A where row k contains the
         control input: u(k)
         for k = 0,1 ... N-1
@@ -240,6 +244,7 @@ def get_input(
     if len(P_end) > 0:
         low_cost = np.inf
         low_u = np.zeros([N,m])
+        u0 = None
         
         # for each polytope in target region
         for P3 in P_end:
@@ -257,8 +262,10 @@ def get_input(
             try:
                 u, cost = get_input_helper(
                     x0, ssys, P1, P3, N, R, r, Q,
-                    closed_loop=closed_loop
+                    closed_loop=closed_loop,
+                    solver=solver, u0=u0
                 )
+                u0 = u
                 r[idx, :] += mid_weight*xc
             except:
                 r[idx, :] += mid_weight*xc
@@ -283,7 +290,7 @@ def get_input(
             r[idx, :] += -mid_weight*xc
         low_u, cost = get_input_helper(
             x0, ssys, P1, P3, N, R, r, Q,
-            closed_loop=closed_loop
+            closed_loop=closed_loop, solver=solver
         )
         
     if test_result:
@@ -294,7 +301,7 @@ def get_input(
 
 def get_input_helper(
     x0, ssys, P1, P3, N, R, r, Q,
-    closed_loop=True
+    closed_loop=True, solver=None, u0=None
 ):
     """Calculates the sequence u_seq such that:
     
@@ -304,6 +311,9 @@ def get_input_helper(
       - [u(k); x(k)] \in PU
     
     and minimizes x'Rx + 2*r'x + u'Qu
+    
+    @param solver: QP backend, see L{optimization}
+    @param u0: input sequence to warm start from
     """
     n = ssys.A.shape[1]
     m = ssys.B.shape[1]
@@ -338,57 +348,36 @@ def get_input_helper(
     M = M - Lx.dot(x0).reshape(Lx.shape[0],1)
         
     # Constraints
-    G = matrix(Lu)
-    h = matrix(M)
-
-    B_diag = ssys.B
-    for i in xrange(N-1):
-        B_diag = _block_diag2(B_diag,ssys.B)
-    K_hat = np.tile(ssys.K, (N,1))
-
-    A_it = ssys.A.copy()
-    A_row = np.zeros([n, n*N])
-    A_K = np.zeros([n*N, n*N])
-    A_N = np.zeros([n*N, n])
+    G = Lu
+    h = M.flatten()
 
-    for i in xrange(N):
-        A_row = ssys.A.dot(A_row)
-        A_row[np.ix_(
-            range(n),
-            range(i*n, (i+1)*n)
-        )] = np.eye(n)
-
-        A_N[np.ix_(
-            range(i*n, (i+1)*n),
-            range(n)
-        )] = A_it
-        
-        A_K[np.ix_(
-            range(i*n,(i+1)*n),
-            range(A_K.shape[1])
-        )] = A_row
-        
-        A_it = ssys.A.dot(A_it)
-        
-    Ct = A_K.dot(B_diag)
-    P = matrix(Q + Ct.T.dot(R).dot(Ct) )
-    q = matrix(
+    # stacked dynamics, cached per system and horizon
+    hm = horizon_model(ssys, N)
+    K_hat = hm.K_hat
+    A_K = hm.A_K
+    A_N = hm.A_N
+    Ct = hm.Ct
+    P = Q + Ct.T.dot(R).dot(Ct)
+    q = (
         np.dot(
             np.dot(x0.reshape(1, x0.size), A_N.T) +
             A_K.dot(K_hat).T, R.dot(Ct)
         ) +
         r.T.dot(Ct)
-    ).T 
+    ).flatten()
+    
+    if u0 is not None:
+        u0 = u0.flatten()
     
-    sol = solvers.qp(P, q, G, h)
+    sol = optimization.qp(P, q, G, h, solver=solver, x0=u0)
     
     if sol['status'] != "optimal":
         raise Exception("getInputHelper: "
             "QP solver finished with status " +
             str(sol['status'])
         )
-    u = np.array(sol['x']).flatten()
-    cost = sol['primal objective']
+    u = sol['x']
+    cost = sol['fun']
     
     return u.reshape(N, m), cost
 
@@ -0,0 +1,184 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Cache of geometric quantities of regions.
+
+Volume, Chebyshev ball and bounding box each cost
+linear programs or sampling, and the same cells are
+queried repeatedly during refinement.
+
+Primary classes:
+    - L{GeometryCache}
+
+Functions that use a cache shared by the module:
+    - L{volume}
+    - L{cheby_ball}
+    - L{bounding_box}
+
+See Also
+========
+L{discretize}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import weakref
+
+import polytope as pc
+
+class GeometryCache(object):
+    """Volume, Chebyshev ball and bounding box of regions.
+
+    Entries are keyed by the identity of the C{Polytope}
+    or C{Region}, so copies are distinct entries,
+    and are dropped when the object is garbage collected.
+    The volume and Chebyshev ball of a C{Region}
+    are combined from those of its polytopes,
+    so they are computed once per polytope,
+    even if it is shared by several regions.
+
+    An entry is discarded if the region changes,
+    i.e., if the arrays C{A}, C{b} of a C{Polytope}
+    or the polytopes listed in a C{Region} are replaced.
+    Call L{invalidate} after modifying them in place.
+    """
+    def __init__(self):
+        self._entries = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries = dict()
+
+    def invalidate(self, region):
+        """Forget the quantities computed for C{region}.
+        """
+        self._entries.pop(id(region), None)
+
+    def volume(self, region):
+        """Return volume of C{region}, as C{pc.volume}.
+        """
+        entry = self._entry(region)
+        if 'volume' not in entry:
+            if isinstance(region, pc.Region):
+                vol = sum(self.volume(p) for p in region)
+            elif self.cheby_ball(region)[0] <= pc.polytope.ABS_TOL:
+                vol = 0.
+            else:
+                vol = pc.volume(region)
+            entry['volume'] = vol
+        return entry['volume']
+
+    def cheby_ball(self, region):
+        """Return C{(rc, xc)} Chebyshev radius and center,
+
+        as C{pc.cheby_ball}.
+        For a C{Region} that of its largest polytope.
+        Unlike C{pc.cheby_ball}, empty results are cached too.
+        """
+        entry = self._entry(region)
+        if 'cheby' not in entry:
+            if isinstance(region, pc.Region):
+                rc, xc = 0, None
+                for p in region:
+                    r, x = self.cheby_ball(p)
+                    if r > rc:
+                        rc, xc = r, x
+            else:
+                rc, xc = pc.cheby_ball(region)
+            entry['cheby'] = (rc, xc)
+        return entry['cheby']
+
+    def bounding_box(self, region):
+        """Return C{(l, u)} bounds of C{region}, as C{pc.bounding_box}.
+        """
+        entry = self._entry(region)
+        if 'bbox' not in entry:
+            entry['bbox'] = pc.bounding_box(region)
+        return entry['bbox']
+
+    def _entry(self, region):
+        key = id(region)
+        stamp = _stamp(region)
+
+        item = self._entries.get(key)
+        if item is not None:
+            ref, old_stamp, entry = item
+            if ref() is region and old_stamp == stamp:
+                return entry
+
+        entries = self._entries
+        def forget(ref):
+            item = entries.get(key)
+            if item is not None and item[0] is ref:
+                del entries[key]
+
+        entry = dict()
+        self._entries[key] = (weakref.ref(region, forget), stamp, entry)
+        return entry
+
+def _stamp(region):
+    """Return value that changes if C{region} is replaced.
+    """
+    if isinstance(region, pc.Region):
+        return tuple(id(p) for p in region.list_poly)
+    return (id(region.A), id(region.b) )
+
+_cache = GeometryCache()
+
+def volume(region):
+    """Return volume of C{region}, using the module cache.
+
+    See L{GeometryCache.volume}.
+    """
+    return _cache.volume(region)
+
+def cheby_ball(region):
+    """Return Chebyshev radius and center, using the module cache.
+
+    See L{GeometryCache.cheby_ball}.
+    """
+    return _cache.cheby_ball(region)
+
+def bounding_box(region):
+    """Return bounding box of C{region}, using the module cache.
+
+    See L{GeometryCache.bounding_box}.
+    """
+    return _cache.bounding_box(region)
+
+def invalidate(region):
+    """Forget cached quantities of C{region}.
+    """
+    _cache.invalidate(region)
@@ -0,0 +1,314 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Registry of LP and QP solvers used by the abstraction.
+
+The backends available depend on what is installed:
+
+  - C{'cvxopt'}: the C{cvxopt} solvers
+  - C{'glpk'}: C{cvxopt} with GLPK for LPs
+  - C{'scipy'}: C{scipy.optimize.linprog} with HiGHS, LPs only
+
+A backend is selected globally with L{set_default},
+which also sets the LP solver of C{polytope},
+or per call with the C{solver} argument.
+As in C{polytope}, the default is C{'glpk'} if available.
+
+Consecutive LPs that share structure can be warm started
+with an initial point C{x0}, where the backend supports it.
+Only C{'cvxopt'} warm starts LPs, so with the default C{'glpk'}
+C{x0} is ignored, unless C{set_default('cvxopt')} is called.
+QPs are warm started by all backends.
+
+The number of calls and the time spent in each backend
+are counted, see L{stats}.
+The LPs of C{polytope} (Chebyshev balls, reduction, adjacency)
+are counted under C{'polytope'} after L{count_polytope_lps}.
+
+Primary functions:
+    - L{lp}
+    - L{qp}
+    - L{set_default}
+    - L{stats}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+
+import numpy as np
+from cvxopt import matrix, solvers
+
+try:
+    from cvxopt import glpk
+except ImportError:
+    glpk = None
+
+try:
+    from scipy.optimize import linprog
+except ImportError:
+    linprog = None
+
+class CvxoptBackend(object):
+    """LPs and QPs solved by C{cvxopt}.
+    
+    LPs are warm started only by the interior point solver,
+    so not if C{lp_solver} is C{'glpk'},
+    and only if C{x0} is strictly feasible.
+    
+    @param lp_solver: passed to C{cvxopt.solvers.lp},
+        C{None} or C{'glpk'}
+    """
+    has_qp = True
+    
+    def __init__(self, name='cvxopt', lp_solver=None):
+        self.name = name
+        self.lp_solver = lp_solver
+    
+    def lp(self, c, G, h, x0=None):
+        primalstart = None
+        if x0 is not None and self.lp_solver is None:
+            s = h - G.dot(x0)
+            if np.all(s > 0):
+                primalstart = {'x':matrix(x0), 's':matrix(s)}
+        
+        sol = solvers.lp(
+            matrix(c), matrix(G), matrix(h),
+            solver=self.lp_solver, primalstart=primalstart
+        )
+        return _result(sol['status'], sol['x'], sol['primal objective'])
+    
+    def qp(self, P, q, G, h, x0=None):
+        if x0 is not None:
+            initvals = {'x':matrix(x0)}
+        else:
+            initvals = None
+        
+        sol = solvers.qp(
+            matrix(P), matrix(q), matrix(G), matrix(h),
+            initvals=initvals
+        )
+        return _result(sol['status'], sol['x'], sol['primal objective'])
+
+class ScipyBackend(object):
+    """LPs solved by C{scipy.optimize.linprog} with HiGHS.
+    
+    HiGHS is not warm started, so C{x0} is ignored.
+    """
+    has_qp = False
+    
+    _status = {0:'optimal', 2:'primal infeasible', 3:'dual infeasible'}
+    
+    def __init__(self, name='scipy'):
+        self.name = name
+    
+    def lp(self, c, G, h, x0=None):
+        res = linprog(
+            c, A_ub=G, b_ub=h,
+            bounds=[(None, None)] * len(c),
+            method='highs'
+        )
+        status = self._status.get(res.status, 'unknown')
+        if status != 'optimal':
+            return _result(status, None, None)
+        return _result(status, res.x, res.fun)
+    
+    def qp(self, P, q, G, h, x0=None):
+        raise ValueError('backend ' + self.name + ' has no QP solver')
+
+def _result(status, x, fun):
+    """Return C{dict} with C{'status'}, C{'x'}, C{'fun'}.
+    """
+    if x is not None:
+        x = np.array(x, dtype=float).flatten()
+    return {'status':status, 'x':x, 'fun':fun}
+
+_backends = dict()
+_stats = dict()
+
+# as polytope, prefer GLPK
+if glpk is not None:
+    _default = ['glpk']
+else:
+    _default = ['cvxopt']
+
+def register(backend):
+    """Add C{backend}, which has C{name}, C{lp}, C{qp}, C{has_qp}.
+    """
+    _backends[backend.name] = backend
+
+def available():
+    """Return names of the registered backends.
+    """
+    return sorted(_backends)
+
+def get_backend(name=None):
+    """Return backend C{name}, or the default if C{None}.
+    """
+    if name is None:
+        name = _default[0]
+    try:
+        return _backends[name]
+    except KeyError:
+        raise ValueError('unknown solver: ' + str(name) +
+                         ', available: ' + str(available() ) )
+
+def set_default(name):
+    """Use backend C{name} when no solver is given.
+    
+    For C{'cvxopt'} and C{'glpk'} the LP solver
+    of C{polytope} is set to match.
+    """
+    backend = get_backend(name)
+    _default[0] = name
+    
+    if isinstance(backend, CvxoptBackend):
+        _set_polytope_lp_solver(backend.lp_solver)
+    else:
+        logger.info('polytope keeps its LP solver, ' +
+                    'it has no backend ' + str(name) )
+
+def get_default():
+    return _default[0]
+
+def lp(c, G, h, solver=None, x0=None):
+    """Solve C{min c'x s.t. G x <= h}.
+    
+    @param solver: backend name, or C{None} for the default
+    @param x0: initial point for a warm start
+    
+    @return: C{dict} with items:
+        - C{'status'}: C{'optimal'}, C{'primal infeasible'},
+          C{'dual infeasible'} or C{'unknown'}
+        - C{'x'}: solution as 1darray, or C{None}
+        - C{'fun'}: optimal value, or C{None}
+    """
+    backend = get_backend(solver)
+    
+    start = time.time()
+    sol = backend.lp(c, G, h, x0)
+    _count(backend.name, 'lp', time.time() - start)
+    return sol
+
+def qp(P, q, G, h, solver=None, x0=None):
+    """Solve C{min 1/2 x'Px + q'x s.t. G x <= h}.
+    
+    If the backend has no QP solver, then C{'cvxopt'} is used.
+    
+    @return: as L{lp}
+    """
+    backend = get_backend(solver)
+    if not backend.has_qp:
+        logger.debug(backend.name + ' has no QP solver, using cvxopt')
+        backend = get_backend('cvxopt')
+    
+    start = time.time()
+    sol = backend.qp(P, q, G, h, x0)
+    _count(backend.name, 'qp', time.time() - start)
+    return sol
+
+def stats():
+    """Return counters of calls and seconds spent, keyed by backend.
+    
+    @return: C{{name: {'lp':n_lp, 'qp':n_qp, 'time':seconds}}}
+    """
+    return {k:dict(v) for k, v in _stats.iteritems()}
+
+def reset_stats():
+    _stats.clear()
+
+def _count(name, kind, elapsed):
+    c = _stats.setdefault(name, {'lp':0, 'qp':0, 'time':0.})
+    c[kind] += 1
+    c['time'] += elapsed
+
+class _CountingSolvers(object):
+    """Stands in for C{cvxopt.solvers} inside C{polytope}.
+    """
+    def __init__(self, solvers):
+        self._solvers = solvers
+    
+    def lp(self, *args, **kwargs):
+        start = time.time()
+        sol = self._solvers.lp(*args, **kwargs)
+        _count('polytope', 'lp', time.time() - start)
+        return sol
+    
+    def __getattr__(self, name):
+        return getattr(self._solvers, name)
+
+def count_polytope_lps(enable=True):
+    """Count the LPs that C{polytope} solves, under C{'polytope'}.
+    """
+    module = _polytope_module()
+    if module is None:
+        return
+    
+    current = module.solvers
+    if enable and not isinstance(current, _CountingSolvers):
+        module.solvers = _CountingSolvers(current)
+    elif not enable and isinstance(current, _CountingSolvers):
+        module.solvers = current._solvers
+
+def _polytope_module():
+    try:
+        from polytope import polytope as module
+    except ImportError:
+        return None
+    
+    if not hasattr(module, 'solvers'):
+        logger.warn('cannot find the LP solver of polytope')
+        return None
+    return module
+
+def _set_polytope_lp_solver(lp_solver):
+    module = _polytope_module()
+    if module is None or not hasattr(module, 'lp_solver'):
+        return
+    module.lp_solver = lp_solver
+
+register(CvxoptBackend())
+
+if glpk is not None:
+    register(CvxoptBackend('glpk', 'glpk') )
+
+if linprog is not None:
+    # without presolve, which could solve the probe
+    # before the method is validated
+    try:
+        linprog([1.], A_ub=[[-1.]], b_ub=[0.],
+                bounds=[(None, None)], method='highs',
+                options={'presolve':False})
+        register(ScipyBackend() )
+    except Exception:
+        logger.debug('scipy.optimize.linprog has no HiGHS method')
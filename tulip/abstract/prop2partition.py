@@ -38,12 +38,16 @@ logger = logging.getLogger(__name__)
 
 import warnings
 import copy
+import itertools
+import multiprocessing as mp
 
 import numpy as np
 from scipy import sparse as sp
 import polytope as pc
 
 from .plot import plot_partition
+from .adjacency import BoxIndex, SetMatrix
+from . import geometry
 
 try:
     import matplotlib as mpl
@@ -53,10 +57,19 @@ except Exception, e:
 
 _hl = 40 * '-'
 
-def prop2part(state_space, cont_props_dict):
+def prop2part(state_space, cont_props_dict, n_jobs=1):
     """Main function that takes a domain (state_space) and a list of
     propositions (cont_props), and returns a proposition preserving
     partition of the state space.
+    
+    The regions are split by one proposition at a time.
+    A region whose bounding box misses that of the proposition
+    is not split, and one whose bounding box is inside
+    the proposition is labeled without splitting,
+    so neither needs LPs.
+    The adjacency is updated after each split:
+    only pieces of the same or of adjacent regions are checked,
+    and regions that were not split keep their adjacency.
 
     See Also
     ========
@@ -69,6 +82,10 @@ def prop2part(state_space, cont_props_dict):
     @param cont_props_dict: propositions
     @type cont_props_dict: dict of C{polytope.Polytope}
     
+    @param n_jobs: number of processes that split the regions,
+        -1 to use all CPUs
+    @type n_jobs: int
+    
     @return: state space quotient partition induced by propositions
     @rtype: L{PropPreservingPartition}
     """
@@ -76,63 +93,49 @@ def prop2part(state_space, cont_props_dict):
     first_poly.append(state_space)
     
     regions = [pc.Region(first_poly)]
+    adj = SetMatrix(1)
+    adj.add(0, 0)
     
-    for cur_prop in cont_props_dict:
-        cur_prop_poly = cont_props_dict[cur_prop]
-        
-        num_reg = len(regions)
-        prop_holds_reg = []
-        
-        for i in xrange(num_reg): #i region counter
-            region_now = regions[i].copy()
-            #loop for prop holds
-            prop_holds_reg.append(0)
-            
-            prop_now = regions[i].props.copy()
-            
-            dummy = region_now.intersect(cur_prop_poly)
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
+    
+    if n_jobs > 1:
+        pool = mp.Pool(n_jobs)
+    else:
+        pool = None
+    
+    try:
+        for cur_prop in cont_props_dict:
+            cur_prop_poly = cont_props_dict[cur_prop]
             
-            # does cur_prop hold in dummy ?
-            if pc.is_fulldim(dummy):
-                dum_prop = prop_now.copy()
-                dum_prop.add(cur_prop)
-                
-                # is dummy a Polytope ?
-                if len(dummy) == 0:
-                    regions[i] = pc.Region([dummy], dum_prop)
-                else:
-                    # dummy is a Region
-                    dummy.props = dum_prop.copy()
-                    regions[i] = dummy.copy()
-                prop_holds_reg[-1] = 1
+            tasks = [(region, cur_prop, cur_prop_poly) for region in regions]
+            if pool is None:
+                pieces = map(_split_region, tasks)
             else:
-                #does not hold in the whole region
-                # (-> no need for the 2nd loop)
-                regions.append(region_now)
-                continue
-                
-            #loop for prop does not hold
-            regions.append(pc.Region([], props=prop_now) )
-            dummy = region_now.diff(cur_prop_poly)
+                size = max(1, len(tasks) // (4 * n_jobs) )
+                pieces = pool.map(_split_region, tasks, chunksize=size)
             
-            if pc.is_fulldim(dummy):
-                dum_prop = prop_now.copy()
-                
-                # is dummy a Polytope ?
-                if len(dummy) == 0:
-                    regions[-1] = pc.Region([pc.reduce(dummy)], dum_prop)
-                else:
-                    # dummy is a Region
-                    dummy.props = dum_prop.copy()
-                    regions[-1] = dummy.copy()
-            else:
-                regions.pop()
-        
-        count = 0
-        for hold_count in xrange(len(prop_holds_reg)):
-            if prop_holds_reg[hold_count]==0:
-                regions.pop(hold_count-count)
-                count+=1
+            # regions where cur_prop holds come first,
+            # then those where it does not hold
+            new_regions = []
+            parents = []
+            for k, (holds, rest) in enumerate(pieces):
+                if holds is not None:
+                    new_regions.append(holds)
+                    parents.append(k)
+            for k, (holds, rest) in enumerate(pieces):
+                if rest is not None:
+                    new_regions.append(rest)
+                    parents.append(k)
+            
+            split = [holds is not None and rest is not None
+                     for holds, rest in pieces]
+            adj = _split_adjacency(new_regions, parents, split, adj)
+            regions = new_regions
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
     
     mypartition = PropPreservingPartition(
         domain = copy.deepcopy(state_space),
@@ -140,10 +143,120 @@ def prop2part(state_space, cont_props_dict):
         prop_regions = copy.deepcopy(cont_props_dict)
     )
     
-    mypartition.adj = pc.find_adjacent_regions(mypartition).copy()
+    mypartition.adj = adj.tolil(dtype=np.int8)
     
     return mypartition
 
+def _split_region(task):
+    """Split region by proposition, for L{prop2part}.
+    
+    @param task: C{(region, prop, prop_poly)}
+    
+    @return: C{(holds, rest)}, the parts of C{region}
+        where C{prop} holds and does not hold,
+        each C{None} if not full-dimensional
+    """
+    region, cur_prop, cur_prop_poly = task
+    prop_now = region.props.copy()
+    
+    dum_prop = prop_now.copy()
+    dum_prop.add(cur_prop)
+    
+    rl, ru = geometry.bounding_box(region)
+    rl = np.array(rl, dtype=float).flatten()
+    ru = np.array(ru, dtype=float).flatten()
+    
+    pl, pu = geometry.bounding_box(cur_prop_poly)
+    pl = np.array(pl, dtype=float).flatten()
+    pu = np.array(pu, dtype=float).flatten()
+    
+    # disjoint bounding boxes: does not hold
+    if np.any(ru <= pl) or np.any(pu <= rl):
+        return (None, region)
+    
+    # bounding box inside cur_prop: holds in the whole region
+    if _box_inside(rl, ru, cur_prop_poly, 0.):
+        holds = region.copy()
+        holds.props = dum_prop
+        return (holds, None)
+    
+    dummy = region.intersect(cur_prop_poly)
+    
+    # does cur_prop hold in dummy ?
+    if not pc.is_fulldim(dummy):
+        #does not hold in the whole region
+        return (None, region)
+    
+    # is dummy a Polytope ?
+    if len(dummy) == 0:
+        holds = pc.Region([dummy], dum_prop)
+    else:
+        # dummy is a Region
+        holds = dummy.copy()
+        holds.props = dum_prop.copy()
+    
+    #prop does not hold
+    dummy = region.diff(cur_prop_poly)
+    
+    if not pc.is_fulldim(dummy):
+        return (holds, None)
+    
+    # is dummy a Polytope ?
+    if len(dummy) == 0:
+        rest = pc.Region([pc.reduce(dummy)], prop_now.copy())
+    else:
+        # dummy is a Region
+        rest = dummy.copy()
+        rest.props = prop_now.copy()
+    return (holds, rest)
+
+def _split_adjacency(regions, parents, split, parent_adj):
+    """Return adjacency of C{regions}, from that of their parents.
+    
+    Pieces can be adjacent only if their parents are
+    the same or adjacent. Pieces of parents that were not split
+    are the parents, so they keep their adjacency.
+    Other pairs are checked with C{pc.is_adjacent},
+    if their bounding boxes intersect.
+    
+    @param parents: index of parent of each region
+    @param split: True for parents that were split in two
+    @type parent_adj: L{SetMatrix}
+    
+    @rtype: L{SetMatrix}
+    """
+    n = len(regions)
+    adj = SetMatrix(n)
+    boxes = BoxIndex(regions)
+    
+    children = dict()
+    for k, p in enumerate(parents):
+        children.setdefault(p, []).append(k)
+    
+    for k in xrange(n):
+        adj.add(k, k)
+    
+    for p, q in parent_adj.nonzero():
+        if p > q:
+            continue
+        
+        for k in children.get(p, []):
+            for l in children.get(q, []):
+                if k >= l and p == q:
+                    continue
+                
+                if p != q and not split[p] and not split[q]:
+                    touching = True
+                elif boxes.intersect(k, l):
+                    touching = pc.is_adjacent(regions[k], regions[l])
+                else:
+                    touching = False
+                
+                if touching:
+                    adj.add(k, l)
+                    adj.add(l, k)
+    return adj
+
 def part2convex(ppp):
     """This function takes a proposition preserving partition and generates 
     another proposition preserving partition such that each part in the new 
@@ -226,7 +339,7 @@ def pwa_partition(pwa_sys, ppp, abs_tol=1e-5):
             isect = region.intersect(subsys.domain)
             
             if pc.is_fulldim(isect):
-                rc, xc = pc.cheby_ball(isect)
+                rc, xc = geometry.cheby_ball(isect)
                 
                 if rc < abs_tol:
                     msg = 'One of the regions in the refined PPP is '
@@ -252,15 +365,16 @@ def pwa_partition(pwa_sys, ppp, abs_tol=1e-5):
     # compute spatial adjacency matrix
     n = len(new_list)
     adj = sp.lil_matrix((n, n), dtype=np.int8)
-    for i, ri in enumerate(new_list):
+    for i, j in BoxIndex(new_list).pairs():
         pi = parents[i]
-        for j, rj in enumerate(new_list[0:i]):
-            pj = parents[j]
-            
-            if (ppp.adj[pi, pj] == 1) or (pi == pj):
-                if pc.is_adjacent(ri, rj):
-                    adj[i, j] = 1
-                    adj[j, i] = 1
+        pj = parents[j]
+        
+        if (ppp.adj[pi, pj] == 1) or (pi == pj):
+            if pc.is_adjacent(new_list[i], new_list[j]):
+                adj[i, j] = 1
+                adj[j, i] = 1
+    
+    for i in xrange(n):
         adj[i, i] = 1
             
     new_ppp = PropPreservingPartition(
@@ -288,9 +402,18 @@ def add_grid(ppp, grid_size=None, num_grid_pnts=None, abs_tol=1e-10):
     
       - A L{PropPreservingPartition} object with grids
         
+    Boxes that are inside a region are kept without LPs,
+    and only boxes whose bounding box overlaps a region
+    are intersected with it.
+    Adjacency follows from the grid coordinates of the boxes,
+    so only pieces of the same or of neighboring boxes are checked.
+    
     Note: There could be numerical instabilities when the continuous 
     propositions in ppp do not align well with the grid resulting in very small 
-    regions. Performace significantly degrades without glpk.
+    regions. Performace significantly degrades without glpk:
+    select the LP solver with L{optimization.set_default}
+    and compare the time spent with L{optimization.stats},
+    after L{optimization.count_polytope_lps}.
     """
     if (grid_size!=None)&(num_grid_pnts!=None):
         raise Exception("add_grid: Only one of the grid size or number of \
@@ -341,59 +464,73 @@ def add_grid(ppp, grid_size=None, num_grid_pnts=None, abs_tol=1e-10):
             raise Exception("add_grid: "
                 "num_grid_pnts isn't given in a correct format.")
     
-    j=0
-    list_grid=dict()
-    
-    while j<dim:
-        list_grid[j] = compute_interval(
+    # grid boxes, all at once:
+    # first dimension varies slowest, as in product_interval
+    intervals = [
+        np.array(compute_interval(
             float(domain_bb[0][j]),
             float(domain_bb[1][j]),
             size_list[j],
             abs_tol
-        )
-        if j>0:
-            if j==1:
-                re_list=list_grid[j-1]
-                re_list=product_interval(re_list, list_grid[j])
-            else:
-                re_list=product_interval(re_list, list_grid[j])
-        j+=1
+        ))
+        for j in xrange(dim)
+    ]
+    shape = [len(x) for x in intervals]
+    coords = np.indices(shape).reshape(dim, -1).T
+    lower = np.column_stack([intervals[j][coords[:, j], 0]
+                             for j in xrange(dim)])
+    upper = np.column_stack([intervals[j][coords[:, j], 1]
+                             for j in xrange(dim)])
+    
+    # intersect only boxes that overlap the bounding box of a region
+    hits = np.zeros((len(lower), len(ppp.regions)), dtype=bool)
+    for j, region in enumerate(ppp.regions):
+        rl, ru = geometry.bounding_box(region)
+        rl = np.array(rl, dtype=float).flatten()
+        ru = np.array(ru, dtype=float).flatten()
         
+        hits[:, j] = (
+            np.all(lower < ru - abs_tol, axis=1) &
+            np.all(upper > rl + abs_tol, axis=1)
+        )
+    
     new_list = []
     parent = []
-    for i in xrange(len(re_list)):
-        temp_list=list()
-        j=0
-        while j<dim*2:
-            temp_list.append([re_list[i][j],re_list[i][j+1]])
-            j=j+2
-        for j in xrange(len(ppp.regions)):
-            tmp = pc.box2poly(temp_list)
-            isect = tmp.intersect(ppp.regions[j], abs_tol)
+    cell = []
+    full = []
+    for i, j in zip(*np.nonzero(hits)):
+        tmp = pc.box2poly(np.column_stack([lower[i], upper[i]]) )
+        region = ppp.regions[j]
+        
+        if _box_inside(lower[i], upper[i], region, abs_tol):
+            # no LP needed: the box is a piece of the region
+            isect = pc.Region([tmp], [])
+            is_full = True
+        else:
+            isect = tmp.intersect(region, abs_tol)
+            is_full = False
             
             #if pc.is_fulldim(isect):
-            rc, xc = pc.cheby_ball(isect)
-            if rc > abs_tol/2:
-                if rc < abs_tol:
-                    print("Warning: "
-                        "One of the regions in the refined PPP is too small"
-                        ", this may cause numerical problems")
-                if len(isect) == 0:
-                    isect = pc.Region([isect], [])
-                isect.props = ppp.regions[j].props.copy()
-                new_list.append(isect)
-                parent.append(j)   
-    
-    adj = sp.lil_matrix((len(new_list), len(new_list)), dtype=np.int8)
-    for i in xrange(len(new_list)):
-        adj[i,i] = 1
-        for j in xrange(i+1, len(new_list)):
-            if (ppp.adj[parent[i], parent[j]] == 1) or \
-                    (parent[i] == parent[j]):
-                if pc.is_adjacent(new_list[i], new_list[j]):
-                    adj[i,j] = 1
-                    adj[j,i] = 1
-            
+            rc, xc = geometry.cheby_ball(isect)
+            if rc <= abs_tol/2:
+                continue
+            if rc < abs_tol:
+                print("Warning: "
+                    "One of the regions in the refined PPP is too small"
+                    ", this may cause numerical problems")
+            if len(isect) == 0:
+                isect = pc.Region([isect], [])
+        
+        isect.props = region.props.copy()
+        new_list.append(isect)
+        parent.append(j)
+        cell.append(i)
+        full.append(is_full)
+    
+    adj = _grid_adjacency(
+        new_list, coords[cell], parent, full, ppp.adj
+    )
+    
     return PropPreservingPartition(
         domain = ppp.domain,
         regions = new_list,
@@ -401,6 +538,82 @@ def add_grid(ppp, grid_size=None, num_grid_pnts=None, abs_tol=1e-10):
         prop_regions = ppp.prop_regions
     )
 
+def _box_inside(lower, upper, region, abs_tol):
+    """Return True if the box is a subset of a polytope of C{region}.
+    
+    The maximum of each constraint over the box
+    is attained at a vertex, so is found without LPs.
+    """
+    center = (lower + upper) / 2.
+    radius = (upper - lower) / 2.
+    
+    if isinstance(region, pc.Region):
+        polys = region.list_poly
+    else:
+        polys = [region]
+    
+    for p in polys:
+        m = np.dot(p.A, center) + np.dot(np.abs(p.A), radius)
+        if np.all(m <= p.b + abs_tol):
+            return True
+    return False
+
+def _grid_adjacency(regions, coords, parent, full, parent_adj):
+    """Return adjacency of pieces of grid boxes.
+    
+    Only pieces of the same or of neighboring boxes can be adjacent.
+    Neighboring boxes touch (possibly at a corner),
+    so two pieces that are whole boxes are adjacent.
+    Other pairs are checked with C{pc.is_adjacent},
+    if their parents are the same or adjacent.
+    
+    @param coords: integer grid coordinates of the box of each piece
+    @type coords: 2d array
+    
+    @param parent: index of the region of each piece
+    @param full: True where the piece is the whole box
+    
+    @rtype: C{scipy.sparse.lil_matrix}
+    """
+    n = len(regions)
+    parent_adj = SetMatrix.from_sparse(parent_adj)
+    
+    pieces = dict()
+    for k in xrange(n):
+        pieces.setdefault(tuple(coords[k]), []).append(k)
+    
+    # half of the neighbors, so each pair is visited once
+    dim = coords.shape[1] if n > 0 else 0
+    zero = (0,) * dim
+    offsets = [o for o in itertools.product((-1, 0, 1), repeat=dim)
+               if o > zero]
+    
+    rows = range(n)
+    cols = range(n)
+    for g, ks in pieces.iteritems():
+        pairs = [(k, l) for k in ks for l in ks if k < l]
+        for o in offsets:
+            h = tuple(x + y for x, y in zip(g, o) )
+            pairs += [(k, l) for k in ks for l in pieces.get(h, [])]
+        
+        for k, l in pairs:
+            pk = parent[k]
+            pl = parent[l]
+            
+            if full[k] and full[l]:
+                touching = True
+            elif (pk == pl) or ((pk, pl) in parent_adj):
+                touching = pc.is_adjacent(regions[k], regions[l])
+            else:
+                touching = False
+            
+            if touching:
+                rows += [k, l]
+                cols += [l, k]
+    
+    data = np.ones(len(rows), dtype=np.int8)
+    return sp.coo_matrix((data, (rows, cols)), shape=(n, n)).tolil()
+
 #### Helper functions ####
 def compute_interval(low_domain, high_domain, size, abs_tol=1e-7):
     """Helper implementing intervals computation for each dimension.
@@ -0,0 +1,138 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Progress and timing events of L{discretize}.
+
+Each iteration of L{discretize} checks one pair of cells
+and reports it as an event, a C{dict} with items:
+
+  - C{'iteration'}: int, counted from 0
+  - C{'pair'}: C{[i, j]}, for the transition C{i ---> j}
+  - C{'times'}: dict of seconds spent in each step of
+    the reachability check, keyed by:
+    C{'solve_feasible'}, C{'intersect'}, C{'diff'},
+    C{'volume'}, C{'cheby_ball'}
+  - C{'outcome'}: one of
+    C{'split'}, C{'found'}, C{'unreachable'}
+  - C{'n_cells'}: number of cells after the iteration
+  - C{'n_pending'}: number of pairs still to be checked
+  - C{'elapsed'}: seconds since L{discretize} started
+
+The events contain only JSON types,
+so they can be saved with L{JsonLinesWriter}.
+
+Primary classes:
+    - L{DiscretizeStats}
+    - L{JsonLinesWriter}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+
+STEPS = ('solve_feasible', 'intersect', 'diff', 'volume', 'cheby_ball')
+OUTCOMES = ('split', 'found', 'unreachable')
+
+class DiscretizeStats(object):
+    """Totals over the events of a L{discretize} call.
+
+    Attributes:
+
+      - n_iterations: number of pairs checked
+      - outcomes: dict of {outcome: count}
+      - times: dict of {step: total seconds}
+      - elapsed: seconds from start to the last event
+      - n_cells: number of cells after the last event
+      - slowest: event with the longest reachability check
+    """
+    def __init__(self):
+        self.n_iterations = 0
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.times = dict.fromkeys(STEPS, 0.)
+        self.elapsed = 0.
+        self.n_cells = 0
+        self.slowest = None
+
+    def __str__(self):
+        s = 'Discretization statistics:\n'
+        s += '\t iterations: ' + str(self.n_iterations) + '\n'
+        s += '\t cells: ' + str(self.n_cells) + '\n'
+        s += '\t elapsed: ' + str(self.elapsed) + ' [sec]\n'
+        for outcome in OUTCOMES:
+            s += '\t ' + outcome + ': ' + str(self.outcomes[outcome]) + '\n'
+        for step in STEPS:
+            s += '\t time in ' + step + ': '
+            s += str(self.times[step]) + ' [sec]\n'
+        return s
+
+    def __call__(self, event):
+        """Add C{event} to the totals.
+        """
+        self.n_iterations += 1
+        self.outcomes[event['outcome']] += 1
+        for step, t in event['times'].iteritems():
+            self.times[step] = self.times.get(step, 0.) + t
+        self.elapsed = event['elapsed']
+        self.n_cells = event['n_cells']
+
+        if self.slowest is None or \
+           _duration(event) > _duration(self.slowest):
+            self.slowest = event
+
+def _duration(event):
+    return sum(event['times'].itervalues() )
+
+class JsonLinesWriter(object):
+    """Observer that writes each event as a line of JSON.
+
+    Pass it as C{callback} to L{discretize}.
+
+    @param f: file name, opened for appending,
+        or an open file
+    @type f: str or file
+    """
+    def __init__(self, f):
+        if isinstance(f, basestring):
+            self._file = open(f, 'a')
+            self._owned = True
+        else:
+            self._file = f
+            self._owned = False
+
+    def __call__(self, event):
+        self._file.write(json.dumps(event, sort_keys=True) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
@@ -0,0 +1,330 @@
+# Copyright (c) 2014 by California Institute of Technology
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the California Institute of Technology nor
+#    the names of its contributors may be used to endorse or promote
+#    products derived from this software without specific prior
+#    written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL CALTECH
+# OR THE CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Work queue of region pairs awaiting a reachability check.
+
+Primary classes:
+    - L{PairQueue}
+
+Ordering policies:
+    - L{index_order}
+    - L{volume_order}
+    - L{goal_order}
+
+See Also
+========
+L{discretize}
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import heapq
+import itertools
+from collections import deque, defaultdict
+
+import numpy as np
+
+from . import geometry
+
+class PairQueue(object):
+    """Set of pending (source, target) region index pairs.
+
+    Replaces the dense 0/1 matrix C{IJ}, where C{IJ[j, i] == 1}
+    meant that the transition C{i ---> j} remains to be checked.
+
+    Pairs are popped in the order defined by C{key},
+    a function C{key(i, j)} returning a sortable value;
+    smallest key is popped first.
+    If C{key} is None, then pairs are popped in insertion order (FIFO).
+
+    Pushing a pending pair again refreshes its key,
+    so policies that depend on the current regions
+    see regions that have been refined meanwhile.
+    Discarded pairs are removed lazily,
+    so both L{push} and L{discard} cost O(1),
+    and L{pop} costs O(1) amortized for FIFO
+    and O(log n) otherwise.
+    L{peek} of C{k} pairs costs O(k log k),
+    not counting stale entries ahead of them.
+
+    See Also
+    ========
+    L{index_order}, L{volume_order}, L{goal_order}
+    """
+    def __init__(self, pairs=None, key=None):
+        self.key = key
+        self._pending = dict()
+        self._by_region = defaultdict(set)
+        self._counter = itertools.count()
+
+        if key is None:
+            self._queue = deque()
+        else:
+            self._queue = []
+
+        if pairs is not None:
+            for i, j in pairs:
+                self.push(i, j)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __nonzero__(self):
+        return bool(self._pending)
+
+    def __contains__(self, pair):
+        return pair in self._pending
+
+    def __iter__(self):
+        return iter(self._pending)
+
+    def __str__(self):
+        s = 'Pending pairs (source, target):\n\t'
+        s += str(sorted(self._pending) ) + '\n'
+        return s
+
+    def pairs_of(self, i):
+        """Return pending pairs that have C{i} as source or target.
+        """
+        return set(self._by_region.get(i, () ))
+
+    def push(self, i, j):
+        """Mark transition C{i ---> j} as pending.
+        """
+        pair = (i, j)
+        self._by_region[i].add(pair)
+        self._by_region[j].add(pair)
+
+        if self.key is None:
+            if pair in self._pending:
+                return
+            stamp = next(self._counter)
+            self._pending[pair] = (stamp, stamp)
+            self._queue.append((stamp, i, j))
+            self._compact()
+            return
+
+        key = self.key(i, j)
+        if pair in self._pending and self._pending[pair][0] == key:
+            return
+
+        stamp = next(self._counter)
+        self._pending[pair] = (key, stamp)
+        heapq.heappush(self._queue, (key, stamp, i, j))
+
+        self._compact()
+
+    def discard(self, i, j):
+        """Remove C{i ---> j} from pending pairs, if present.
+        """
+        if self._pending.pop((i, j), None) is not None:
+            self._forget(i, j)
+
+    def pop(self):
+        """Remove and return next pending pair C{(i, j)}.
+
+        @raise IndexError: if no pairs are pending
+        """
+        self._drop_stale()
+        if not self._queue:
+            raise IndexError('pop from empty PairQueue')
+
+        if self.key is None:
+            entry = self._queue.popleft()
+        else:
+            entry = heapq.heappop(self._queue)
+
+        i, j = entry[-2:]
+        del self._pending[(i, j)]
+        self._forget(i, j)
+        return (i, j)
+
+    def peek(self, k=1):
+        """Return next C{k} pending pairs, in the order L{pop} would.
+
+        Unlike L{pop}, the pairs remain pending.
+
+        Only the entries ahead of the C{k}-th pair are visited:
+        in FIFO order from the front of the queue,
+        otherwise best-first down the heap.
+
+        @type k: int
+        @rtype: list of C{(i, j)}
+        """
+        if k >= len(self._pending):
+            entries = sorted(
+                (key, stamp, pair)
+                for pair, (key, stamp) in self._pending.iteritems()
+            )
+            return [pair for key, stamp, pair in entries]
+
+        self._drop_stale()
+
+        pairs = []
+        if self.key is None:
+            for entry in self._queue:
+                if len(pairs) >= k:
+                    break
+                if not self._is_stale(entry):
+                    pairs.append(entry[-2:])
+            return pairs
+
+        # children of heap entry n are 2n + 1, 2n + 2
+        heap = self._queue
+        frontier = [(heap[0], 0)]
+        while frontier and len(pairs) < k:
+            entry, n = heapq.heappop(frontier)
+            if not self._is_stale(entry):
+                pairs.append(entry[-2:])
+
+            for child in (2 * n + 1, 2 * n + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child) )
+        return pairs
+
+    def _is_stale(self, entry):
+        """Return True if queue C{entry} is discarded or re-pushed.
+        """
+        stamp, i, j = entry[-3:]
+        return self._pending.get((i, j), (None, None))[1] != stamp
+
+    def _drop_stale(self):
+        """Remove stale entries from the front of the queue.
+        """
+        while self._queue and self._is_stale(self._queue[0]):
+            if self.key is None:
+                self._queue.popleft()
+            else:
+                heapq.heappop(self._queue)
+
+    def _forget(self, i, j):
+        self._by_region[i].discard((i, j))
+        self._by_region[j].discard((i, j))
+
+    def _compact(self):
+        """Drop stale entries once they dominate the queue.
+        """
+        if len(self._queue) <= 2 * len(self._pending) + 64:
+            return
+
+        if self.key is None:
+            self._queue = deque(sorted(
+                (stamp, i, j)
+                for (i, j), (key, stamp) in self._pending.iteritems()
+            ))
+            return
+
+        self._queue = [
+            (key, stamp, i, j)
+            for (i, j), (key, stamp) in self._pending.iteritems()
+        ]
+        heapq.heapify(self._queue)
+
+def index_order(i, j):
+    """Order of a row-major scan of the dense C{IJ} matrix.
+
+    Pops the pending pair with smallest target index C{j}
+    and among those the smallest source index C{i},
+    reproducing the order of the original C{np.nonzero(IJ)} loop.
+    """
+    return (j, i)
+
+def volume_order(regions):
+    """Return key that pops pairs with largest source volume first.
+
+    @param regions: current cells, indexed as the pairs.
+        Read when a pair is pushed, so pass the
+        list that is updated during refinement.
+    @type regions: list of C{Region}
+    """
+    def key(i, j):
+        return (-geometry.volume(regions[i]), j, i)
+    return key
+
+def goal_order(regions, goal):
+    """Return key that pops pairs with target closest to C{goal} first.
+
+    Distance is measured between Chebyshev centers.
+
+    @param regions: current cells, see L{volume_order}
+    @type regions: list of C{Region}
+
+    @type goal: C{Polytope} or C{Region}
+    """
+    rg, xg = geometry.cheby_ball(goal)
+    if xg is None:
+        raise ValueError('goal_order: goal set is empty')
+    xg = np.array(xg).flatten()
+
+    def key(i, j):
+        rc, xc = geometry.cheby_ball(regions[j])
+        if xc is None:
+            dist = np.inf
+        else:
+            dist = np.linalg.norm(np.array(xc).flatten() - xg)
+        return (dist, j, i)
+    return key
+
+def pair_order(policy, regions, goal=None):
+    """Return key function for L{PairQueue} from policy name.
+
+    @param policy: one of:
+
+        - C{'index'}: order of the original dense scan (default)
+        - C{'fifo'}: first pushed, first checked
+        - C{'volume'}: largest source region first
+        - C{'goal'}: target region closest to C{goal} first
+
+        or a callable C{key(i, j)}, which is returned as is.
+
+    @param regions: see L{volume_order}
+
+    @param goal: required if C{policy == 'goal'}
+
+    @return: C{key} argument for L{PairQueue}
+    """
+    if callable(policy):
+        return policy
+
+    if policy == 'index':
+        return index_order
+    elif policy == 'fifo':
+        return None
+    elif policy == 'volume':
+        return volume_order(regions)
+    elif policy == 'goal':
+        if goal is None:
+            raise ValueError('pair_order: "goal" policy needs a goal set')
+        return goal_order(regions, goal)
+    else:
+        raise ValueError('pair_order: unknown policy: ' + str(policy))